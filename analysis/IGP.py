@@ -12,7 +12,135 @@ Created on Sat Mar 14 19:08:57 2020
 @author: Caterina Mogno c.mogno@ed.ac.uk
 """
 
-def get_IGP(data_path, shp_path):
+import os
+import json
+
+import numpy as np
+import xarray as xr
+
+from WRFChemToolkit.analysis import profiling as prf
+
+
+# IGP sub-regions: HASC_1 codes of their states.
+IGP_REGIONS = {
+    'U_IGP': ['PK.SD', 'IN.PB', 'PK.PB'],
+    'M_IGP': ['IN.DL', 'IN.HR', 'IN.UP'],
+    'L_IGP': ['IN.WB', 'IN.BR', 'BD.BA', 'BD.KH', 'BD.RS', 'BD.RP', 'BD.DH'],
+    }
+
+# in-memory cache of region-label grids, by (grid, shapefile).
+_LABELS = {}
+
+
+@prf.profiled
+def get_region_labels(ds, shp_path, cache_dir=None):
+    """
+    Return the region-label grid of the IGP states on the dataset grid: 
+    cells in the i-th state of the shapefile have label i+1, cells outside
+    all states 0. The HASC_1 code of each label is in the 'codes' attribute
+    (JSON list). The shapefile is rasterized (all states at once) only once 
+    per grid and shapefile, then it is cached in memory and, if cache_dir 
+    is given, on disk.
+
+    :param ds:
+     WRF-Chem output (opened with salem or with WRF global attributes).
+    :type ds: xarray.Dataset
+    :param shp_path:
+     path to IGP shapefiles.
+    :type shp_path: string
+    :param cache_dir:
+     directory for the on disk cache. Default no disk cache.
+    :type cache_dir: string
+    :return:
+     region labels (south_north, west_east).
+    :rtype: xarray.DataArray
+    """
+    import hashlib
+    import salem
+    
+    grid = ds.salem.grid
+    stat = os.stat(shp_path)
+    key = hashlib.sha1(json.dumps([grid.to_dict(), os.path.abspath(shp_path),
+                                   stat.st_size, stat.st_mtime], 
+                                  sort_keys=True, default=str).encode()
+                       ).hexdigest()
+    
+    if key in _LABELS:
+        return _LABELS[key]
+    
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, 'igp_labels_' + key + '.nc')
+        if os.path.exists(path):
+            with xr.open_dataarray(path) as labels:
+                _LABELS[key] = labels.load()
+            return _LABELS[key]
+    
+    import rasterio
+    from rasterio.features import rasterize
+    from salem.gis import transform_geopandas
+    
+    # rasterize all states at once on the grid (in corner coordinates, as 
+    # salem does for roi).
+    shdf = salem.read_shapefile(shp_path)
+    codes = [str(code) for code in shdf['HASC_1']]
+    shdf = transform_geopandas(shdf, to_crs=grid.corner_grid)
+    mask = np.zeros((grid.ny, grid.nx), dtype=np.int16)
+    with rasterio.Env():
+        mask = rasterize(zip(shdf.geometry, range(1, len(codes) + 1)), 
+                         out=mask)
+    
+    labels = xr.DataArray(mask, dims=('south_north', 'west_east'), 
+                          name='region', attrs={'codes': json.dumps(codes)})
+    
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        labels.to_netcdf(path + '.tmp')
+        os.replace(path + '.tmp', path)
+    
+    _LABELS[key] = labels
+    
+    return labels
+
+
+def _get_groups_(labels, states=False):
+    """
+    Labels of each IGP region (and of each state if states).
+    """
+    codes = json.loads(labels.attrs['codes'])
+    
+    groups = {'IGP': list(range(1, len(codes) + 1))}
+    for region, region_codes in IGP_REGIONS.items():
+        groups[region] = [i + 1 for i, code in enumerate(codes) 
+                          if code in region_codes]
+    if states:
+        for code in dict.fromkeys(codes):
+            groups[code] = [i + 1 for i, c in enumerate(codes) if c == code]
+    
+    return groups
+
+
+def _query_catalog_(data_path, catalog=None, time_window=None):
+    """
+    Files of the catalog matching the path and overlapping the time window
+    (as statistics.merge_ds), or the path itself without catalog.
+    """
+    if catalog is None:
+        return data_path
+    
+    from WRFChemToolkit.analysis import catalog as cat
+    start, end = time_window if time_window is not None else (None, None)
+    paths = cat.query_files(catalog, start, end, pattern=data_path)
+    if not paths:
+        raise ValueError('No files of catalog %s match %s between %s and '
+                         '%s.' % (catalog, data_path, start, end))
+    
+    return paths
+
+
+@prf.profiled
+def get_IGP(data_path, shp_path, catalog=None, time_window=None, 
+            states=False, cache_dir=None):
     """
      Return only data in IGP adminsitrative domains (based on masking process). 
      Return type is a dictionary containing WRF-Chem outputs datasets with keys:
@@ -22,7 +150,7 @@ def get_IGP(data_path, shp_path):
      - M_IGP : data for states Haryana, Delhi NCT, Uttar Pradesh (IND).
      - L_IGP : data for states Bihar, West Bengal (IND), Barisal, 
        Dhaka, Khulna, Rajshahi, Rangpur (BGD).
-     - Single states subsets (TO DO)."
+     - Single states subsets, keys HASC_1 codes (with states=True).
     
     WARNING: this division of IGP is arbitrary, given that there is no 
              official IGP administrative domain. 
@@ -34,51 +162,137 @@ def get_IGP(data_path, shp_path):
     :param shp_path:
      path to IGP shapefiles.
     :type shp_path: string
+    :param catalog:
+     path to the catalog of the data files (see catalog.update_catalog),
+     to open only the files overlapping time_window. Default no catalog.
+    :type catalog: string
+    :param time_window:
+     (start, end) times of the files to open. Default all times.
+    :type time_window: tuple
+    :param states:
+     add single states subsets. Default False.
+    :type states: bool
+    :param cache_dir:
+     directory for the on disk cache of the region labels (see 
+     get_region_labels). Default no disk cache.
+    :type cache_dir: string
     :return:
     dictionary of xarray.Dataset.
   :rtype: dict
  """
     
+    data_path = _query_catalog_(data_path, catalog, time_window)
+    
     import salem
 
     igp_data={} # dictionary for containing datasets.
-
     
     ds = salem.open_mf_wrf_dataset(data_path) # open data with salem.
     
-    # get IGP states shapefiles.
-    shdf= salem.read_shapefile(shp_path) # IGP shp.
-    shdf_UIGP = shdf.loc[
-                      (shdf['HASC_1'] == 'PK.SD')
-                    | (shdf['HASC_1'] == 'IN.PB')
-                    | (shdf['HASC_1'] == 'PK.PB')
-                    ]
-    shdf_MIGP = shdf.loc[
-                      (shdf['HASC_1'] == 'IN.DL')
-                    |  (shdf['HASC_1'] == 'IN.HR')
-                    | (shdf['HASC_1'] == 'IN.UP')
-                    ]
-    shdf_LIGP = shdf.loc[
-                      (shdf['HASC_1'] == 'IN.WB')
-                    | (shdf['HASC_1'] == 'IN.BR')
-                    | (shdf['HASC_1'] == 'BD.BA')
-                    | (shdf['HASC_1'] == 'BD.KH')
-                    | (shdf['HASC_1'] == 'BD.RS')
-                    | (shdf['HASC_1'] == 'BD.RP')
-                    |  (shdf['HASC_1'] == 'BD.DH')
-                    ]
+    # get IGP states labels on the grid (rasterized once and cached).
+    labels = get_region_labels(ds, shp_path, cache_dir)
     
     # Get data subsets.
-    IGP = ds.salem.roi(shape=shdf)   
-    UIGP = ds.salem.roi(shape=shdf_UIGP)
-    MIGP = ds.salem.roi(shape=shdf_MIGP)
-    LIGP = ds.salem.roi(shape=shdf_LIGP)
-    
-    # Add to list.
-    igp_data.update({'IGP': IGP})
-    igp_data.update({'U_IGP': UIGP})
-    igp_data.update({'M_IGP': MIGP})
-    igp_data.update({'L_IGP': LIGP})
+    for region, ids in _get_groups_(labels, states).items():
+        igp_data.update({region: ds.salem.roi(roi=np.isin(labels.values, 
+                                                          ids))})
     
 
     return igp_data
+
+
+@prf.profiled
+def regional_reduce(ds, labels, how='mean', states=True):
+    """
+    Regional means (or sums) of all the variables for IGP, U_IGP, M_IGP, 
+    L_IGP and (optionally) each state, computed in one grouped pass over the
+    data: sums and counts by state label, then combined for each region.
+
+    :param ds:
+     dataset on the grid of labels (e.g. from aerosols_202.get_aerosols).
+    :type ds: xarray.Dataset
+    :param labels:
+     region labels (see get_region_labels).
+    :type labels: xarray.DataArray
+    :param how:
+     'mean' or 'sum'. Default 'mean'.
+    :type how: string
+    :param states:
+     add single states, with HASC_1 codes as region names. Default True.
+    :type states: bool
+    :return:
+     dataset with 'region' dimension (IGP, U_IGP, M_IGP, L_IGP, states).
+    :rtype: xarray.Dataset
+    """
+    
+    names = [var for var in ds.data_vars 
+             if set(labels.dims) <= set(ds[var].dims) 
+             and np.issubdtype(ds[var].dtype, np.number)]
+    data = ds[names].drop_vars([c for c in ds.coords 
+                                if set(labels.dims) & set(ds[c].dims)])
+    labels = labels.rename('region')
+    
+    # single grouped pass by state label.
+    sums = data.groupby(labels).sum(skipna=True)
+    counts = data.notnull().groupby(labels).sum()
+    
+    present = set(sums['region'].values)
+    out = []
+    groups = _get_groups_(labels, states)
+    for region, ids in groups.items():
+        ids = [i for i in ids if i in present]
+        region_sum = sums.sel(region=ids).sum(dim='region')
+        if how == 'mean':
+            count = counts.sel(region=ids).sum(dim='region')
+            out.append(region_sum / count.where(count > 0))
+        else:
+            out.append(region_sum)
+    
+    regional = xr.concat(out, dim='region').assign_coords(region=list(groups))
+    for var in names:
+        regional[var].attrs = ds[var].attrs
+    
+    return regional
+
+
+@prf.profiled
+def get_IGP_means(data_path, shp_path, how='mean', states=True, 
+                  cache_dir=None, catalog=None, time_window=None):
+    """
+    Regional means (or sums) of WRF-Chem outputs for IGP, U_IGP, M_IGP, 
+    L_IGP and each state in one pass (see regional_reduce), instead of 
+    masking the data for each region as get_IGP.
+
+    :param data_path:
+     path to data files.
+    :type data_path: string
+    :param shp_path:
+     path to IGP shapefiles.
+    :type shp_path: string
+    :param how:
+     'mean' or 'sum'. Default 'mean'.
+    :type how: string
+    :param states:
+     add single states. Default True.
+    :type states: bool
+    :param cache_dir:
+     directory for the on disk cache of the region labels. Default none.
+    :type cache_dir: string
+    :param catalog:
+     path to the catalog of the data files. Default no catalog.
+    :type catalog: string
+    :param time_window:
+     (start, end) times of the files to open. Default all times.
+    :type time_window: tuple
+    :return:
+     dataset with 'region' dimension.
+    :rtype: xarray.Dataset
+    """
+    data_path = _query_catalog_(data_path, catalog, time_window)
+    
+    import salem
+    
+    ds = salem.open_mf_wrf_dataset(data_path)
+    labels = get_region_labels(ds, shp_path, cache_dir)
+    
+    return regional_reduce(ds, labels, how=how, states=states)
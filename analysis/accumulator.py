@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental statistics of WRF-Chem outputs for operational forecasts.
+
+StatsAccumulator keeps running count, mean, variance (Welford), min and max
+over time per grid cell and per variable. It is updated one file at a time
+(each file merged with the parallel form of Welford's update), saved to disk
+between forecast cycles and returns time_mean compatible datasets at any
+time, so that new outputs cost O(new data) instead of a full recalculation.
+"""
+
+import json
+
+import numpy as np
+import xarray as xr
+
+from WRFChemToolkit.analysis import utils as utl
+
+
+# statistics kept by the accumulator.
+STATS = ['count', 'mean', 'm2', 'min', 'max']
+
+
+class StatsAccumulator(object):
+    """
+    Running statistics over time of the variables of WRF-Chem outputs.
+
+    :param time_nm: name of the time dimension. Default 'Time'.
+    :type time_nm: string
+    :param variables: variables to accumulate. Default all the numeric
+     variables with time dimension.
+    :type variables: list of strings.
+    """
+
+    def __init__(self, time_nm='Time', variables=None):
+
+        self.time_nm = time_nm
+        self.variables = variables
+        self.files = []   # files already accumulated.
+        self.stats = None # dict of Datasets, one for each of STATS.
+        self.coords = None
+        self.attrs = {}
+        self.dtypes = {}
+
+    def update(self, ds):
+        """
+        Add the time steps of a dataset to the statistics.
+
+        :param ds: WRF-Chem output (e.g. a single file).
+        :type ds: xarray DataSet.
+        """
+        t = self.time_nm
+
+        names = self.variables
+        if names is None:
+            names = [var for var in ds.data_vars if t in ds[var].dims
+                     and np.issubdtype(ds[var].dtype, np.number)]
+        x = xr.Dataset({var: ds[var] for var in names}).astype('float64')
+
+        # statistics of the new data.
+        n_b = x.count(dim=t)
+        mean_b = (x.sum(dim=t, skipna=True) / n_b.where(n_b > 0)).fillna(0)
+        m2_b = ((x - mean_b)**2).sum(dim=t, skipna=True)
+        new = dict(count=n_b, mean=mean_b, m2=m2_b,
+                   min=x.min(dim=t, skipna=True),
+                   max=x.max(dim=t, skipna=True))
+        new = {stat: value.load() for stat, value in new.items()}
+
+        if self.stats is None:
+            self.stats = new
+            self.coords = {nm: c.load() for nm, c in ds.coords.items()}
+            self.attrs = {var: dict(ds[var].attrs) for var in names}
+            self.dtypes = {var: str(ds[var].dtype) for var in names}
+            return
+
+        # coords along time concatenated (layout of time_mean of all data).
+        for nm, c in self.coords.items():
+            if t in c.dims and nm in ds.coords:
+                self.coords[nm] = xr.concat([c, ds.coords[nm].load()],
+                                            dim=t)
+
+        # merge with the running statistics (Chan et al. parallel Welford).
+        n_a, mean_a, m2_a = (self.stats['count'], self.stats['mean'],
+                             self.stats['m2'])
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        self.stats['mean'] = mean_a + delta * (n_b / n.where(n > 0)).fillna(0)
+        self.stats['m2'] = (m2_a + m2_b + delta**2
+                            * (n_a * n_b / n.where(n > 0)).fillna(0))
+        self.stats['count'] = n
+        self.stats['min'] = np.fmin(self.stats['min'], new['min'])
+        self.stats['max'] = np.fmax(self.stats['max'], new['max'])
+
+    def update_file(self, path):
+        """
+        Add the time steps of a file to the statistics. Files already
+        accumulated are skipped.
+
+        :param path: path to the WRF-Chem output file.
+        :type path: string
+        :return: True if the file was added.
+        :rtype: bool
+        """
+        import os
+
+        path = os.path.abspath(path)
+        if path in self.files:
+            return False
+
+        drop = None
+        if self.variables is not None:
+            drop = utl._get_drop_list_([path], self.variables)
+
+        with xr.open_dataset(path, drop_variables=drop) as ds:
+            self.update(ds)
+        self.files.append(path)
+
+        return True
+
+    def _finalize_(self, values, keep_dtype=False):
+        """
+        Dataset with time_mean layout (dtypes, attrs, coords) from values:
+        float as time_mean (float32 kept, integers to float64), or the
+        dtype of the input (e.g. min and max).
+        """
+        ds = xr.Dataset(coords=self.coords)
+        for var in values.data_vars:
+            dtype = np.dtype(self.dtypes[var])
+            if not keep_dtype and not np.issubdtype(dtype, np.floating):
+                dtype = np.float64
+            ds[var] = values[var].astype(dtype)
+            ds[var].attrs = self.attrs[var]
+
+        return ds
+
+    def time_mean(self):
+        """
+        Time average of the accumulated data, as statistics.time_mean.
+
+        :return: Time averaged dataset.
+        :rtype: xarray DataSet.
+        """
+        count = self.stats['count']
+
+        return self._finalize_(self.stats['mean'].where(count > 0))
+
+    def variance(self, ddof=1):
+        """
+        Variance over time of the accumulated data.
+
+        :param ddof: delta degrees of freedom. Default 1 (sample variance).
+        :type ddof: integer
+        :return: variance dataset.
+        :rtype: xarray DataSet.
+        """
+        count = self.stats['count']
+
+        return self._finalize_(self.stats['m2']
+                               / (count - ddof).where(count > ddof))
+
+    def std(self, ddof=1):
+        """
+        Standard deviation over time of the accumulated data.
+
+        :param ddof: delta degrees of freedom. Default 1.
+        :type ddof: integer
+        :return: standard deviation dataset.
+        :rtype: xarray DataSet.
+        """
+        return np.sqrt(self.variance(ddof))
+
+    def minimum(self):
+        """
+        Minimum over time of the accumulated data.
+        """
+        return self._finalize_(self.stats['min'], keep_dtype=True)
+
+    def maximum(self):
+        """
+        Maximum over time of the accumulated data.
+        """
+        return self._finalize_(self.stats['max'], keep_dtype=True)
+
+    def count(self):
+        """
+        Number of valid values over time of the accumulated data.
+        """
+        return xr.Dataset(dict(self.stats['count'].data_vars),
+                          coords=self.coords)
+
+    def save(self, path):
+        """
+        Save the accumulator to a netCDF file.
+
+        :param path: path to the file.
+        :type path: string
+        """
+        out = xr.Dataset(coords=self.coords)
+        for stat in STATS:
+            for var in self.stats[stat].data_vars:
+                out[stat + '__' + var] = self.stats[stat][var]
+
+        out.attrs['time_nm'] = self.time_nm
+        out.attrs['variables'] = json.dumps(self.variables)
+        out.attrs['files'] = json.dumps(self.files)
+        out.attrs['var_attrs'] = json.dumps(self.attrs, default=str)
+        out.attrs['dtypes'] = json.dumps(self.dtypes)
+
+        out.to_netcdf(path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an accumulator saved with save.
+
+        :param path: path to the file.
+        :type path: string
+        :return: accumulator.
+        :rtype: StatsAccumulator
+        """
+        with xr.open_dataset(path) as ds:
+            ds = ds.load()
+
+        acc = cls(ds.attrs['time_nm'], json.loads(ds.attrs['variables']))
+        acc.files = json.loads(ds.attrs['files'])
+        acc.attrs = json.loads(ds.attrs['var_attrs'])
+        acc.dtypes = json.loads(ds.attrs['dtypes'])
+        acc.coords = {nm: c for nm, c in ds.coords.items()}
+        acc.stats = {}
+        for stat in STATS:
+            names = [nm for nm in ds.data_vars if nm.startswith(stat + '__')]
+            acc.stats[stat] = xr.Dataset(
+                {nm[len(stat) + 2:]: ds[nm].reset_coords(drop=True)
+                 for nm in names})
+
+        return acc
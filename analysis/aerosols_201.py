@@ -8,9 +8,61 @@ Created on Wed Jan  8 10:45:57 2020
 @author: Caterina Mogno - c.mogno@ed.ac.uk
 """
 
+from WRFChemToolkit.analysis import profiling as prf
 from WRFChemToolkit.analysis import utils as utl
 
 
+#list of relevant aerosols variables for pm2.5.
+AEROSOLS = [
+    'so4_a01','so4_a02', 'so4_a03', 'so4_a04', # sulfate.
+    'no3_a01','no3_a02', 'no3_a03', 'no3_a04', # nitrate.
+    'nh4_a01','nh4_a02', 'nh4_a03', 'nh4_a04', # ammonium.
+    'bc_a01','bc_a02', 'bc_a03', 'bc_a04', # black carbon.
+    'oc_a01','oc_a02', 'oc_a03', 'oc_a04', # organic carbon (POA).
+    'smpa_a01','smpa_a02', 'smpa_a03', 'smpa_a04', # anthro SOA.
+    'smpbb_a01','smpbb_a02', 'smpbb_a03', 'smpbb_a04', # biomass burning SOA.
+    'biog1_o_a01','biog1_o_a02', 'biog1_o_a03', 'biog1_o_a04', # biogenic SOA (isporene).
+    'biog1_c_a01','biog1_c_a02', 'biog1_c_a03', 'biog1_c_a04', # biogenic SOA (pinenes).       
+    'glysoa_sfc_a01','glysoa_sfc_a02', 'glysoa_sfc_a03', 'glysoa_sfc_a04',  # glyoxal SOA.      
+    'oin_a01','oin_a02', 'oin_a03', 'oin_a04', # dust.
+    'na_a01','na_a02', 'na_a03', 'na_a04', # seasalt (sodium).
+    'cl_a01','cl_a02', 'cl_a03', 'cl_a04', # seasalt (cloride).
+    'PM2_5_DRY', # dry pm2.5 (prognostic variable).
+    'water_a01','water_a02', 'water_a03', 'water_a04', # wet pm2.5 component.
+    'num_a01','num_a02', 'num_a03', 'num_a04', # pm2.5 density number.
+    'ALT' #inverse density.
+    ]
+
+
+# List of aerosol species contributing to PM25. According to WRF-Chem code 
+# in module_mosaic_sumpm.F subroutine sum_pm_mosaic_vbs0.
+SPECIES = ['so4','nh4','no3','biog1_o','biog1_c','smpbb','smpa',
+           'glysoa_sfc','oc', 'bc', 'oin','na','cl']
+
+# PM2.5 components: species summed up in each component.
+COMPONENTS = {
+    'SOA': ['biog1_o','biog1_c','smpbb','smpa','glysoa_sfc'], 
+    'SIA': ['so4','nh4','no3'],
+    'POA': ['oc'],
+    'seasalt': ['na','cl'],
+    'dust': ['oin'],
+    }
+
+
+def get_variables():
+    """
+    Return the list of WRF-Chem output variables needed by get_aerosols, 
+    e.g. to open only those with statistics.merge_ds(data_path, variables).
+
+    :return: variables names.
+    :rtype: list of strings.
+    
+    """
+    
+    return list(AEROSOLS)
+
+
+@prf.profiled
 def calculate_pm25_species_3bins(ds):
     
     """
@@ -23,25 +75,14 @@ def calculate_pm25_species_3bins(ds):
     
     """
     
-    # List of aerosol species contributing to PM25. According to WRF-Chem code 
-    # in module_mosaic_sumpm.F subroutine sum_pm_mosaic_vbs0.
-    
-    species = ['so4','nh4','no3','biog1_o','biog1_c','smpbb','smpa',
-               'glysoa_sfc','oc', 'bc', 'oin','na','cl']
-    
-    conversion = ds['ALT'] # inverse densitiy.
-    
     # Calculating contributions: summing up the first 3 bins 
-    # (diameter < 2.5 um) for each species.
-    for species in species:
-      ds['pm25_'+ species] = utl._sum_(ds[species + '_a01'],
-                              ds[species + '_a02'],
-                              ds[species + '_a03']
-                              )/conversion
-      ds['pm25_'+ species].attrs['units']= 'ug m-3'
+    # (diameter < 2.5 um) of each species in a single pass, dividing once by
+    # the inverse density ALT (see utils.sum_bins).
+    utl.sum_bins(ds, SPECIES, {'pm25': 3}, conversion='ALT')
       
 
 
+@prf.profiled
 def calculate_total_pm25(ds):
     """
     Add to dataset the calculated pm2.5 in ug m-3. Should be equal to the 
@@ -76,6 +117,7 @@ def calculate_total_pm25(ds):
     
 
 
+@prf.profiled
 def calculate_pm25_components(ds):
     
     """
@@ -118,46 +160,53 @@ def calculate_pm25_components(ds):
     
     
 
-def get_aerosols(ds):
+@prf.profiled
+def get_aerosols(ds, variables=None, dtype=None, memory_budget=None,
+                 levels=None):
     
     """
     This function creates a dataset with all the pm2.5 useful data from 
     the WRF-Chem output.
     
+    If variables, dtype or memory_budget are given, only the requested 
+    derived variables are returned, computed from their inputs only (see 
+    derived.compute): raw inputs are dropped, outputs can be stored as 
+    float32 and the data can be processed in time chunks within a memory 
+    budget. If levels are given (e.g. 0 for surface PM), only those 
+    bottom_top levels are read and processed.
+    
     :param ds: WRF-chem output.
     :type ds: xarray DataSet.
+    :param variables: derived variables to return, e.g. ['pm25_tot']. 
+     Default all.
+    :type variables: list of strings.
+    :param dtype: dtype of the outputs, e.g. 'float32'. Default as computed.
+    :type dtype: string
+    :param memory_budget: memory budget in bytes. Default no budget.
+    :type memory_budget: integer
+    :param levels: bottom_top levels (see utils.select_levels). 
+     Default all.
+    :type levels: integer, list of integers or slice.
     :return: Reduced dataset with pm25 data.
     :rtype: xarray DataSet.
     
     """
     
-    #list of relevant aerosols variables for pm2.5.
-    aerosols = [
-        'so4_a01','so4_a02', 'so4_a03', 'so4_a04', # sulfate.
-        'no3_a01','no3_a02', 'no3_a03', 'no3_a04', # nitrate.
-        'nh4_a01','nh4_a02', 'nh4_a03', 'nh4_a04', # ammonium.
-        'bc_a01','bc_a02', 'bc_a03', 'bc_a04', # black carbon.
-        'oc_a01','oc_a02', 'oc_a03', 'oc_a04', # organic carbon (POA).
-        'smpa_a01','smpa_a02', 'smpa_a03', 'smpa_a04', # anthro SOA.
-        'smpbb_a01','smpbb_a02', 'smpbb_a03', 'smpbb_a04', # biomass burning SOA.
-        'biog1_o_a01','biog1_o_a02', 'biog1_o_a03', 'biog1_o_a04', # biogenic SOA (isporene).
-        'biog1_c_a01','biog1_c_a02', 'biog1_c_a03', 'biog1_c_a04', # biogenic SOA (pinenes).       
-        'glysoa_sfc_a01','glysoa_sfc_a02', 'glysoa_sfc_a03', 'glysoa_sfc_a04',  # glyoxal SOA.      
-        'oin_a01','oin_a02', 'oin_a03', 'oin_a04', # dust.
-        'na_a01','na_a02', 'na_a03', 'na_a04', # seasalt (sodium).
-        'cl_a01','cl_a02', 'cl_a03', 'cl_a04', # seasalt (cloride).
-        'PM2_5_DRY', # dry pm2.5 (prognostic variable).
-        'water_a01','water_a02', 'water_a03', 'water_a04', # wet pm2.5 component.
-        'num_a01','num_a02', 'num_a03', 'num_a04', # pm2.5 density number.
-        'ALT' #inverse density.
-        ]
-    
-    ds_aer = utl._get_data_subset_(ds,aerosols)
-    calculate_pm25_species_3bins(ds_aer)
-    calculate_total_pm25(ds_aer)
-    calculate_pm25_components(ds_aer)
-    
-    return ds_aer
+    ds = utl.select_levels(ds, levels)
+    
+    if variables is not None or dtype is not None or memory_budget is not None:
+        from WRFChemToolkit.analysis import derived
+        if variables is None:
+            variables = list(derived.get_registry(201))
+        return derived.compute(ds, variables, 201, dtype=dtype, 
+                               memory_budget=memory_budget)
+    
+    # species, components and total from the aerosol table (see 
+    # mechanisms), as calculate_pm25_species_3bins, calculate_total_pm25 
+    # and calculate_pm25_components.
+    from WRFChemToolkit.analysis import mechanisms as mch
+    
+    return mch.get_mechanism(201).get_aerosols(ds)
     
 
     
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-disk cache (NetCDF4) of derived aerosols datasets.
+
+Cache entries are keyed by the identity of the source files (path, size,
+mtime or content hash), chem_opt and the version of the derivation code
+(hash of the aerosols and utils modules source), so that changing any of
+them gives a new entry. Least recently used entries are evicted when the
+cache exceeds a size budget, except entries open in datasets returned by
+get_aerosols (in this process) and the entry just written, so the cache
+can exceed the budget while they are in use.
+"""
+
+import os
+import json
+import hashlib
+import weakref
+
+import xarray as xr
+
+from WRFChemToolkit.analysis import utils as utl
+from WRFChemToolkit.analysis import writer as wrt
+
+
+# bump to invalidate all the entries if the cache layout changes.
+CACHE_VERSION = 1
+
+# weak references to the datasets returned by get_aerosols, by entry path.
+_OPEN = {}
+
+
+def _get_module_(chem_opt):
+    """
+    Return the aerosols module for chem_opt, or its mechanism (see
+    mechanisms) for chem_opt with an aerosol table only.
+    """
+    from WRFChemToolkit.analysis import aerosols_201, aerosols_202
+    from WRFChemToolkit.analysis import mechanisms as mch
+
+    modules = {201: aerosols_201, 202: aerosols_202}
+    if int(chem_opt) not in modules:
+        return mch.get_mechanism(chem_opt)
+
+    return modules[int(chem_opt)]
+
+
+def _code_version_(module):
+    """
+    Version of the derivation code: hash of the source of the aerosols
+    module (or aerosol table), mechanisms and utils.
+    """
+    from WRFChemToolkit.analysis import mechanisms as mch
+
+    sha = hashlib.sha1()
+    sources = [module, mch, utl]
+    if isinstance(module, mch.Mechanism):
+        sha.update(repr(mch._TABLES[module.chem_opt]).encode())
+        sources = [mch, utl]
+    for mod in sources:
+        with open(mod.__file__, 'rb') as f:
+            sha.update(f.read())
+
+    return sha.hexdigest()
+
+
+def get_key(data_path, chem_opt, identity='stat', levels=None):
+    """
+    Cache key of the derived aerosols of the data files.
+
+    :param data_path: path to data files.
+    :type data_path: string or list of strings.
+    :param chem_opt: WRF-Chem chem_opt of the data (201, 202).
+    :type chem_opt: integer
+    :param identity: identify files by 'stat' (size and mtime) or 'hash'
+     (content). Default 'stat'.
+    :type identity: string
+    :param levels: bottom_top levels of the derived aerosols. Default all.
+    :type levels: integer, list of integers or slice.
+    :return: cache key.
+    :rtype: string
+    """
+    content = dict(version=CACHE_VERSION,
+                   chem_opt=int(chem_opt),
+                   code=_code_version_(_get_module_(chem_opt)),
+                   files=[utl.get_file_identity(p, identity)
+                          for p in utl._get_paths_(data_path)])
+    if levels is not None:
+        content['levels'] = repr(levels)
+
+    return hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
+
+def evict(cache_dir, max_size, keep=None):
+    """
+    Remove the least recently used cache entries until the cache size is
+    below max_size. Entries in keep and entries open in datasets returned
+    by get_aerosols are not removed.
+
+    :param cache_dir: cache directory.
+    :type cache_dir: string
+    :param max_size: size budget in bytes.
+    :type max_size: integer
+    :param keep: entries (paths) not to remove. Default None.
+    :type keep: list of strings.
+    :return: removed files.
+    :rtype: list of strings.
+    """
+    entries = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir)
+               if f.endswith('.nc')]
+    entries.sort(key=os.path.getmtime) # oldest used first.
+    size = sum(os.path.getsize(f) for f in entries)
+    keep = {os.path.abspath(f) for f in keep or []} | _in_use_()
+
+    removed = []
+    for f in entries:
+        if size <= max_size:
+            break
+        if os.path.abspath(f) in keep:
+            continue
+        size = size - os.path.getsize(f)
+        os.remove(f)
+        removed.append(f)
+
+    return removed
+
+
+def _open_(path):
+    """
+    Open a cache entry, marked as in use (not evicted) while the dataset
+    is referenced.
+    """
+    ds = xr.open_dataset(path)
+    _OPEN.setdefault(os.path.abspath(path), []).append(weakref.ref(ds))
+
+    return ds
+
+
+def _in_use_():
+    """
+    Paths of the cache entries open in referenced datasets.
+    """
+    for path in list(_OPEN):
+        _OPEN[path] = [ref for ref in _OPEN[path] if ref() is not None]
+        if not _OPEN[path]:
+            del _OPEN[path]
+
+    return set(_OPEN)
+
+
+def get_aerosols(data_path, chem_opt, cache_dir, max_size=None,
+                 identity='stat', levels=None):
+    """
+    Return the aerosols dataset (see aerosols_201/202.get_aerosols) of the
+    data files, from the cache if the files, chem_opt and derivation code
+    are unchanged, otherwise calculated and stored in the cache.
+
+    :param data_path: path to data files.
+    :type data_path: string or list of strings.
+    :param chem_opt: WRF-Chem chem_opt of the data (201, 202).
+    :type chem_opt: integer
+    :param cache_dir: cache directory.
+    :type cache_dir: string
+    :param max_size: cache size budget in bytes (entries in use are kept,
+     see evict). Default no limit.
+    :type max_size: integer
+    :param identity: identify files by 'stat' (size and mtime) or 'hash'
+     (content). Default 'stat'.
+    :type identity: string
+    :param levels: bottom_top levels to read (see utils.select_levels).
+     Default all.
+    :type levels: integer, list of integers or slice.
+    :return: Reduced dataset with pm data.
+    :rtype: xarray DataSet.
+    """
+    from WRFChemToolkit.analysis import statistics as st
+
+    os.makedirs(cache_dir, exist_ok=True)
+    key = get_key(data_path, chem_opt, identity, levels)
+    path = os.path.join(cache_dir, key + '.nc')
+
+    if os.path.exists(path):
+        os.utime(path) # mark as recently used.
+        return _open_(path)
+
+    module = _get_module_(chem_opt)
+    ds = st.merge_ds(data_path, variables=module.get_variables(),
+                     levels=levels)
+    ds_aer = module.get_aerosols(ds)
+
+    # written through a temporary file, so that no partial entry is left.
+    wrt.write(ds_aer, path, complevel=1)
+
+    ds_aer = _open_(path)
+    if max_size is not None:
+        evict(cache_dir, max_size, keep=[path])
+
+    return ds_aer
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent catalog (SQLite) of WRF-Chem output files, for opening only the
+files overlapping a time window instead of globbing a whole archive.
+
+For each file the catalog records domain, Times range, grid shape, chem_opt
+and the variables inventory. Files are re-read only if their size or
+modification time changed.
+"""
+
+import os
+import re
+import sqlite3
+import fnmatch
+
+from WRFChemToolkit.analysis import utils as utl
+
+
+# WRF Times format.
+TIME_FMT = '%Y-%m-%d_%H:%M:%S'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    domain TEXT,
+    start TEXT,
+    end TEXT,
+    n_times INTEGER,
+    bottom_top INTEGER,
+    south_north INTEGER,
+    west_east INTEGER,
+    chem_opt INTEGER
+);
+CREATE TABLE IF NOT EXISTS variables (
+    path TEXT,
+    name TEXT,
+    PRIMARY KEY (path, name)
+);
+CREATE INDEX IF NOT EXISTS files_time ON files (start, end);
+"""
+
+
+def _connect_(db_path):
+    """
+    Open the catalog database (created if not existing).
+    """
+    con = sqlite3.connect(db_path)
+    con.executescript(_SCHEMA)
+
+    return con
+
+
+def _format_time_(time):
+    """
+    Convert a time (string, datetime, numpy.datetime64) to WRF Times format,
+    that sorts as string.
+    """
+    import pandas as pd
+
+    if isinstance(time, bytes):
+        time = time.decode()
+    if isinstance(time, str):
+        time = time.replace('_', ' ')
+
+    return pd.Timestamp(time).strftime(TIME_FMT)
+
+
+def _read_header_(path):
+    """
+    Read the catalog record of a WRF-Chem output file from its header and
+    Times variable.
+    """
+
+    try:
+        import netCDF4
+        with netCDF4.Dataset(path) as nc:
+            times = [str(t) for t in netCDF4.chartostring(
+                                             nc.variables['Times'][:])]
+            dims = {name: len(dim) for name, dim in nc.dimensions.items()}
+            attrs = {name: nc.getncattr(name) for name in nc.ncattrs()}
+            names = list(nc.variables)
+    except ImportError:
+        import xarray as xr
+        with xr.open_dataset(path, decode_times=False) as ds:
+            times = [t.decode() if isinstance(t, bytes) else str(t)
+                     for t in ds['Times'].values]
+            dims = dict(ds.sizes)
+            attrs = dict(ds.attrs)
+            names = list(ds.variables)
+
+    if 'GRID_ID' in attrs:
+        domain = 'd%02d' % int(attrs['GRID_ID'])
+    else:
+        match = re.search(r'_(d\d\d)_', os.path.basename(path))
+        domain = match.group(1) if match else None
+
+    chem_opt = attrs.get('CHEM_OPT')
+
+    record = dict(domain=domain,
+                  start=_format_time_(min(times)),
+                  end=_format_time_(max(times)),
+                  n_times=len(times),
+                  bottom_top=dims.get('bottom_top'),
+                  south_north=dims.get('south_north'),
+                  west_east=dims.get('west_east'),
+                  chem_opt=None if chem_opt is None else int(chem_opt))
+
+    return record, names
+
+
+def update_catalog(db_path, data_path):
+    """
+    Add to the catalog the files linked in the path (syntax as in
+    statistics.merge_ds, e.g. /mydir/wrfout_d01_2010-*). Only new or
+    modified files are read; entries of deleted files are removed.
+
+    :param db_path: path to the catalog (SQLite file).
+    :type db_path: string
+    :param data_path: path to data files.
+    :type data_path: string or list of strings.
+    :return: number of files (re)indexed.
+    :rtype: integer
+    """
+
+    con = _connect_(db_path)
+    known = {row[0]: row[1:] for row in
+             con.execute('SELECT path, size, mtime FROM files')}
+    n = 0
+
+    with con:
+        # remove deleted files.
+        for path in known:
+            if not os.path.exists(path):
+                con.execute('DELETE FROM files WHERE path = ?', (path,))
+                con.execute('DELETE FROM variables WHERE path = ?', (path,))
+
+        for path in utl._get_paths_(data_path):
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            if known.get(path) == (stat.st_size, stat.st_mtime):
+                continue
+
+            record, names = _read_header_(path)
+            record.update(path=path, size=stat.st_size, mtime=stat.st_mtime)
+
+            con.execute('INSERT OR REPLACE INTO files (%s) VALUES (%s)'
+                        % (', '.join(record), ', '.join('?' * len(record))),
+                        tuple(record.values()))
+            con.execute('DELETE FROM variables WHERE path = ?', (path,))
+            con.executemany('INSERT INTO variables VALUES (?, ?)',
+                            [(path, name) for name in names])
+            n = n + 1
+
+    con.close()
+
+    return n
+
+
+def query_files(db_path, start=None, end=None, pattern=None, domain=None,
+                chem_opt=None, variables=None):
+    """
+    Return the cataloged files overlapping the time window [start, end],
+    sorted by time.
+
+    :param db_path: path to the catalog (SQLite file).
+    :type db_path: string
+    :param start: start of the time window. Default no limit.
+    :type start: string, datetime or numpy.datetime64.
+    :param end: end of the time window. Default no limit.
+    :type end: string, datetime or numpy.datetime64.
+    :param pattern: only files matching this path (with wildcards) or list
+     of paths. Default all.
+    :type pattern: string or list of strings.
+    :param domain: only files of this domain (e.g. 'd01'). Default all.
+    :type domain: string
+    :param chem_opt: only files with this chem_opt. Default all.
+    :type chem_opt: integer
+    :param variables: only files containing all these variables. Default all.
+    :type variables: list of strings.
+    :return: paths of the files.
+    :rtype: list of strings.
+    """
+
+    query = 'SELECT path FROM files WHERE 1'
+    args = []
+
+    if start is not None:
+        query = query + ' AND end >= ?'
+        args.append(_format_time_(start))
+    if end is not None:
+        query = query + ' AND start <= ?'
+        args.append(_format_time_(end))
+    if domain is not None:
+        query = query + ' AND domain = ?'
+        args.append(domain)
+    if chem_opt is not None:
+        query = query + ' AND chem_opt = ?'
+        args.append(int(chem_opt))
+    if variables:
+        query = query + (' AND (SELECT COUNT(*) FROM variables v WHERE '
+                         'v.path = files.path AND v.name IN (%s)) = ?'
+                         % ', '.join('?' * len(set(variables))))
+        args.extend(set(variables))
+        args.append(len(set(variables)))
+
+    con = _connect_(db_path)
+    paths = [row[0] for row in
+             con.execute(query + ' ORDER BY start, path', args)]
+    con.close()
+
+    if isinstance(pattern, str):
+        pattern = os.path.abspath(pattern)
+        paths = [p for p in paths if fnmatch.fnmatch(p, pattern)]
+    elif pattern is not None:
+        selected = set(os.path.abspath(p) for p in pattern)
+        paths = [p for p in paths if p in selected]
+
+    return paths
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command line batch pipeline over WRF-Chem outputs.
+
+The files are grouped in tasks (one per file or per day) processed by a
+pool of workers. For each task the products are:
+
+ - aerosols: aerosols dataset (merge_ds and get_aerosols), netCDF.
+ - igp: regional means of the aerosols for IGP, U_IGP, M_IGP, L_IGP and
+   states (get_region_labels and regional_reduce), netCDF.
+ - maps: maps (map_2D) of the time average of the aerosols variables.
+
+Completed products are checkpointed in a state file (state.json) in the
+output directory, with the identity (size, mtime) of their input files and
+a hash of the options they depend on (see PRODUCT_OPTIONS), so that an
+interrupted job run again resumes where it stopped: only products missing,
+failed, with modified inputs or with other options are processed.
+
+Usage:
+    python -m WRFChemToolkit.analysis.cli '/mydir/wrfout_d01_2010-04-*' \\
+        --chem-opt 202 --products aerosols igp maps --out-dir out \\
+        --shp IGP.shp --workers 4
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+
+from WRFChemToolkit.analysis import utils as utl
+from WRFChemToolkit.analysis import cache
+from WRFChemToolkit.analysis import mechanisms as mch
+from WRFChemToolkit.analysis import profiling as prf
+from WRFChemToolkit.analysis import writer as wrt
+
+
+PRODUCTS = ['aerosols', 'igp', 'maps']
+
+# options the outputs of each product depend on.
+PRODUCT_OPTIONS = {
+    'aerosols': ['chem_opt', 'levels'],
+    'igp': ['chem_opt', 'levels', 'shp_path'],
+    'maps': ['chem_opt', 'levels', 'map_vars', 'format', 'dpi',
+             'coastline', 'borders'],
+    }
+
+# name of the checkpoint file in the output directory.
+STATE_FILE = 'state.json'
+
+
+def get_tasks(data_path, group='file'):
+    """
+    Group the data files in tasks.
+
+    :param data_path: path to data files (with wildcards) or list of paths.
+    :type data_path: string or list of strings.
+    :param group: 'file' (a task for each file) or 'day' (a task for the
+     files of each day, from the WRF file names). Default 'file'.
+    :type group: string
+    :return: task name -> paths of the files.
+    :rtype: dict
+    """
+    tasks = {}
+    for path in utl._get_paths_(data_path):
+        name = os.path.basename(path)
+        if group == 'day':
+            match = re.search(r'(d\d\d)_(\d{4}-\d\d-\d\d)', name)
+            if match:
+                name = match.group(1) + '_' + match.group(2)
+        tasks.setdefault(name.replace(':', '-'), []).append(
+            os.path.abspath(path))
+
+    return tasks
+
+
+def load_state(out_dir):
+    """
+    Load the checkpoint state of an output directory.
+
+    :param out_dir: output directory.
+    :type out_dir: string
+    :return: task name -> product -> dict(inputs, options, outputs) or
+     dict(inputs, options, error).
+    :rtype: dict
+    """
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_state_(out_dir, state):
+    """
+    Write the checkpoint state (atomically).
+    """
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def _get_identity_(paths):
+    """
+    Identity (path, size, mtime) of the input files.
+    """
+    return [utl.get_file_identity(path) for path in paths]
+
+
+def _get_options_key_(options, product):
+    """
+    Hash of the options the outputs of a product depend on.
+    """
+    content = {opt: options[opt] for opt in PRODUCT_OPTIONS[product]}
+
+    return hashlib.sha1(json.dumps(content, sort_keys=True,
+                                   default=repr).encode()).hexdigest()
+
+
+def _is_done_(entry, paths, options, product):
+    """
+    True if the product of a task was completed with the same inputs and
+    options and its outputs exist.
+    """
+    return (entry is not None and 'outputs' in entry
+            and entry['inputs'] == _get_identity_(paths)
+            and entry.get('options') == _get_options_key_(options, product)
+            and all(os.path.exists(p) for p in entry['outputs']))
+
+
+def _run_task_(task):
+    """
+    Process the products of a task. Return product -> outputs paths or
+    error message.
+    """
+    import xarray as xr
+
+    from WRFChemToolkit.analysis import statistics as st
+
+    name, paths, products, options = task
+    out_dir = options['out_dir']
+    module = cache._get_module_(options['chem_opt'])
+    results = {}
+
+    ds, ds_aer = None, None
+    aer_path = os.path.join(out_dir, 'aerosols', 'aerosols_%s.nc' % name)
+
+    def _get_data_():
+        nonlocal ds, ds_aer
+        if ds is None:
+            ds = st.merge_ds(paths, variables=module.get_variables(),
+                             levels=options['levels'])
+            if options['aerosols_done'] and 'aerosols' not in products:
+                ds_aer = xr.open_dataset(aer_path)
+            else:
+                ds_aer = module.get_aerosols(ds)
+        return ds, ds_aer
+
+    for product in products:
+        try:
+            with prf.stage('cli.' + product, task=name):
+                os.makedirs(os.path.join(out_dir, product), exist_ok=True)
+
+                if product == 'aerosols':
+                    wrt.write(_get_data_()[1], aer_path)
+                    outputs = [aer_path]
+
+                elif product == 'igp':
+                    from WRFChemToolkit.analysis import IGP
+
+                    ds, ds_aer = _get_data_()
+                    labels = IGP.get_region_labels(ds, options['shp_path'],
+                                                   options['cache_dir'])
+                    out = os.path.join(out_dir, 'igp', 'igp_%s.nc' % name)
+                    wrt.write(IGP.regional_reduce(ds_aer, labels), out,
+                              preset='timeseries')
+                    outputs = [out]
+
+                elif product == 'maps':
+                    outputs = _make_maps_(_get_data_()[1], name, options)
+
+            results[product] = dict(outputs=outputs)
+        except Exception as err:
+            results[product] = dict(error=repr(err))
+
+    return name, results
+
+
+def _make_maps_(ds_aer, name, options):
+    """
+    Maps of the time average of the aerosols variables of a task.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import xarray as xr
+
+    from WRFChemToolkit.analysis import plots
+
+    tavg = ds_aer[options['map_vars']].mean(dim='Time', keep_attrs=True)
+    tavg = xr.Dataset(dict(tavg.data_vars), coords=dict(ds_aer.coords))
+
+    outputs = []
+    for var in options['map_vars']:
+        save = os.path.join(options['out_dir'], 'maps', '%s_%s' % (var, name))
+        plots.map_2D(tavg, var, title='%s %s' % (var, name),
+                     coastline=options['coastline'],
+                     borders=options['borders'], save=save,
+                     format=options['format'], dpi=options['dpi'])
+        plt.close('all')
+        outputs.append(save + '.' + options['format'])
+
+    return outputs
+
+
+def run(data_path, chem_opt, products, out_dir, shp_path=None, workers=1,
+        group='file', map_vars=None, format='png', dpi=150, coastline=True,
+        borders=True, cache_dir=None, levels=None, restart=False):
+    """
+    Run the pipeline, resuming from the checkpoint state of out_dir.
+
+    :param data_path: path to data files (with wildcards) or list of paths.
+    :type data_path: string or list of strings.
+    :param chem_opt: WRF-Chem chem_opt of the data (see
+     mechanisms.get_chem_opts).
+    :type chem_opt: integer
+    :param products: products to make (see PRODUCTS).
+    :type products: list of strings.
+    :param out_dir: output directory.
+    :type out_dir: string
+    :param shp_path: path to IGP shapefiles (for 'igp'). Default None.
+    :type shp_path: string
+    :param workers: number of processes (started with spawn, so scripts
+     calling run need an if __name__ == '__main__' guard). Default 1 (no
+     pool).
+    :type workers: integer
+    :param group: group files by 'file' or 'day'. Default 'file'.
+    :type group: string
+    :param map_vars: variables to map. Default the total PM2.5 of chem_opt
+     (e.g. ['pm25_tot'] for 202, ['pm25_calc'] for 201).
+    :type map_vars: list of strings.
+    :param format: format of the maps. Default 'png'.
+    :type format: string
+    :param dpi: resolution of the maps. Default 150.
+    :type dpi: integer
+    :param coastline: plot coastline in maps. Default True.
+    :type coastline: bool
+    :param borders: plot borders in maps. Default True.
+    :type borders: bool
+    :param cache_dir: directory for the on disk cache of the IGP labels.
+     Default None.
+    :type cache_dir: string
+    :param levels: bottom_top levels to read (e.g. [0] for surface
+     products). Default all.
+    :type levels: list of integers.
+    :param restart: ignore the checkpoint state. Default False.
+    :type restart: bool
+    :return: checkpoint state.
+    :rtype: dict
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    unknown = set(products) - set(PRODUCTS)
+    if unknown:
+        raise ValueError('Unknown products %s.' % sorted(unknown))
+    if 'igp' in products and shp_path is None:
+        raise ValueError("Product 'igp' needs shp_path.")
+
+    if map_vars is None:
+        map_vars = mch.get_mechanism(chem_opt).totals[:1]
+
+    os.makedirs(out_dir, exist_ok=True)
+    state = {} if restart else load_state(out_dir)
+    options = dict(chem_opt=int(chem_opt), out_dir=out_dir,
+                   shp_path=shp_path, cache_dir=cache_dir,
+                   map_vars=list(map_vars), format=format, dpi=dpi,
+                   coastline=coastline, borders=borders, levels=levels)
+
+    # products still to do for each task (the aerosols file is reused if
+    # it is done with the same options).
+    todo = []
+    for name, paths in get_tasks(data_path, group).items():
+        done = {p: _is_done_(state.get(name, {}).get(p), paths, options, p)
+                for p in PRODUCTS}
+        missing = [p for p in PRODUCTS if p in products and not done[p]]
+        if missing:
+            todo.append((name, paths, missing,
+                         dict(options, aerosols_done=done['aerosols'])))
+
+    print('%d tasks to process (%d already done).'
+          % (len(todo), len(get_tasks(data_path, group)) - len(todo)))
+
+    if workers == 1:
+        _save_results_(map(_run_task_, todo), todo, options, state, out_dir)
+    else:
+        # spawn: forked workers can hang on the netCDF/HDF5 and dask state
+        # of the parent (e.g. files opened before run).
+        # profiling (e.g. --profile) is enabled in the workers too.
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=prf.init_worker,
+                                 initargs=(prf.get_config(),)) as pool:
+            _save_results_(pool.map(_run_task_, todo), todo, options, state,
+                           out_dir)
+
+    return state
+
+
+def _save_results_(results, todo, options, state, out_dir):
+    """
+    Checkpoint the results of the tasks as they complete.
+    """
+    paths = {task[0]: task[1] for task in todo}
+    for name, task_results in results:
+        for product, entry in task_results.items():
+            entry['inputs'] = _get_identity_(paths[name])
+            entry['options'] = _get_options_key_(options, product)
+            state.setdefault(name, {})[product] = entry
+            if 'error' in entry:
+                print('%s %s failed: %s' % (name, product, entry['error']))
+        _save_state_(out_dir, state) # checkpoint after each task.
+        print('%s done.' % name)
+
+
+def main(argv=None):
+    """
+    Command line entry point. Return 1 if any product failed.
+    """
+    parser = argparse.ArgumentParser(
+        description='Batch processing of WRF-Chem outputs.')
+    parser.add_argument('data_path', nargs='+',
+                        help='data files (paths or quoted wildcard path).')
+    parser.add_argument('--chem-opt', type=int, required=True,
+                        choices=mch.get_chem_opts())
+    parser.add_argument('--products', nargs='+', default=['aerosols'],
+                        choices=PRODUCTS)
+    parser.add_argument('--out-dir', required=True)
+    parser.add_argument('--shp', default=None, help='IGP shapefile.')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--group', default='file', choices=['file', 'day'])
+    parser.add_argument('--map-vars', nargs='+', default=None)
+    parser.add_argument('--format', default='png')
+    parser.add_argument('--dpi', type=int, default=150)
+    parser.add_argument('--no-coastline', action='store_true')
+    parser.add_argument('--no-borders', action='store_true')
+    parser.add_argument('--cache-dir', default=None)
+    parser.add_argument('--levels', type=int, nargs='+', default=None,
+                        help='bottom_top levels to read (e.g. 0).')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore the checkpoint state.')
+    parser.add_argument('--profile', default=None,
+                        help='write profiling records (JSON lines).')
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        prf.enable(args.profile)
+
+    data_path = args.data_path
+    if len(data_path) == 1:
+        data_path = data_path[0]
+
+    state = run(data_path, args.chem_opt, args.products, args.out_dir,
+                shp_path=args.shp, workers=args.workers, group=args.group,
+                map_vars=args.map_vars, format=args.format, dpi=args.dpi,
+                coastline=not args.no_coastline,
+                borders=not args.no_borders, cache_dir=args.cache_dir,
+                levels=args.levels, restart=args.restart)
+
+    failed = [(name, product) for name, entries in state.items()
+              for product, entry in entries.items() if 'error' in entry]
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lazy derived variables of WRF-Chem outputs (pm25_SOA, pm10_SIA, pm25_tot..).
+
+Each derived variable is registered, for a chem_opt, with its inputs (raw
+WRF-Chem variables or other derived variables) and the function computing it.
+Requesting a variable computes and reads only its transitive dependencies,
+each once (memoized), without any ordering precondition: e.g. pm25_SIA only
+needs the so4, nh4, no3 bins and ALT. The variables of each chem_opt with
+an aerosol table (see mechanisms) are registered from the table.
+"""
+
+import xarray as xr
+
+from WRFChemToolkit.analysis import utils as utl
+
+
+# derived variables for each chem_opt: name -> (inputs, function, units).
+_REGISTRY = {}
+
+# variables registered from the aerosol tables, by chem_opt.
+_FROM_TABLE = {}
+
+
+def register(chem_opt, name, inputs, func, units='ug m-3'):
+    """
+    Register a derived variable. An input with the same name of the
+    variable refers to the raw WRF-Chem variable (e.g. condensable vapours
+    converted in place).
+
+    :param chem_opt: WRF-Chem chem_opt.
+    :type chem_opt: integer
+    :param name: name of the derived variable.
+    :type name: string
+    :param inputs: names of the input variables.
+    :type inputs: list of strings.
+    :param func: function of the input DataArrays (in the order of inputs).
+    :type func: function
+    :param units: units of the derived variable. Default 'ug m-3'.
+    :type units: string
+    """
+    _REGISTRY.setdefault(int(chem_opt), {})[name] = (list(inputs), func, units)
+
+
+def get_registry(chem_opt):
+    """
+    Return the derived variables of a chem_opt (name -> (inputs, function,
+    units)).
+
+    :param chem_opt: WRF-Chem chem_opt.
+    :type chem_opt: integer
+    :return: registry.
+    :rtype: dict
+    """
+    if int(chem_opt) not in _FROM_TABLE:
+        _register_mechanism_(int(chem_opt))
+    if int(chem_opt) not in _REGISTRY:
+        raise ValueError('chem_opt %s not supported.' % chem_opt)
+
+    return _REGISTRY[int(chem_opt)]
+
+
+def get_dependencies(chem_opt, names):
+    """
+    Return the raw WRF-Chem variables needed to compute the variables.
+
+    :param chem_opt: WRF-Chem chem_opt.
+    :type chem_opt: integer
+    :param names: names of derived (or raw) variables.
+    :type names: list of strings.
+    :return: names of the raw variables.
+    :rtype: list of strings.
+    """
+    registry = get_registry(chem_opt)
+    raw = {}
+    visited = set()
+
+    def _visit_(name, parent=None):
+        if name not in registry or name == parent:
+            raw[name] = None
+            return
+        if name in visited:
+            return
+        visited.add(name)
+        for inp in registry[name][0]:
+            _visit_(inp, name)
+
+    for name in names:
+        _visit_(name)
+
+    return list(raw)
+
+
+class DerivedDataset(object):
+    """
+    Lazy view of a WRF-Chem output with the derived variables of its
+    chem_opt: ds[name] computes (once) only what name depends on.
+
+    :param ds: WRF-Chem output.
+    :type ds: xarray DataSet.
+    :param chem_opt: WRF-Chem chem_opt.
+    :type chem_opt: integer
+    """
+
+    def __init__(self, ds, chem_opt):
+
+        self.ds = ds
+        self.chem_opt = int(chem_opt)
+        self.registry = get_registry(chem_opt)
+        self._memo = {}
+
+    def __getitem__(self, name):
+
+        return self._get_(name)
+
+    def __contains__(self, name):
+
+        return name in self.registry or name in self.ds
+
+    def _get_(self, name, parent=None):
+
+        if name not in self.registry or name == parent:
+            return self.ds[name]
+
+        if name not in self._memo:
+            inputs, func, units = self.registry[name]
+            var = func(*[self._get_(inp, name) for inp in inputs])
+            var.attrs['units'] = units
+            self._memo[name] = var.rename(name)
+
+        return self._memo[name]
+
+    def get(self, names):
+        """
+        Dataset of the requested (derived or raw) variables.
+
+        :param names: variables names.
+        :type names: list of strings.
+        :return: dataset with the variables (and coordinates of ds).
+        :rtype: xarray DataSet.
+        """
+        out = xr.Dataset(coords=dict(self.ds.coords))
+        for name in names:
+            out[name] = self[name]
+
+        return out
+
+
+def get_derived(ds, names, chem_opt):
+    """
+    Return a dataset with only the requested derived variables, computing
+    (and reading) only their dependencies.
+
+    :param ds: WRF-Chem output.
+    :type ds: xarray DataSet.
+    :param names: derived variables names, e.g. ['pm25_SIA', 'pm25_tot'].
+    :type names: list of strings.
+    :param chem_opt: WRF-Chem chem_opt.
+    :type chem_opt: integer
+    :return: dataset with the requested variables.
+    :rtype: xarray DataSet.
+    """
+    return DerivedDataset(ds, chem_opt).get(names)
+
+
+def _get_nodes_(chem_opt, names):
+    """
+    Derived variables computed (memoized) to get names.
+    """
+    registry = get_registry(chem_opt)
+    nodes = set()
+
+    def _visit_(name, parent=None):
+        if name in registry and name != parent and name not in nodes:
+            nodes.add(name)
+            for inp in registry[name][0]:
+                _visit_(inp, name)
+
+    for name in names:
+        _visit_(name)
+
+    return nodes
+
+
+def compute(ds, names, chem_opt, dtype=None, memory_budget=None,
+            time_nm='Time'):
+    """
+    Compute only the requested derived variables, reading only their raw
+    inputs and (optionally) casting the results, e.g. to float32. With a
+    memory budget, the data is processed in chunks of time steps so that
+    inputs and intermediates of a chunk fit in the budget; inputs and
+    intermediates of each chunk are dropped once the outputs are computed.
+
+    :param ds: WRF-Chem output.
+    :type ds: xarray DataSet.
+    :param names: derived variables names.
+    :type names: list of strings.
+    :param chem_opt: WRF-Chem chem_opt.
+    :type chem_opt: integer
+    :param dtype: dtype of the outputs (e.g. 'float32'). Default as computed.
+    :type dtype: string
+    :param memory_budget: memory budget in bytes. Default no chunking.
+    :type memory_budget: integer
+    :param time_nm: name of the time dimension. Default 'Time'.
+    :type time_nm: string
+    :return: dataset with the requested variables (in memory if
+     memory_budget).
+    :rtype: xarray DataSet.
+    """
+    raw = [name for name in get_dependencies(chem_opt, names) if name in ds]
+    ds = xr.Dataset({name: ds[name] for name in raw},
+                    coords=dict(ds.coords))
+
+    def _compute_(sub):
+        out = DerivedDataset(sub, chem_opt).get(names)
+        if dtype is not None:
+            for name in names:
+                out[name] = out[name].astype(dtype, keep_attrs=True)
+        return out
+
+    if memory_budget is None or time_nm not in ds.dims:
+        return _compute_(ds)
+
+    # working set of one time step: raw inputs and memoized intermediates.
+    n_steps = ds.sizes[time_nm]
+    field = max(ds[name].nbytes for name in raw) / n_steps
+    per_step = field * (len(raw) + len(_get_nodes_(chem_opt, names)))
+    step = max(1, int(memory_budget // per_step))
+
+    chunks = []
+    for i in range(0, n_steps, step):
+        chunks.append(_compute_(ds.isel({time_nm: slice(i, i + step)})
+                                ).load())
+
+    return xr.concat(chunks, dim=time_nm, data_vars='minimal',
+                     coords='minimal', compat='override')
+
+
+def _bin_sum_(*args):
+    """
+    Sum of the bins (all but last argument) divided by ALT (last argument).
+    """
+    return utl._sum_(*args[:-1]) / args[-1]
+
+
+def _forget_(chem_opt):
+    """
+    Remove the variables registered from the aerosol table of chem_opt
+    (registered again from the new table when needed).
+    """
+    for name in _FROM_TABLE.pop(int(chem_opt), []):
+        _REGISTRY.get(int(chem_opt), {}).pop(name, None)
+
+
+def _register_mechanism_(chem_opt):
+    """
+    Register the derived variables of the aerosol table of chem_opt (see 
+    mechanisms.register_mechanism): species, components and totals for 
+    each cutoff and converted condensable vapours. Variables registered 
+    before are not replaced.
+    """
+    from WRFChemToolkit.analysis import mechanisms as mch
+
+    if chem_opt not in mch.get_chem_opts():
+        return
+    mech = mch.get_mechanism(chem_opt)
+
+    registry = _REGISTRY.setdefault(chem_opt, {})
+    names = _FROM_TABLE.setdefault(chem_opt, [])
+
+    def _add_(name, inputs, func):
+        if name not in registry:
+            register(chem_opt, name, inputs, func)
+            names.append(name)
+
+    for prefix, nbins in sorted(mech.cutoffs.items(), key=lambda c: c[1]):
+        for sp in mech.species:
+            _add_(prefix + '_' + sp, [mch._bin_var_(sp, b) 
+                                      for b in range(1, nbins + 1)]
+                  + [mech.conversion], _bin_sum_)
+        outputs = list(mech.components.items())
+        outputs.append((mech.total_name, mech.total))
+        for out, inputs in outputs:
+            _add_(prefix + '_' + out, [prefix + '_' + i for i in inputs],
+                  utl._sum_)
+
+    # condensable vapours converted in place (only conversion is needed).
+    for cv in mech.cond_vap:
+        _add_(cv, [cv, mech.conversion], mech._get_cv_func_())
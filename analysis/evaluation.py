@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Evaluation of WRF-Chem outputs against observations at stations.
+
+Model and observations are (time, station) series of one or more species
+(e.g. pm25_tot from stations.extract_stations and the measured PM2.5).
+The statistics (bias, NMB, NME, RMSE, correlation and index of agreement)
+are computed from sums over time (or over time windows) of the paired
+values and of their deviations from the window means, for all stations,
+species and windows at once: no per-station loops or pandas frames.
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from WRFChemToolkit.analysis import profiling as prf
+
+
+# evaluation statistics.
+STATS = ['n', 'mean_obs', 'mean_mod', 'bias', 'nmb', 'nme', 'rmse', 'r',
+         'ioa']
+
+
+def align(model, obs, time_nm='Time', obs_time_nm=None, tolerance=None):
+    """
+    Align model and observations on times and stations (common times and
+    stations, common variables). Model times are taken from XTIME if
+    there is no time_nm coordinate (WRF-Chem outputs).
+
+    :param model: model series (time, station).
+    :type model: xarray.Dataset
+    :param obs: observed series (time, station), same variable names.
+    :type obs: xarray.Dataset
+    :param time_nm: name of the model time dimension. Default 'Time'.
+    :type time_nm: string
+    :param obs_time_nm: name of the obs time dimension. Default time_nm.
+    :type obs_time_nm: string
+    :param tolerance: match each model time to the nearest obs time
+     within tolerance (e.g. '30min') instead of exact times. Default None.
+    :type tolerance: string
+    :return: aligned model and obs.
+    :rtype: tuple of xarray.Dataset
+    """
+    if time_nm not in model.indexes and 'XTIME' in model.coords:
+        model = model.assign_coords({time_nm: model['XTIME'].values})
+    if obs_time_nm is not None and obs_time_nm != time_nm:
+        obs = obs.rename({obs_time_nm: time_nm})
+
+    names = [var for var in model.data_vars if var in obs.data_vars]
+    model, obs = model[names], obs[names]
+
+    if tolerance is not None:
+        obs = obs.sel({time_nm: model[time_nm].values}, method='nearest',
+                      tolerance=pd.Timedelta(tolerance))
+        obs = obs.assign_coords({time_nm: model[time_nm].values})
+
+    return xr.align(model, obs, join='inner')
+
+
+def _reduce_(x, time_nm, window, pooled):
+    """
+    Sum over time (or time windows, labelled by their start) and, if
+    pooled, stations.
+    """
+    if window is None:
+        x = x.sum(dim=time_nm)
+    else:
+        x = x.resample({time_nm: window}, closed='left', label='left').sum()
+    if pooled:
+        x = x.sum(dim='station')
+
+    return x
+
+
+@prf.profiled
+def evaluate(model, obs, time_nm='Time', window=None, pooled=False,
+             aligned=False, tolerance=None):
+    """
+    Evaluation statistics of model vs observations, for all the variables
+    and stations at once. Only pairs with both values valid are used.
+
+     - n: number of valid pairs.
+     - mean_obs, mean_mod: mean observed and modelled values.
+     - bias: mean(M - O).
+     - nmb: normalised mean bias, sum(M - O) / sum(O).
+     - nme: normalised mean error, sum(|M - O|) / sum(O).
+     - rmse: root mean square error.
+     - r: Pearson correlation.
+     - ioa: index of agreement (Willmott, 1981).
+
+    :param model: model series (time, station).
+    :type model: xarray.Dataset
+    :param obs: observed series (time, station), same variable names.
+    :type obs: xarray.Dataset
+    :param time_nm: name of the time dimension. Default 'Time'.
+    :type time_nm: string
+    :param window: statistics over time windows (pandas frequency, e.g.
+     'D', 'MS'). Default None (whole period).
+    :type window: string
+    :param pooled: statistics of all stations pooled together. Default
+     False (each station).
+    :type pooled: bool
+    :param aligned: model and obs are already aligned (see align).
+     Default False.
+    :type aligned: bool
+    :param tolerance: time tolerance of the alignment (see align).
+     Default None (exact times).
+    :type tolerance: string
+    :return: statistics of each variable, dims ('stat', [time_nm],
+     ['station']), stat coords as STATS.
+    :rtype: xarray.Dataset
+    """
+    if not aligned:
+        model, obs = align(model, obs, time_nm, tolerance=tolerance)
+
+    valid = model.notnull() & obs.notnull()
+    m = model.astype('float64').where(valid)
+    o = obs.astype('float64').where(valid)
+
+    # sums of the paired values.
+    n = _reduce_(valid.astype('float64'), time_nm, window, pooled)
+    so = _reduce_(o, time_nm, window, pooled)
+    sm = _reduce_(m, time_nm, window, pooled)
+    sad = _reduce_(abs(m - o), time_nm, window, pooled)
+    sse = _reduce_((m - o)**2, time_nm, window, pooled)
+
+    n = n.where(n > 0)
+    mean_o, mean_m = so / n, sm / n
+
+    # second pass on the values centred on the means of each window (no
+    # cancellation of large sums of squares when the model is close to the
+    # observations), window labels are their start times.
+    obar, mbar = mean_o, mean_m
+    if window is not None:
+        obar = obar.reindex({time_nm: m[time_nm]}, method='ffill')
+        mbar = mbar.reindex({time_nm: m[time_nm]}, method='ffill')
+    do, dm = o - obar, m - mbar
+    soo = _reduce_(do**2, time_nm, window, pooled)
+    smm = _reduce_(dm**2, time_nm, window, pooled)
+    som = _reduce_(do * dm, time_nm, window, pooled)
+    # potential error of the index of agreement.
+    pot = _reduce_((abs(m - obar) + abs(do))**2, time_nm, window, pooled)
+
+    stats = dict(n=n.fillna(0), mean_obs=mean_o, mean_mod=mean_m,
+                 bias=mean_m - mean_o, nmb=(sm - so) / so, nme=sad / so,
+                 rmse=np.sqrt(sse / n),
+                 r=som / np.sqrt(soo.where(soo > 0) * smm.where(smm > 0)),
+                 ioa=1 - sse / pot.where(pot > 0))
+
+    out = xr.concat([stats[stat] for stat in STATS],
+                    dim=pd.Index(STATS, name='stat'))
+    for var in out.data_vars:
+        out[var].attrs = dict(model[var].attrs)
+
+    return out
+
+
+@prf.profiled
+def evaluate_files(data_path, obs, lats, lons, chem_opt=202,
+                   variables=('pm25_tot',), names=None, level=0,
+                   method='nearest', **kwargs):
+    """
+    Evaluate derived aerosols variables of WRF-Chem output files against
+    observations. Files are processed one at a time (open, get_aerosols
+    of the variables only at one level, extract_stations), so that memory
+    is bounded by a single file and the (time, station) series.
+
+    :param data_path: path to data files.
+    :type data_path: string or list of strings.
+    :param obs: observed series (time, station).
+    :type obs: xarray.Dataset
+    :param lats: latitude of the stations.
+    :type lats: list or array of floats.
+    :param lons: longitude of the stations.
+    :type lons: list or array of floats.
+    :param chem_opt: WRF-Chem chem_opt of the data (201, 202).
+     Default 202.
+    :type chem_opt: integer
+    :param variables: derived variables to evaluate. Default pm25_tot.
+    :type variables: list of strings.
+    :param names: names of the stations, as the obs station coords.
+     Default 0, 1, ...
+    :type names: list of strings.
+    :param level: bottom_top level. Default 0 (surface).
+    :type level: integer
+    :param method: station extraction, 'nearest' or 'bilinear'.
+     Default 'nearest'.
+    :type method: string
+    :param kwargs: other arguments of evaluate (time_nm, window, pooled,
+     tolerance).
+    :return: statistics (see evaluate).
+    :rtype: xarray.Dataset
+    """
+    from WRFChemToolkit.analysis import cache
+    from WRFChemToolkit.analysis import stations as stn
+    from WRFChemToolkit.analysis import utils as utl
+
+    module = cache._get_module_(chem_opt)
+
+    series = []
+    for path in utl._get_paths_(data_path):
+        drop = utl._get_drop_list_([path], module.get_variables())
+        with xr.open_dataset(path, drop_variables=drop) as ds:
+            ds_aer = module.get_aerosols(ds, variables=list(variables),
+                                        levels=level)
+            points = stn.extract_stations(ds_aer, lats, lons, names,
+                                          list(variables), method)
+            if 'bottom_top' in points.dims:
+                points = points.isel(bottom_top=0, drop=True)
+            series.append(points.load())
+
+    time_nm = kwargs.get('time_nm', 'Time')
+    model = xr.concat(series, dim=time_nm)
+
+    return evaluate(model, obs, **kwargs)
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Aerosol tables of WRF-Chem chem_opt (mechanisms) and the shared engine
+calculating PM from them.
+
+A table declares the aerosol species summed up in PM (and those excluded
+from the dry PM, e.g. water), the number of size bins, the cutoffs
+(bins summed up in each PM size, e.g. {'pm25': 3, 'pm10': 4}), the
+components (species summed up in SOA, SIA, POA, sea salt, dust..), the
+total and the condensable vapours. From the table a Mechanism builds
+once (per chem_opt) a plan of fused steps:
+
+ - size-bin sums of each species, one fused sum per PM size
+   (utils.sum_bins),
+ - single-pass sums of components and totals (utils.fused_sum),
+ - conversion of the condensable vapours,
+
+which is used by get_aerosols of any chem_opt, and registers the same
+variables for lazy computation (see derived). Supporting a new mechanism
+only needs register_mechanism with its table.
+"""
+
+from WRFChemToolkit.analysis import profiling as prf
+from WRFChemToolkit.analysis import utils as utl
+
+
+# tables of the mechanisms, by chem_opt.
+_TABLES = {}
+
+# mechanisms (with their plan), built once by chem_opt.
+_MECHANISMS = {}
+
+# default tables registered (see _register_defaults_).
+_DEFAULTS = []
+
+# MOSAIC species without VBS SOA, as in WRF-Chem module_mosaic_sumpm.F
+# subroutine sum_pm_mosaic.
+MOSAIC_SPECIES = ['so4', 'no3', 'cl', 'nh4', 'na', 'oin', 'oc', 'bc']
+
+MOSAIC_COMPONENTS = {
+    'SIA': ['so4', 'nh4', 'no3'], # Secondary Inorganic Aerosols.
+    'POA': ['oc'], # Primary Organic Aerosols.
+    'sea': ['na', 'cl'], # Seasalt.
+    'dust': ['oin'],
+    }
+
+
+def _bin_var_(species, b):
+    """
+    Name of the size bin b of an aerosol species (e.g. so4_a01).
+    """
+    return species + '_a%02d' % b
+
+
+def register_mechanism(chem_opt, name, species, nbins, cutoffs,
+                       components=None, total=None, total_name='tot',
+                       cond_vap=None, keep=None, extra=None,
+                       conversion='ALT', cv_func=None, exclude=('water',)):
+    """
+    Register the aerosol table of a chem_opt.
+
+    :param chem_opt: WRF-Chem chem_opt.
+    :type chem_opt: integer
+    :param name: name of the mechanism.
+    :type name: string
+    :param species: aerosol species summed up in PM.
+    :type species: list of strings.
+    :param nbins: number of size bins (variables <species>_a01, ...).
+    :type nbins: integer
+    :param cutoffs: number of bins summed up for each PM size, e.g.
+     {'pm25': 3, 'pm10': 4}.
+    :type cutoffs: dict
+    :param components: species summed up in each component, e.g.
+     {'SIA': ['so4', 'nh4', 'no3']}. Default no components.
+    :type components: dict
+    :param total: components (or species) summed up in the total PM.
+     Default all the species.
+    :type total: list of strings.
+    :param total_name: name of the total (e.g. pm25_tot). Default 'tot'.
+    :type total_name: string
+    :param cond_vap: condensable vapours converted from ppmv to ug m-3.
+     Default None.
+    :type cond_vap: list of strings.
+    :param keep: raw variables in get_aerosols outputs. Default the bins
+     of the species, num and water bins, PM2_5_DRY and conversion.
+    :type keep: list of strings.
+    :param extra: other raw variables in get_aerosols outputs (with the
+     default keep). Default None.
+    :type extra: list of strings.
+    :param conversion: inverse density variable. Default 'ALT'.
+    :type conversion: string
+    :param cv_func: function (cv, conversion) converting condensable
+     vapours. Default aerosols_202._cv_to_ug_.
+    :type cv_func: function
+    :param exclude: species not in the dry PM (direct_pm, as WRF-Chem
+     PM2_5_DRY and PM10). Default ('water',).
+    :type exclude: list of strings.
+    """
+    components = dict(components or {})
+    if total is None:
+        total = list(species)
+
+    for comp, members in components.items():
+        unknown = set(members) - set(species)
+        if unknown:
+            raise ValueError('Component %s has unknown species %s.'
+                             % (comp, sorted(unknown)))
+    unknown = set(total) - set(species) - set(components)
+    if unknown:
+        raise ValueError('Total has unknown components %s.' % sorted(unknown))
+    if max(cutoffs.values()) > nbins:
+        raise ValueError('Cutoffs larger than the number of bins.')
+
+    if keep is None:
+        keep = [_bin_var_(sp, b) for sp in list(species) + ['num', 'water']
+                for b in range(1, nbins + 1)]
+        keep = keep + ['PM2_5_DRY'] + list(extra or []) + [conversion]
+
+    chem_opt = int(chem_opt)
+    _TABLES[chem_opt] = dict(name=name, species=list(species),
+                             nbins=int(nbins), cutoffs=dict(cutoffs),
+                             components=components, total=list(total),
+                             total_name=total_name,
+                             cond_vap=list(cond_vap or []), keep=list(keep),
+                             conversion=conversion, cv_func=cv_func,
+                             dry=[sp for sp in species
+                                  if sp not in set(exclude or [])])
+
+    # the plan and the derived variables are built again.
+    _MECHANISMS.pop(chem_opt, None)
+    from WRFChemToolkit.analysis import derived
+    derived._forget_(chem_opt)
+
+
+def get_chem_opts():
+    """
+    Return the chem_opt with a registered table.
+
+    :return: chem_opt values.
+    :rtype: list of integers.
+    """
+    _register_defaults_()
+
+    return sorted(_TABLES)
+
+
+def get_mechanism(chem_opt):
+    """
+    Return the mechanism of a chem_opt (its plan is built once).
+
+    :param chem_opt: WRF-Chem chem_opt.
+    :type chem_opt: integer
+    :return: mechanism.
+    :rtype: Mechanism
+    """
+    _register_defaults_()
+    chem_opt = int(chem_opt)
+    if chem_opt not in _TABLES:
+        raise ValueError('chem_opt %s not supported.' % chem_opt)
+
+    if chem_opt not in _MECHANISMS:
+        _MECHANISMS[chem_opt] = Mechanism(chem_opt, **_TABLES[chem_opt])
+
+    return _MECHANISMS[chem_opt]
+
+
+class Mechanism(object):
+    """
+    Aerosol calculations of a chem_opt from its table (see
+    register_mechanism), with the same functions of the aerosols modules
+    (get_variables, get_aerosols, direct_pm).
+
+    :param chem_opt: WRF-Chem chem_opt.
+    :type chem_opt: integer
+    """
+
+    def __init__(self, chem_opt, name, species, nbins, cutoffs, components,
+                 total, total_name, cond_vap, keep, conversion, cv_func,
+                 dry):
+
+        self.chem_opt = int(chem_opt)
+        self.name = name
+        self.species = species
+        self.nbins = nbins
+        self.cutoffs = cutoffs
+        self.components = components
+        self.total = total
+        self.total_name = total_name
+        self.cond_vap = cond_vap
+        self.keep = keep
+        self.conversion = conversion
+        self.cv_func = cv_func
+        self.dry = dry
+        self.plan = self._get_plan_()
+
+    def _get_plan_(self):
+        """
+        Steps of the PM calculation: ('bins', species, cutoffs), ('sum',
+        output, inputs), ('copy', output, input), ('cv', vapour).
+        """
+        plan = [('bins', self.species, self.cutoffs)]
+
+        for prefix in sorted(self.cutoffs, key=self.cutoffs.get):
+            outputs = list(self.components.items())
+            outputs.append((self.total_name, self.total))
+            for out, inputs in outputs:
+                inputs = [prefix + '_' + inp for inp in inputs]
+                if len(inputs) == 1:
+                    plan.append(('copy', prefix + '_' + out, inputs[0]))
+                else:
+                    plan.append(('sum', prefix + '_' + out, inputs))
+
+        for cv in self.cond_vap:
+            plan.append(('cv', cv))
+
+        return plan
+
+    @property
+    def totals(self):
+        """
+        Names of the total PM variables (e.g. pm25_tot, pm10_tot).
+        """
+        return [prefix + '_' + self.total_name for prefix in
+                sorted(self.cutoffs, key=self.cutoffs.get)]
+
+    def get_variables(self):
+        """
+        Return the list of WRF-Chem output variables needed by get_aerosols,
+        e.g. to open only those with statistics.merge_ds(data_path, variables).
+
+        :return: variables names.
+        :rtype: list of strings.
+        """
+        return list(dict.fromkeys(self.keep + self.cond_vap
+                                  + [self.conversion]))
+
+    def _get_cv_func_(self):
+
+        if self.cv_func is None:
+            from WRFChemToolkit.analysis import aerosols_202
+            return aerosols_202._cv_to_ug_
+
+        return self.cv_func
+
+    @prf.profiled
+    def apply(self, ds):
+        """
+        Add to dataset the species, components and total PM in ug m-3 and
+        convert the condensable vapours, following the plan.
+
+        :param ds: WRF-chem output.
+        :type ds: xarray DataSet.
+        """
+        for step in self.plan:
+            if step[0] == 'bins':
+                utl.sum_bins(ds, step[1], step[2],
+                             conversion=self.conversion)
+            elif step[0] == 'sum':
+                ds[step[1]] = utl.fused_sum(ds, step[2])
+                ds[step[1]].attrs['units'] = 'ug m-3'
+            elif step[0] == 'copy':
+                ds[step[1]] = ds[step[2]]
+            elif step[0] == 'cv':
+                ds[step[1]] = self._get_cv_func_()(ds[step[1]],
+                                                   ds[self.conversion])
+                ds[step[1]].attrs['units'] = 'ug m-3'
+
+    @prf.profiled
+    def get_aerosols(self, ds, variables=None, dtype=None,
+                     memory_budget=None, levels=None):
+        """
+        Dataset with the PM data of the WRF-Chem output (see
+        aerosols_202.get_aerosols for the arguments).
+
+        :param ds: WRF-chem output.
+        :type ds: xarray DataSet.
+        :return: Reduced dataset with pm data.
+        :rtype: xarray DataSet.
+        """
+        ds = utl.select_levels(ds, levels)
+
+        if (variables is not None or dtype is not None
+                or memory_budget is not None):
+            from WRFChemToolkit.analysis import derived
+            if variables is None:
+                variables = list(derived.get_registry(self.chem_opt))
+            return derived.compute(ds, variables, self.chem_opt, dtype=dtype,
+                                   memory_budget=memory_budget)
+
+        ds_aer = utl._get_data_subset_(ds, self.get_variables())
+        self.apply(ds_aer)
+
+        return ds_aer
+
+    @prf.profiled
+    def direct_pm(self, ds):
+        """
+        Add to dataset the total dry PM (e.g. pm25_dir_tot) directly from
+        the bins of the dry species (as WRF-Chem PM2_5_DRY and PM10), each
+        in a single pass dividing once by the inverse density.
+
+        :param ds: WRF-chem output.
+        :type ds: xarray DataSet.
+        """
+        for prefix, nbins in self.cutoffs.items():
+            name = prefix + '_dir_' + self.total_name
+            ds[name] = utl.fused_sum(ds, [_bin_var_(sp, b)
+                                          for sp in self.dry
+                                          for b in range(1, nbins + 1)],
+                                     conversion=self.conversion)
+            ds[name].attrs['units'] = 'ug m-3'
+
+
+def _register_default_(chem_opt, *args, **kwargs):
+    """
+    Register a default table, unless a table of chem_opt is registered.
+    """
+    if int(chem_opt) not in _TABLES:
+        register_mechanism(chem_opt, *args, **kwargs)
+
+
+def _register_defaults_():
+    """
+    Register the tables of chem_opt 201 and 202 (from the aerosols modules)
+    and of MOSAIC 4 bins (9) and 8 bins (10), once. Tables registered
+    before are not replaced.
+    """
+    if _DEFAULTS:
+        return
+    _DEFAULTS.append(True)
+
+    from WRFChemToolkit.analysis import aerosols_201 as ar201
+    from WRFChemToolkit.analysis import aerosols_202 as ar202
+
+    _register_default_(201, 'MOZART-MOSAIC 4 bins VBS-0', ar201.SPECIES, 4,
+                       {'pm25': 3}, ar201.COMPONENTS, total_name='calc',
+                       keep=ar201.AEROSOLS)
+    _register_default_(202, 'MOZART-MOSAIC 4 bins VBS-4 aq', ar202.SPECIES,
+                       4, {'pm25': 3, 'pm10': 4}, ar202.COMPONENTS,
+                       ar202.TOTAL, cond_vap=ar202.COND_VAP,
+                       keep=ar202.AEROSOLS + ar202.STATE_VAR)
+
+    # MOSAIC bins edges (um): 4 bins 0.039-0.156-0.625-2.5-10, 8 bins
+    # 0.039-0.078-0.156-0.312-0.625-1.25-2.5-5-10.
+    _register_default_(9, 'CBMZ-MOSAIC 4 bins', MOSAIC_SPECIES, 4,
+                       {'pm25': 3, 'pm10': 4}, MOSAIC_COMPONENTS,
+                       ['SIA', 'POA', 'sea', 'dust', 'bc'])
+    _register_default_(10, 'CBMZ-MOSAIC 8 bins', MOSAIC_SPECIES, 8,
+                       {'pm25': 6, 'pm10': 8}, MOSAIC_COMPONENTS,
+                       ['SIA', 'POA', 'sea', 'dust', 'bc'])
@@ -8,10 +8,106 @@ Created on Thu Jan  9 10:57:07 2020
 @author: Caterina Mogno c.mogno@ed.ac.uk
 """
 
+from WRFChemToolkit.analysis import profiling as prf
 
+
+# formats where the dpi only sets the resolution of rasterized layers.
+VECTOR_FORMATS = ['pdf', 'eps', 'ps', 'svg', 'svgz']
+
+
+def _draw_map_(ax, coastline=True, borders=True):
+    """
+    Draw meridians, parallels, coastlines and borders on a cartopy GeoAxes.
+    """
+    
+    import cartopy.crs as ccrs
+    import cartopy.feature as cfeature
+    from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
+    
+    # draw meridians and parallels.
+    gl = ax.gridlines(crs=ccrs.PlateCarree(), draw_labels=True,
+                          linewidth=0.5, color='k', alpha=0.4, linestyle='-')
+    gl.xlabels_top = False
+    gl.ylabels_right = False
+    gl.xformatter = LONGITUDE_FORMATTER
+    gl.yformatter = LATITUDE_FORMATTER
+    gl.xlabel_style = {'size': 10, 'color': 'gray'}
+    gl.ylabel_style = {'size': 10, 'color': 'grey'}
+
+
+    # draw coastlines and borders.
+    if coastline:
+        ax.add_feature(cfeature.COASTLINE, lw=0.5)
+    if borders:
+        ax.add_feature(cfeature.BORDERS, lw=0.5)
+
+
+def _get_decimation_(ax, shape, dpi, max_cells=None):
+    """
+    Block size for averaging a grid of given shape so that it has no more 
+    cells than max_cells, by default the pixels of the axes at dpi (the
+    resolution of the data layer, see _get_raster_dpi_).
+    """
+    
+    import numpy as np
+    
+    if max_cells is None:
+        bbox = ax.get_position()
+        width, height = ax.figure.get_size_inches()
+        max_cells = (width * bbox.width * dpi) * (height * bbox.height * dpi)
+    
+    return max(1, int(np.ceil(np.sqrt(shape[0] * shape[1] / max_cells))))
+
+
+def _get_raster_dpi_(format, dpi, raster_dpi, rasterize=True):
+    """
+    Resolution of the data layer: raster_dpi for the rasterized layer of
+    vector formats, at most dpi for raster formats.
+    """
+    
+    if format in VECTOR_FORMATS:
+        return raster_dpi if rasterize else dpi
+    
+    return min(dpi, raster_dpi)
+
+
+def _block_mean_(values, block):
+    """
+    Block-average a 2D (masked) array over block x block cells (edges trimmed).
+    """
+    
+    import numpy as np
+    
+    if block == 1:
+        return values
+    
+    ny = values.shape[0] // block * block
+    nx = values.shape[1] // block * block
+    values = np.ma.asarray(values)[:ny, :nx]
+    
+    return values.reshape(ny // block, block, nx // block, block
+                          ).mean(axis=(1, 3))
+
+
+def _rasterize_(cs):
+    """
+    Rasterize the data layer (pcolormesh or contourf) in vector outputs.
+    """
+    
+    import matplotlib.artist
+    
+    if isinstance(cs, matplotlib.artist.Artist):
+        cs.set_rasterized(True)
+    else:
+        for artist in cs.collections: # matplotlib < 3.8 contour sets.
+            artist.set_rasterized(True)
+
+
+@prf.profiled
 def map_2D(dataset, var_name, level=0, mask_values=None,
            title=None, cmap = 'OrRd', coastline=True, borders=True,
-           pixels=False, vmin = 0, vmax = 600, save=False, format='pdf', dpi=1000):
+           pixels=False, vmin = 0, vmax = 600, save=False, format='pdf', dpi=1000,
+           rasterize=True, decimate=True, max_cells=None, raster_dpi=200):
 
     """
     Plots a 2D-map of a variable at a given time (and level).
@@ -40,35 +136,30 @@ def map_2D(dataset, var_name, level=0, mask_values=None,
     :type format: string
     :param dpi: resolution of the saved plot in dots per inches. Default 1000.
     :type dpi: integer
+    :param rasterize: rasterize the data layer (coastlines, borders and labels
+     are kept as vectors) in vector formats (pdf, eps..). Default True.
+    :type rasterize: bool
+    :param decimate: block-average the grid when it has more cells than the 
+     pixels of the data layer (or max_cells). Default True.
+    :type decimate: bool
+    :param max_cells: maximum number of grid cells to plot, e.g. to bound 
+     the output size. Default pixels of the data layer.
+    :type max_cells: integer
+    :param raster_dpi: resolution of the data layer: of the rasterized layer
+     in vector formats, at most dpi in raster formats (png..). Bounds the 
+     output size and render time of large grids. Default 200.
+    :type raster_dpi: integer
     """
     
     import matplotlib.pyplot as plt
     import cartopy.crs as ccrs
-    import cartopy.feature as cfeature
-    from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
     import numpy as np
     
     
     # ------------------------- DRAW THE MAP --------------------------------
     # draw map.
     ax = plt.subplot(projection=ccrs.PlateCarree())
- 
-    # draw meridians and parallels.
-    gl = ax.gridlines(crs=ccrs.PlateCarree(), draw_labels=True,
-                          linewidth=0.5, color='k', alpha=0.4, linestyle='-')
-    gl.xlabels_top = False
-    gl.ylabels_right = False
-    gl.xformatter = LONGITUDE_FORMATTER
-    gl.yformatter = LATITUDE_FORMATTER
-    gl.xlabel_style = {'size': 10, 'color': 'gray'}
-    gl.ylabel_style = {'size': 10, 'color': 'grey'}
-
-
-    # draw coastlines and borders.
-    if coastline:
-        ax.add_feature(cfeature.COASTLINE, lw=0.5)
-    if borders:
-        ax.add_feature(cfeature.BORDERS, lw=0.5)
+    _draw_map_(ax, coastline=coastline, borders=borders)
 
    # ------------------------- GET DATA TO PLOT------------------------------
    
@@ -79,11 +170,18 @@ def map_2D(dataset, var_name, level=0, mask_values=None,
     long = dataset.XLONG.values[0, :, :]
     lat = dataset.XLAT.values[0, :, :]
     
-    if mask_values is None:
-        var_values = var[level, :, :]
-    else: 
-        var_values= np.ma.masked_where(var[level,:,:].values < mask_values,
-                                       var[level,:,:].values) 
+    var_values = var[level, :, :].values
+    
+    # block-average grids finer than the output.
+    layer_dpi = _get_raster_dpi_(format, dpi, raster_dpi, rasterize)
+    if decimate:
+        block = _get_decimation_(ax, var_values.shape, layer_dpi, max_cells)
+        long = _block_mean_(long, block)
+        lat = _block_mean_(lat, block)
+        var_values = _block_mean_(var_values, block)
+    
+    if mask_values is not None:
+        var_values= np.ma.masked_where(var_values < mask_values, var_values) 
    
 
    # -------------------------  PLOT DATA ----------------------------------
@@ -96,6 +194,9 @@ def map_2D(dataset, var_name, level=0, mask_values=None,
         cs = plt.contourf(long, lat, var_values,
             transform=ccrs.PlateCarree(), cmap=cmap,vmin=vmin, vmax=vmax)
     
+    if rasterize:
+        _rasterize_(cs)
+    
     # colorbar.
     cbar = plt.colorbar(cs)
     cbar.set_label(var.units)
@@ -105,15 +206,279 @@ def map_2D(dataset, var_name, level=0, mask_values=None,
     
     #save
     if save:
-        plt.savefig( save + '.' + format, format=format, dpi=dpi)
+        with prf.stage('savefig', format=format):
+            plt.savefig( save + '.' + format, format=format, 
+                        dpi=layer_dpi if format in VECTOR_FORMATS else dpi)
     
     plt.show()
     
     
-def time_series(dates, variables, labels,title=None, xlabel=None, ylabel=None):
+# figure of a map_2D_batch worker, built once and reused by all its tasks.
+_FRAME = {}
+
+
+def _init_frames_(long, lat, opt):
+    """
+    Build the figure of a map_2D_batch worker (headless, once for each 
+    process): map, gridlines and features, and the decimated grid.
+    """
+    
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import cartopy.crs as ccrs
+    import numpy as np
+    
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(projection=ccrs.PlateCarree())
+    _draw_map_(ax, coastline=opt['coastline'], borders=opt['borders'])
+    
+    # block-average grids finer than the output.
+    block = 1
+    if opt['decimate']:
+        block = _get_decimation_(ax, long.shape, opt['layer_dpi'], 
+                                 opt['max_cells'])
+    
+    _FRAME.clear()
+    _FRAME.update(fig=fig, ax=ax, long=_block_mean_(long, block), 
+                  lat=_block_mean_(lat, block), block=block, opt=opt, 
+                  levels=np.linspace(opt['vmin'], opt['vmax'], opt['levels']),
+                  cs=None, cbar=None)
+
+
+def _render_frames_(task):
+    """
+    Render a sequence of map frames of one variable on the figure of the 
+    worker (see _init_frames_): only the data artist is updated for each 
+    frame.
+    """
+    
+    import cartopy.crs as ccrs
+    import numpy as np
+    
+    frames, paths, titles, units = task
+    fig, ax, opt = _FRAME['fig'], _FRAME['ax'], _FRAME['opt']
+    
+    for values, path, title in zip(frames, paths, titles):
+        values = _block_mean_(values, _FRAME['block'])
+        if opt['mask_values'] is not None:
+            values = np.ma.masked_where(values < opt['mask_values'], values)
+        
+        cs = _FRAME['cs']
+        if opt['pixels'] and cs is not None:
+            cs.set_array(values)
+        else:
+            if cs is not None:
+                cs.remove()
+            if opt['pixels']:
+                cs = ax.pcolormesh(_FRAME['long'], _FRAME['lat'], values, 
+                                   transform=ccrs.PlateCarree(), 
+                                   cmap=opt['cmap'], vmin=opt['vmin'], 
+                                   vmax=opt['vmax'])
+            else:
+                # same color levels for all frames (consistent animations).
+                cs = ax.contourf(_FRAME['long'], _FRAME['lat'], values, 
+                                 levels=_FRAME['levels'], 
+                                 transform=ccrs.PlateCarree(), 
+                                 cmap=opt['cmap'], extend='both')
+            if opt['rasterize']:
+                _rasterize_(cs)
+            _FRAME['cs'] = cs
+            if _FRAME['cbar'] is None:
+                _FRAME['cbar'] = fig.colorbar(cs, ax=ax)
+        
+        _FRAME['cbar'].set_label(units)
+        ax.set_title(title)
+        fig.savefig(path, format=opt['format'], dpi=opt['savefig_dpi'])
+    
+    return paths
+
+
+@prf.profiled
+def map_2D_batch(dataset, var_names, out_dir, times=None, time_nm='Time', 
+                 level=0, mask_values=None, cmap='OrRd', coastline=True, 
+                 borders=True, pixels=False, vmin=0, vmax=600, levels=21, 
+                 format='png', dpi=150, rasterize=True, decimate=True, 
+                 max_cells=None, raster_dpi=200, workers=None):
+    """
+    Plots 2D-maps of variables for a range of times (and a level) to files,
+    e.g. hourly maps of several species. Frames are rendered headless in a 
+    pool of processes (started with spawn, so scripts calling it need an 
+    if __name__ == '__main__' guard): the figure (projection, gridlines and
+    features) is built once for each worker and only the data is updated 
+    from frame to frame.
+    Frames are saved as out_dir/<var_name>_<nnnn>.<format>, numbered from 0
+    for each variable (e.g. for ffmpeg -i <var_name>_%04d.png).
+
+    :param dataset: WRF-Chem output.
+    :type dataset: xarray DataSet
+    :param var_names: variables names as in the dataset.
+    :type var_names: list of strings
+    :param out_dir: directory for the frames.
+    :type out_dir: string
+    :param times: time indices to plot. Default all.
+    :type times: list of integers or slice
+    :param time_nm: name of the time dimension. Default 'Time'.
+    :type time_nm: string
+    :param level: vertical level at which to plot. Default surface level.
+    :type level: integer
+    :param mask_values: mask values to plot below a certain level. Default no mask.
+    :type mask_values: float 
+    :param coastline: plot or not coastline. Default True.
+    :type coastline: bool
+    :param borders: plot or not borders. Default True.
+    :type borders: bool
+    :param pixels: plot as pcolormesh (raw pixels). Default False.
+    :type pixels: bool
+    :param levels: number of contour levels between vmin and vmax. Default 21.
+    :type levels: integer
+    :param format: format of the frames (png, pdf..), Default png.
+    :type format: string
+    :param dpi: resolution of the frames in dots per inches. Default 150.
+    :type dpi: integer
+    :param rasterize: rasterize the data layer in vector formats. Default True.
+    :type rasterize: bool
+    :param decimate: block-average the grid when it has more cells than the 
+     pixels of the data layer (or max_cells). Default True.
+    :type decimate: bool
+    :param max_cells: maximum number of grid cells to plot. Default pixels
+     of the data layer.
+    :type max_cells: integer
+    :param raster_dpi: resolution of the data layer (see map_2D). Default 
+     200.
+    :type raster_dpi: integer
+    :param workers: number of processes. Default number of CPUs.
+    :type workers: integer
+    :return: frames paths for each variable.
+    :rtype: dict
+    """
+    
+    import os
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    import numpy as np
+    
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count()
+    
+    if times is None:
+        times = slice(None)
+    ds = dataset.isel({time_nm: times})
+    
+    long = ds.XLONG.values[0, :, :]
+    lat = ds.XLAT.values[0, :, :]
+    
+    if time_nm in ds.coords:
+        labels = [str(t)[:19] for t in ds[time_nm].values]
+    else:
+        labels = [str(t) for t in np.arange(ds.sizes[time_nm])]
+    
+    opt = dict(mask_values=mask_values, cmap=cmap, coastline=coastline, 
+               borders=borders, pixels=pixels, vmin=vmin, vmax=vmax, 
+               levels=levels, format=format, rasterize=rasterize,
+               decimate=decimate, max_cells=max_cells)
+    opt['layer_dpi'] = _get_raster_dpi_(format, dpi, raster_dpi, rasterize)
+    opt['savefig_dpi'] = (opt['layer_dpi'] if format in VECTOR_FORMATS 
+                          else dpi)
+    
+    # split the frames of each variable in chunks, one task for each.
+    tasks = []
+    frames_paths = {}
+    for var_name in var_names:
+        var = ds[var_name]
+        if 'bottom_top' in var.dims:
+            var = var.isel(bottom_top=level)
+        n = var.sizes[time_nm]
+        paths = [os.path.join(out_dir, '%s_%04d.%s' % (var_name, i, format)) 
+                 for i in range(n)]
+        frames_paths[var_name] = paths
+        
+        step = max(1, -(-n // workers))
+        for i in range(0, n, step):
+            frames = var.isel({time_nm: slice(i, i + step)}).values
+            tasks.append((frames, paths[i:i + step], 
+                          [var_name + ' ' + lb for lb in labels[i:i + step]], 
+                          var.attrs.get('units', '')))
+    
+    if workers == 1:
+        _init_frames_(long, lat, opt)
+        list(map(_render_frames_, tasks))
+        _FRAME.clear()
+    else:
+        # spawn: forked workers can hang on the matplotlib, cartopy and 
+        # netCDF/HDF5 state of the parent.
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_frames_, 
+                                 initargs=(long, lat, opt)) as pool:
+            list(pool.map(_render_frames_, tasks))
+    
+    return frames_paths
+    
+    
+def _lttb_(x, y, n_out):
+    """
+    Indices of the points selected by the Largest-Triangle-Three-Buckets 
+    downsampling (shape preserving) of the series x, y to n_out points.
+    """
+    
+    import numpy as np
+    
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    
+    # n_out - 2 buckets between first and last point.
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    idx = np.empty(n_out, dtype=int)
+    idx[0], idx[-1] = 0, n - 1
+    
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nhi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = np.mean(x[hi:nhi])
+        avg_y = np.nanmean(y[hi:nhi]) if np.any(np.isfinite(y[hi:nhi])) else y[a]
+        
+        # triangle areas with the previous selected point and next average.
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) 
+                      - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(np.nan_to_num(area, nan=-1)))
+        idx[i + 1] = a
+    
+    return idx
+
+
+def _minmax_(x, y, n_out):
+    """
+    Indices of the points selected by min/max bucketing of the series y to 
+    (about) n_out points: first and last point, minimum and maximum of each
+    bucket in between.
+    """
+    
+    import numpy as np
+    
+    n = len(y)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+    
+    idx = [0, n - 1]
+    for bucket in np.array_split(np.arange(1, n - 1), (n_out - 2) // 2):
+        values = np.nan_to_num(y[bucket], nan=np.nanmean(y[bucket]) 
+                               if np.any(np.isfinite(y[bucket])) else 0)
+        idx.extend([bucket[np.argmin(values)], bucket[np.argmax(values)]])
+    
+    return np.unique(idx)
+
+
+@prf.profiled
+def time_series(dates, variables, labels,title=None, xlabel=None, ylabel=None,
+                downsample=None, n_points=2000, webgl=False, dynamic=False):
    
     """
     Plots timeseries of given varialbels in one single plot.
+    Long series (e.g. multi-year hourly) can be downsampled with a shape 
+    preserving method and plotted with WebGL.
  
     :param dates: timeseries dates.
     :type dates: numpy.array
@@ -127,17 +492,47 @@ def time_series(dates, variables, labels,title=None, xlabel=None, ylabel=None):
     :type  xlabel: string
     :param xlabel: y-axis label. Default no label.
     :type  xlabel: string
+    :param downsample: 'lttb' (largest triangle three buckets) or 'minmax' 
+     (min and max of buckets). Default no downsampling.
+    :type downsample: string
+    :param n_points: points of each trace after downsampling. Default 2000.
+    :type n_points: integer
+    :param webgl: use WebGL traces (Scattergl). Default False.
+    :type webgl: bool
+    :param dynamic: return a FigureWidget (Jupyter), not shown, that (with
+     downsample) downsamples again the visible range at full resolution 
+     when zooming. Default False.
+    :type dynamic: bool
+    :return: the figure (shown if not dynamic).
+    :rtype: plotly.graph_objs.Figure or FigureWidget
     """
     
     import plotly.graph_objs as go
+    import numpy as np
+    
+    scatter = go.Scattergl if webgl else go.Scatter
+    sampler = {None: None, 'lttb': _lttb_, 'minmax': _minmax_}[downsample]
+    
+    # numeric x for downsampling.
+    x = np.asarray(dates)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x_num = x.astype('datetime64[ns]').astype('int64').astype(float)
+    else:
+        x_num = x.astype(float)
     
     data=[] #empty list for storing traces.
+    series=[] #full resolution series.
     
     # create trace for each variable
     for i in range(len(variables)):
-            trace = go.Scatter(
-            x=dates, 
-            y=variables[i][:,0].values,
+            y = variables[i][:,0].values
+            series.append(y)
+            keep = slice(None)
+            if sampler is not None:
+                keep = sampler(x_num, y, n_points)
+            trace = scatter(
+            x=x[keep], 
+            y=y[keep],
             name= labels[i],
             mode='lines',
             )
@@ -150,11 +545,33 @@ def time_series(dates, variables, labels,title=None, xlabel=None, ylabel=None):
     title=title,
     showlegend = True)
     
+    if dynamic:
+        fig = go.FigureWidget(data=data, layout=layout)
+        if sampler is None:
+            return fig
+        
+        import pandas as pd
+        
+        def _zoom_(layout, x_range):
+            # downsample the visible range at full resolution.
+            sel = np.ones(len(x), dtype=bool)
+            if x_range is not None:
+                lo, hi = x_range
+                if np.issubdtype(x.dtype, np.datetime64):
+                    lo, hi = pd.Timestamp(lo), pd.Timestamp(hi)
+                sel = (x >= lo) & (x <= hi)
+            with fig.batch_update():
+                for trace, y in zip(fig.data, series):
+                    keep = sampler(x_num[sel], y[sel], n_points)
+                    trace.x = x[sel][keep]
+                    trace.y = y[sel][keep]
+        
+        fig.layout.on_change(_zoom_, 'xaxis.range')
+        
+        return fig
+    
     # plot
     fig = go.Figure(data=data, layout=layout)
     fig.show()
     
-            
-            
-            
- 
\ No newline at end of file
+    return fig
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Opt-in stage-level profiling of the analysis pipeline.
+
+Functions of the analysis modules are decorated with profiled and long
+operations within them (e.g. open_mfdataset) are wrapped in stage. When
+profiling is enabled (enable, or the environment variable WRFCHEM_PROFILE
+set to the path of the output file) each stage gives a record with wall
+time, bytes read, RSS (start, end and peak) and dask tasks executed (and
+tasks of the returned lazy object), written as a JSON line so that records
+of many runs can be aggregated (see summary). When profiling is disabled
+the overhead is a flag check per call. Stages are nested per thread, and
+worker processes can be profiled as their parent (see init_worker).
+"""
+
+import os
+import json
+import time
+import socket
+import datetime
+import functools
+import threading
+import contextlib
+
+
+# profiling configuration.
+_CONFIG = dict(enabled=False, path=None, interval=0.01)
+
+# records of this process, active stages of all threads (for the RSS
+# sampler) and stages of each thread (outermost first, see _get_stack_).
+_RECORDS = []
+_ACTIVE = []
+_LOCAL = threading.local()
+_LOCK = threading.Lock()
+_SAMPLER = {}
+
+# identifier of the run, to aggregate records of many runs.
+_RUN = '%s-%d-%s' % (socket.gethostname(), os.getpid(),
+                     datetime.datetime.now().strftime('%Y%m%dT%H%M%S'))
+
+
+def enable(path=None, interval=0.01):
+    """
+    Enable profiling.
+
+    :param path: JSON lines file to append the records to. Default records
+     kept in memory only (see get_records).
+    :type path: string
+    :param interval: sampling interval of the RSS [s]. Default 0.01.
+    :type interval: float
+    """
+    _CONFIG.update(enabled=True, path=path, interval=interval)
+
+
+def disable():
+    """
+    Disable profiling.
+    """
+    _CONFIG['enabled'] = False
+
+
+def get_config():
+    """
+    Profiling configuration (enabled, path, interval), e.g. to profile
+    worker processes (see init_worker).
+
+    :return: configuration.
+    :rtype: dict
+    """
+    return dict(_CONFIG)
+
+
+def init_worker(config):
+    """
+    Profile a worker process as its parent (initializer of process pools),
+    appending the records to the same file.
+
+    :param config: configuration of the parent (see get_config).
+    :type config: dict
+    """
+    if config['enabled']:
+        enable(config['path'], config['interval'])
+
+
+def is_enabled():
+    """
+    Return True if profiling is enabled.
+    """
+    return _CONFIG['enabled']
+
+
+def get_records(clear=False):
+    """
+    Records of this process.
+
+    :param clear: clear the records. Default False.
+    :type clear: bool
+    :return: records.
+    :rtype: list of dicts.
+    """
+    records = list(_RECORDS)
+    if clear:
+        del _RECORDS[:]
+
+    return records
+
+
+def _get_rss_():
+    """
+    Resident set size of the process [bytes].
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def _get_bytes_read_():
+    """
+    Bytes read by the process (from disk or page cache).
+    """
+    try:
+        import psutil
+        io = psutil.Process().io_counters()
+        return getattr(io, 'read_chars', io.read_bytes)
+    except (ImportError, AttributeError):
+        pass
+
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def _get_stack_():
+    """
+    Active stages of the current thread (outermost first).
+    """
+    if not hasattr(_LOCAL, 'stack'):
+        _LOCAL.stack = []
+
+    return _LOCAL.stack
+
+
+def _sample_rss_(stop):
+    """
+    Update the peak RSS of the active stages until stop is set.
+    """
+    while not stop.wait(_CONFIG['interval']):
+        rss = _get_rss_()
+        with _LOCK:
+            for record in _ACTIVE:
+                record['peak_rss'] = max(record['peak_rss'], rss or 0)
+
+
+def _get_task_counter_(record):
+    """
+    Dask callback counting the tasks executed in a stage (None without
+    dask).
+    """
+    try:
+        from dask.callbacks import Callback
+    except ImportError:
+        return None
+
+    def _pretask_(key, dask, state):
+        record['dask_tasks'] = record['dask_tasks'] + 1
+
+    return Callback(pretask=_pretask_)
+
+
+def _write_(record):
+    """
+    Store a record and append it to the output file.
+    """
+    _RECORDS.append(record)
+    if _CONFIG['path'] is not None:
+        with open(_CONFIG['path'], 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+
+def _to_mb_(value):
+    return None if value is None else round(value / 2**20, 3)
+
+
+@contextlib.contextmanager
+def stage(name, **info):
+    """
+    Profile a stage of the pipeline (no-op if profiling is disabled). The
+    record (dict) is yielded, so that information can be added to it.
+
+    :param name: name of the stage. Nested stages (in the same thread) are 
+     named outer/inner.
+    :type name: string
+    :param info: other information to record (e.g. number of files).
+    """
+    if not _CONFIG['enabled']:
+        yield None
+        return
+
+    stack = _get_stack_()
+    record = dict(run=_RUN, pid=os.getpid(), stage=name,
+                  path='/'.join([r['stage'] for r in stack] + [name]),
+                  start=datetime.datetime.now().isoformat(),
+                  dask_tasks=0, graph_tasks=None, error=None)
+    record.update(info)
+
+    rss = _get_rss_()
+    bytes_read = _get_bytes_read_()
+    record['peak_rss'] = rss or 0
+
+    stack.append(record)
+    with _LOCK:
+        _ACTIVE.append(record)
+        # one sampler while any stage (of any thread) is active.
+        if not _SAMPLER:
+            stop = threading.Event()
+            _SAMPLER.update(stop=stop, thread=threading.Thread(
+                target=_sample_rss_, args=(stop,), daemon=True))
+            _SAMPLER['thread'].start()
+
+    counter = _get_task_counter_(record)
+    if counter is not None:
+        counter.register()
+
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as err:
+        record['error'] = repr(err)
+        raise
+    finally:
+        record['wall_s'] = time.perf_counter() - start
+        if counter is not None:
+            counter.unregister()
+        stack.remove(record)
+        sampler = {}
+        with _LOCK:
+            _ACTIVE.remove(record)
+            if not _ACTIVE:
+                sampler = dict(_SAMPLER)
+                _SAMPLER.clear()
+        if sampler:
+            sampler['stop'].set()
+            sampler['thread'].join()
+
+        end_rss = _get_rss_()
+        end_read = _get_bytes_read_()
+        record['bytes_read'] = (None if bytes_read is None or end_read is None
+                                else end_read - bytes_read)
+        record['rss_start_mb'] = _to_mb_(rss)
+        record['rss_end_mb'] = _to_mb_(end_rss)
+        record['peak_rss_mb'] = _to_mb_(max(record.pop('peak_rss'),
+                                            end_rss or 0))
+        _write_(record)
+
+
+def _get_graph_tasks_(obj):
+    """
+    Number of tasks of the dask graph of a lazy result (None if not lazy).
+    """
+    graph = getattr(obj, '__dask_graph__', None)
+    if graph is None:
+        return None
+    graph = graph()
+
+    return None if graph is None else len(graph)
+
+
+def profiled(func=None, name=None):
+    """
+    Decorator profiling each call of a function as a stage named
+    module.function (or name).
+
+    :param func: function to profile.
+    :type func: function
+    :param name: name of the stage. Default module.function.
+    :type name: string
+    :return: decorated function.
+    :rtype: function
+    """
+    if func is None:
+        return functools.partial(profiled, name=name)
+
+    if name is None:
+        name = func.__module__.split('.')[-1] + '.' + func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _CONFIG['enabled']:
+            return func(*args, **kwargs)
+
+        with stage(name) as record:
+            result = func(*args, **kwargs)
+            record['graph_tasks'] = _get_graph_tasks_(result)
+
+        return result
+
+    return wrapper
+
+
+def load_records(path):
+    """
+    Load records from JSON lines files.
+
+    :param path: path to the records files (with wildcards) or list of paths.
+    :type path: string or list of strings.
+    :return: records.
+    :rtype: pandas DataFrame.
+    """
+    import glob
+    import pandas as pd
+
+    paths = sorted(glob.glob(path)) if isinstance(path, str) else path
+    records = []
+    for p in paths:
+        with open(p) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+
+    return pd.DataFrame.from_records(records)
+
+
+def summary(records, by='path'):
+    """
+    Aggregate records (e.g. of many runs) by stage.
+
+    :param records: records or path to the records files.
+    :type records: pandas DataFrame, list of dicts or string.
+    :param by: aggregate by 'path' (nested stage name) or 'stage'.
+     Default 'path'.
+    :type by: string
+    :return: calls, total, mean and max wall time, total bytes read, max
+     peak RSS and total dask tasks of each stage, slowest first.
+    :rtype: pandas DataFrame.
+    """
+    import pandas as pd
+
+    if isinstance(records, str):
+        records = load_records(records)
+    records = pd.DataFrame(records)
+
+    out = records.groupby(by).agg(
+        calls=('wall_s', 'size'),
+        wall_s=('wall_s', 'sum'),
+        wall_mean_s=('wall_s', 'mean'),
+        wall_max_s=('wall_s', 'max'),
+        bytes_read=('bytes_read', 'sum'),
+        peak_rss_mb=('peak_rss_mb', 'max'),
+        dask_tasks=('dask_tasks', 'sum'))
+
+    return out.sort_values('wall_s', ascending=False)
+
+
+if os.environ.get('WRFCHEM_PROFILE'):
+    enable(os.environ['WRFCHEM_PROFILE'])
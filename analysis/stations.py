@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Extraction of WRF-Chem outputs at stations (points).
+
+Stations are located on the curvilinear XLAT/XLONG grid with a KD-tree
+(scipy) of the cell centres, built once per grid and cached. All the
+stations are mapped in one query to the nearest cell or to the 4 cells
+(and bilinear weights) around them, then all the variables are extracted
+with a single vectorized isel, giving (Time, station) arrays.
+"""
+
+import numpy as np
+import xarray as xr
+
+from WRFChemToolkit.analysis import profiling as prf
+from WRFChemToolkit.analysis import utils as utl
+
+
+# mean Earth radius [km].
+EARTH_RADIUS = 6371.
+
+# cache of KD-trees of the cells centres, by grid.
+_KDTREE = {}
+
+
+def _to_xyz_(lat, lon):
+    """
+    Cartesian coordinates on the unit sphere of lat and long [deg].
+    """
+    lat, lon = np.deg2rad(lat), np.deg2rad(lon)
+
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon),
+                     np.sin(lat)], axis=-1)
+
+
+def _get_tree_(ds):
+    """
+    KD-tree of the cells centres of the grid of ds, lat and long of the
+    cells. Cached by grid.
+    """
+    lat, lon, key = utl._get_latlon_(ds)
+
+    if key not in _KDTREE:
+        from scipy.spatial import cKDTree
+
+        _KDTREE[key] = (cKDTree(_to_xyz_(lat, lon).reshape(-1, 3)), lat, lon)
+
+    return _KDTREE[key]
+
+
+def _bilinear_(lat, lon, j, i, st_lat, st_lon):
+    """
+    Bilinear weights of the stations in the grid quads with lower-left
+    corners (j, i), from the inverse bilinear map (Newton iterations) in
+    local planar coordinates. Return weights (station, 4) of corners
+    (j, i), (j, i+1), (j+1, i+1), (j+1, i) and True where the station is
+    in the quad.
+    """
+    coslat = np.cos(np.deg2rad(st_lat))
+
+    def _xy_(jj, ii):
+        dlon = (lon[jj, ii] - st_lon + 180.) % 360. - 180.
+        return np.stack([dlon * coslat, lat[jj, ii] - st_lat], axis=-1)
+
+    a, b = _xy_(j, i), _xy_(j, i + 1)
+    c, d = _xy_(j + 1, i + 1), _xy_(j + 1, i)
+    e = a - b + c - d
+
+    s = np.full(j.shape, 0.5)
+    t = np.full(j.shape, 0.5)
+    for _ in range(10):
+        f = a + s[:, None] * (b - a) + t[:, None] * (d - a) \
+            + (s * t)[:, None] * e
+        js = (b - a) + t[:, None] * e
+        jt = (d - a) + s[:, None] * e
+        det = js[:, 0] * jt[:, 1] - js[:, 1] * jt[:, 0]
+        det = np.where(det == 0, np.finfo(float).tiny, det)
+        s = s - (jt[:, 1] * f[:, 0] - jt[:, 0] * f[:, 1]) / det
+        t = t - (js[:, 0] * f[:, 1] - js[:, 1] * f[:, 0]) / det
+
+    eps = 1e-6
+    inside = ((s > -eps) & (s < 1 + eps) & (t > -eps) & (t < 1 + eps)
+              & np.isfinite(s) & np.isfinite(t))
+    s, t = np.clip(s, 0, 1), np.clip(t, 0, 1)
+    weights = np.stack([(1 - s) * (1 - t), s * (1 - t), s * t, (1 - s) * t],
+                       axis=-1)
+
+    return weights, inside
+
+
+@prf.profiled
+def get_station_index(ds, lats, lons, method='nearest', max_distance=None):
+    """
+    Grid indices and weights of stations on the grid of a WRF-Chem output,
+    for all stations in one query of the cached KD-tree.
+
+    :param ds: WRF-Chem output (or dataset with XLAT and XLONG coords).
+    :type ds: xarray.Dataset
+    :param lats: latitude of the stations.
+    :type lats: list or array of floats.
+    :param lons: longitude of the stations.
+    :type lons: list or array of floats.
+    :param method: 'nearest' (nearest cell) or 'bilinear' (4 cells around
+     the station, nearest cell on the domain edges). Default 'nearest'.
+    :type method: string
+    :param max_distance: stations farther than this from the nearest cell
+     centre [km] are outside the domain (no indices). Default no limit.
+    :type max_distance: float
+    :return: south_north, west_east indices and weights (station, corner),
+     distance [km] to the nearest cell (station) and valid (station, True
+     for stations in the domain).
+    :rtype: dict
+    """
+    if method not in ('nearest', 'bilinear'):
+        raise ValueError("method must be 'nearest' or 'bilinear'.")
+
+    st_lat = np.atleast_1d(np.asarray(lats, dtype=float))
+    st_lon = np.atleast_1d(np.asarray(lons, dtype=float))
+
+    tree, lat, lon = _get_tree_(ds)
+    ny, nx = lat.shape
+
+    chord, cell = tree.query(_to_xyz_(st_lat, st_lon))
+    distance = 2 * EARTH_RADIUS * np.arcsin(np.minimum(chord / 2, 1.))
+    jc, ic = np.unravel_index(cell, (ny, nx))
+
+    valid = np.ones(st_lat.shape, dtype=bool)
+    if max_distance is not None:
+        valid = distance <= max_distance
+
+    # nearest cell as default (single corner with weight 1).
+    jj = np.repeat(jc[:, None], 4, axis=1)
+    ii = np.repeat(ic[:, None], 4, axis=1)
+    weights = np.zeros(jj.shape)
+    weights[:, 0] = 1.
+
+    if method == 'bilinear' and ny > 1 and nx > 1:
+        found = np.zeros(st_lat.shape, dtype=bool)
+        # the 4 quads around the nearest cell.
+        for dj, di in ((-1, -1), (-1, 0), (0, -1), (0, 0)):
+            j = np.clip(jc + dj, 0, ny - 2)
+            i = np.clip(ic + di, 0, nx - 2)
+            w, inside = _bilinear_(lat, lon, j, i, st_lat, st_lon)
+            new = inside & ~found
+            jj[new] = np.stack([j, j, j + 1, j + 1], axis=-1)[new]
+            ii[new] = np.stack([i, i + 1, i + 1, i], axis=-1)[new]
+            weights[new] = w[new]
+            found = found | inside
+
+    return dict(south_north=jj, west_east=ii, weights=weights,
+                distance=distance, valid=valid)
+
+
+@prf.profiled
+def extract_stations(ds, lats, lons, names=None, variables=None,
+                     method='nearest', max_distance=None):
+    """
+    Extract variables at stations: a single vectorized isel for all the
+    stations and variables (lazy on dask data), weighted by the station
+    weights (see get_station_index), renormalised over the valid (not NaN)
+    cells. Works on any dataset on the WRF grid, e.g. the pm25_* variables
+    from aerosols_201/202.get_aerosols.
+
+    :param ds: dataset with XLAT and XLONG coords.
+    :type ds: xarray.Dataset
+    :param lats: latitude of the stations.
+    :type lats: list or array of floats.
+    :param lons: longitude of the stations.
+    :type lons: list or array of floats.
+    :param names: names of the stations. Default 0, 1, ...
+    :type names: list of strings.
+    :param variables: variables to extract. Default all variables on the
+     (south_north, west_east) grid.
+    :type variables: list of strings.
+    :param method: 'nearest' or 'bilinear'. Default 'nearest'.
+    :type method: string
+    :param max_distance: stations farther than this from the nearest cell
+     centre [km] are NaN. Default no limit.
+    :type max_distance: float
+    :return: dataset of the variables with 'station' instead of
+     (south_north, west_east) dimensions, e.g. (Time, station), with
+     station_lat, station_long and distance [km] coords.
+    :rtype: xarray.Dataset
+    """
+    index = get_station_index(ds, lats, lons, method, max_distance)
+    n_st = index['weights'].shape[0]
+    if names is None:
+        names = np.arange(n_st)
+
+    dims = ('south_north', 'west_east')
+    if variables is None:
+        variables = [var for var in ds.data_vars
+                     if set(dims) <= set(ds[var].dims)]
+
+    # a single corner (weight 1) for nearest.
+    n_corner = 4 if method == 'bilinear' else 1
+    indexers = {dim: xr.DataArray(index[dim][:, :n_corner],
+                                  dims=('station', 'corner'))
+                for dim in dims}
+    weights = xr.DataArray(np.where(index['valid'][:, None],
+                                    index['weights'][:, :n_corner], np.nan),
+                           dims=('station', 'corner'))
+
+    # NaN corners are left out and the weights of the others renormalised
+    # (e.g. a station on a grid node next to a missing cell).
+    points = ds[list(variables)].reset_coords(drop=True).isel(indexers)
+    norm = weights.where(points.notnull(), 0).sum(dim='corner', skipna=False)
+    out = ((points.fillna(0) * weights).sum(dim='corner', skipna=False)
+           / norm.where(norm > 0))
+    for var in variables:
+        if ds[var].dtype.kind == 'f':
+            out[var] = out[var].astype(ds[var].dtype, copy=False)
+        out[var].attrs = ds[var].attrs
+
+    # keep the non spatial coords (e.g. Time, XTIME).
+    coords = {name: coord for name, coord in ds.coords.items()
+              if not set(dims) & set(coord.dims)}
+    out = out.assign_coords(coords)
+
+    return out.assign_coords(
+        station=('station', list(names)),
+        station_lat=('station', np.atleast_1d(np.asarray(lats, float))),
+        station_long=('station', np.atleast_1d(np.asarray(lons, float))),
+        distance=('station', index['distance']))
@@ -8,25 +8,78 @@ Created on Thu Jan  9 10:57:07 2020
 @author: Caterina Mogno c.mogno@ed.ac.uk
 """
 
+from functools import lru_cache
+
+import numpy as np
 import xarray as xr
 
+from WRFChemToolkit.analysis import profiling as prf
+from WRFChemToolkit.analysis import utils as utl
+
 
-def merge_ds(data_path):
+@prf.profiled
+def merge_ds(data_path, variables=None, catalog=None, time_window=None,
+             levels=None):
  """
   Merge in a single dataset all data linked in the path. To consider multiple
   files the syntax is for example /mydir/wrfout_d01_2010-04-0*.
+  If a list of variables is given (e.g. aerosols_202.get_variables()), all 
+  the other variables are dropped before being decoded.
+  If a catalog (see catalog.update_catalog) is given, only the files 
+  matching the path and overlapping the time window are opened.
+  If levels are given (e.g. 0 for surface analyses), only those bottom_top
+  levels are read from the files.
 
   :param data_path:
-    path to data files.
-  :type data_path: string
+    path to data files (with wildcards), list of paths or remote URL 
+    (e.g. OPeNDAP).
+  :type data_path: string, pathlib.Path or list.
+  :param variables:
+    variables to open (WRF coordinates are always kept). Default all.
+  :type variables: list of strings.
+  :param catalog:
+    path to the catalog of the data files. Default no catalog.
+  :type catalog: string
+  :param time_window:
+    (start, end) times of the files to open, used with catalog. 
+    Default all times.
+  :type time_window: tuple
+  :param levels:
+    bottom_top levels to read (see utils.select_levels). Default all.
+  :type levels: integer, list of integers or slice.
   :return:
     single dataset of multiple files.
   :rtype: xarray Dataset
  """
- dataset = xr.open_mfdataset(data_path,decode_times=True)
+ if catalog is not None:
+     from WRFChemToolkit.analysis import catalog as cat
+     start, end = time_window if time_window is not None else (None, None)
+     pattern = data_path
+     data_path = cat.query_files(catalog, start, end, pattern=pattern)
+     if not data_path:
+         raise ValueError('No files of catalog %s match %s between %s and '
+                          '%s.' % (catalog, pattern, start, end))
+ 
+ paths = utl._get_paths_(data_path)
+ if not paths:
+     raise ValueError('No data files match %s.' % (data_path,))
+ 
+ drop = None
+ if variables is not None:
+     drop = utl._get_drop_list_(paths, variables)
+ 
+ preprocess = None
+ if levels is not None:
+     from functools import partial
+     preprocess = partial(utl.select_levels, levels=levels)
+ 
+ with prf.stage('open_mfdataset'):
+     dataset = xr.open_mfdataset(paths,decode_times=True, 
+                                 drop_variables=drop, preprocess=preprocess)
  return dataset
 
 
+@prf.profiled
 def time_mean(ds, time_nm):
  """
   Make the average over 'Time' dimension of a dataset.
@@ -45,35 +98,290 @@ def time_mean(ds, time_nm):
                    skipna=True).data_vars), coords=dict(ds.coords))
 
 
-def space_mean(ds):
+def _partial_time_sum_(path, time_nm, variables=None, levels=None):
+    """
+    Sum (float64) and count of valid values over time of the variables of a 
+    single file, their dtype and attrs, and the other numeric variables and 
+    the coords of the file (layout of the mean). Worker of time_mean_files.
+    """
+    drop = None
+    if variables is not None:
+        drop = utl._get_drop_list_([path], variables)
+    
+    with xr.open_dataset(path, drop_variables=drop) as ds:
+        ds = utl.select_levels(ds, levels)
+        numeric = [var for var in ds.data_vars 
+                   if np.issubdtype(ds[var].dtype, np.number)]
+        names = [var for var in numeric if time_nm in ds[var].dims]
+        sums = xr.Dataset({var: ds[var].sum(dim=time_nm, skipna=True, 
+                                            dtype='float64') 
+                           for var in names}).load()
+        counts = xr.Dataset({var: ds[var].count(dim=time_nm) 
+                             for var in names}).load()
+        meta = {var: (ds[var].dtype, dict(ds[var].attrs)) for var in names}
+        layout = xr.Dataset({var: ds[var] for var in numeric 
+                             if var not in names}, coords=ds.coords).load()
+    
+    return sums, counts, meta, layout
+
+
+@prf.profiled
+def time_mean_files(data_path, time_nm='Time', variables=None, workers=None,
+                    levels=None):
+    """
+    Make the average over 'Time' dimension of all data linked in the path 
+    (same result as time_mean(merge_ds(data_path), time_nm)) without 
+    building a merged dataset: sums and counts are calculated file by file 
+    in a pool of processes and then merged.
+
+    :param data_path:
+      path to data files.
+    :type data_path: string or list of strings.
+    :param time_nm:
+      name of the time time dimension. Default 'Time'.
+    :type time_nm: string.
+    :param variables:
+      variables to average (WRF coordinates are always kept). Default all.
+    :type variables: list of strings.
+    :param workers:
+      number of processes (started with spawn, so scripts calling it need 
+      an if __name__ == '__main__' guard). Default number of CPUs. 
+    :type workers: integer.
+    :param levels:
+      bottom_top levels to read (see utils.select_levels). Default all.
+    :type levels: integer, list of integers or slice.
+    :return:
+      Time averaged dataset.
+    :rtype: xarray DataSet.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from itertools import repeat
+    
+    paths = utl._get_paths_(data_path)
+    if not paths:
+        raise ValueError('No data files match %s.' % (data_path,))
+    
+    args = (paths, repeat(time_nm), repeat(variables), repeat(levels))
+    if workers == 1:
+        return _merge_partials_(map(_partial_time_sum_, *args), time_nm)
+    
+    # spawn: forked workers can hang on the netCDF/HDF5 and dask state of 
+    # the parent (e.g. files opened before).
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=prf.init_worker, 
+                             initargs=(prf.get_config(),)) as pool:
+        return _merge_partials_(pool.map(_partial_time_sum_, *args), time_nm)
+
+
+def _merge_partials_(partials, time_nm):
+    """
+    Exact merge of the partial sums and counts of time_mean_files, with the 
+    layout of time_mean: coords along time concatenated, other coords and 
+    variables without time from the first file.
+    """
+    time_coords = []
+    for i, (file_sums, file_counts, meta, layout) in enumerate(partials):
+        if i == 0:
+            sums, counts, first = file_sums, file_counts, layout
+        else:
+            sums = sums + file_sums
+            counts = counts + file_counts
+        coords = layout.coords.to_dataset()
+        time_coords.append(coords[[name for name in coords.variables 
+                                   if time_nm in coords[name].dims]])
+    
+    mean = {}
+    for var in sums.data_vars:
+        # float means as time_mean: float32 kept, integers to float64.
+        dtype = meta[var][0]
+        if not np.issubdtype(dtype, np.floating):
+            dtype = np.float64
+        mean[var] = (sums[var] / counts[var].where(counts[var] > 0)
+                     ).astype(dtype)
+        mean[var].attrs = meta[var][1]
+    mean.update(first.data_vars)
+    
+    coords = dict(first.coords)
+    coords.update(xr.concat(time_coords, dim=time_nm).variables)
+    
+    return xr.Dataset(mean, coords=coords)
+
+
+# cache of cell areas, by grid.
+_CELL_AREA = {}
+
+
+def get_cell_area(ds):
+    """
+    Area of the grid cells [m2] from grid spacing (DX, DY global attributes)
+    and map scale factors (MAPFAC_MX and MAPFAC_MY, or MAPFAC_M) of a 
+    WRF-Chem output. Computed once per grid and cached.
+
+    :param ds:
+      WRF-Chem output.
+    :type ds: xarray DataSet.
+    :return:
+      cells area (south_north, west_east).
+    :rtype: xarray DataArray.
+    """
+    key = (utl._get_latlon_(ds)[2], ds.attrs['DX'], ds.attrs['DY'])
+    
+    if key not in _CELL_AREA:
+        mapfac = []
+        for names in (['MAPFAC_MX', 'MAPFAC_MY'], ['MAPFAC_M', 'MAPFAC_M']):
+            if all(name in ds for name in names):
+                mapfac = [ds[name] for name in names]
+                break
+        if not mapfac:
+            raise KeyError('No map scale factors (MAPFAC_M) in dataset.')
+        
+        # first time step only.
+        for i, mf in enumerate(mapfac):
+            for dim in mf.dims:
+                if dim not in ('south_north', 'west_east'):
+                    mf = mf.isel({dim: 0}, drop=True)
+            mapfac[i] = mf.reset_coords(drop=True).load()
+        
+        area = ds.attrs['DX'] * ds.attrs['DY'] / (mapfac[0] * mapfac[1])
+        area.attrs = {'units': 'm2'}
+        _CELL_AREA[key] = area.rename('cell_area')
+    
+    return _CELL_AREA[key]
+
+
+@prf.profiled
+def space_mean(ds, weights=None, mask=None):
  """
   Make the average over latitute and longitude dimension of a DataSet.
+  With weights (e.g. 'area') the average is weighted, as a single 
+  multiply-reduce over all variables.
 
   :param ds:
     dataset to be averaged.
   :type ds: xarray DataSet.
+  :param weights:
+    'area' for weights from cells area (see get_cell_area) or weights 
+    (south_north, west_east). Default no weights.
+  :type weights: string or xarray DataArray.
+  :param mask:
+    average only cells where mask is True. Default no mask.
+  :type mask: xarray DataArray.
   :return:
-    Time averaged ds.
+    Space averaged ds.
   :rtype: xarray DataSet.
  """
- return xr.Dataset(dict(ds.mean(dim= ['south_north','west_east'],
+ dims = ['south_north', 'west_east']
+ 
+ if weights is None and mask is None:
+     return xr.Dataset(dict(ds.mean(dim= dims,
                      keep_attrs=True, skipna=True).data_vars), 
                      coords=dict(ds.coords))
+ 
+ if weights is None:
+     weights = xr.ones_like(mask, dtype=float)
+ elif isinstance(weights, str):
+     if weights != 'area':
+         raise ValueError("Unknown weights %s, use 'area' or a DataArray."
+                          % weights)
+     weights = get_cell_area(ds)
+ if mask is not None:
+     weights = weights.where(mask, 0)
+ 
+ names = [var for var in ds.data_vars 
+          if np.issubdtype(ds[var].dtype, np.number)]
+ mean = ds[names].weighted(weights).mean(dim=dims, keep_attrs=True, 
+                                         skipna=True)
+ 
+ return xr.Dataset(dict(mean.data_vars), coords=dict(ds.coords))
+
+
+# number of (grid, lat/long limits) index slices cached by space_subset.
+SUBSET_CACHE_SIZE = 64
+
+
+class _Grid(object):
+    """
+    XLAT and XLONG of a grid, hashable by the grid key (for lru_cache).
+    """
+    
+    def __init__(self, lat, lon, key):
+        self.lat, self.lon, self.key = lat, lon, key
+    
+    def __hash__(self):
+        return hash(self.key)
+    
+    def __eq__(self, other):
+        return self.key == other.key
 
 
-def space_subset(ds, lat_lim, long_lim ):
+@lru_cache(maxsize=SUBSET_CACHE_SIZE)
+def _subset_index_(grid, lat_lim, long_lim):
+    """
+    Index slices and mask of _get_subset_index_ (cached).
+    """
+    lat, lon = grid.lat, grid.lon
+    inside = ((long_lim[0] < lon) & (lon < long_lim[1]) & 
+              (lat_lim[0] < lat) & (lat < lat_lim[1]))
+    rows = np.flatnonzero(inside.any(axis=1))
+    cols = np.flatnonzero(inside.any(axis=0))
+    
+    if rows.size == 0:
+        sn, we = slice(0, 0), slice(0, 0)
+    else:
+        sn = slice(rows[0], rows[-1] + 1)
+        we = slice(cols[0], cols[-1] + 1)
+    
+    return sn, we, inside[sn, we]
+
+
+def _get_subset_index_(ds, lat_lim, long_lim):
+    """
+    Index slices (south_north, west_east) of the cells within lat and long 
+    limits and mask of the cells inside the limits within the slices. 
+    Cached by grid and limits (least recently used SUBSET_CACHE_SIZE).
+    """
+    lat, lon, key = utl._get_latlon_(ds)
+    
+    return _subset_index_(_Grid(lat, lon, key), tuple(lat_lim), 
+                          tuple(long_lim))
+
+
+@prf.profiled
+def space_subset(ds, lat_lim, long_lim, mask=True):
     """
     Extract spatial subset of a dataset given lat and long limits.
+    The limits are converted (once per grid) to south_north and west_east 
+    index slices, so that the subset is a plain isel (lazy on dask data).
 
    :param ds: 
      dataset.
   :type ds: xarray DataSet.
+  :param lat_lim: 
+     (min, max) latitude.
+  :type lat_lim: tuple.
+  :param long_lim: 
+     (min, max) longitude.
+  :type long_lim: tuple.
+  :param mask: 
+     mask with NaN the cells outside the limits on the edges of a 
+     curvilinear grid. Default True.
+  :type mask: bool.
   :return:
      subset of dataset.
   :rtype: xarray DataSet.
  """
     
-    s_subset=ds.where((long_lim[0] < ds.XLONG) & (ds.XLONG < long_lim[1]) & 
-                (lat_lim[0] < ds.XLAT) & (ds.XLAT < lat_lim[1]), drop=True)
+    sn, we, inside = _get_subset_index_(ds, lat_lim, long_lim)
+    
+    s_subset = ds.isel(south_north=sn, west_east=we)
+    
+    # mask only the ragged edges.
+    if mask and not inside.all():
+        inside = xr.DataArray(inside, dims=('south_north', 'west_east'))
+        for var in s_subset.data_vars:
+            if set(inside.dims) <= set(s_subset[var].dims):
+                s_subset[var] = s_subset[var].where(inside)
   
-    return s_subset
\ No newline at end of file
+    return s_subset
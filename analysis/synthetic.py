@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic WRF-Chem outputs (wrfout-like datasets) for tests and benchmarks.
+
+Datasets have the variables of the aerosol table of the given chem_opt
+(size bins, ALT, P, PB, T, condensable vapours), some gases, map factors,
+WRF coordinates and global attributes. Diagnostics PM2_5_DRY and PM10 are
+consistent with the species bins, as in WRF-Chem module_mosaic_sumpm.F.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from WRFChemToolkit.analysis import mechanisms as mch
+
+
+# WRF dimensions of 3D variables.
+DIMS = ('Time', 'bottom_top', 'south_north', 'west_east')
+
+
+def make_wrfout(nx=50, ny=40, nz=5, nt=6, chem_opt=202,
+                start='2010-04-01', freq='h', dx=27000., center=(25., 80.),
+                dtype='float32', seed=0):
+    """
+    Create a synthetic WRF-Chem output dataset.
+
+    :param nx: number of west_east cells. Default 50.
+    :type nx: integer
+    :param ny: number of south_north cells. Default 40.
+    :type ny: integer
+    :param nz: number of bottom_top levels. Default 5.
+    :type nz: integer
+    :param nt: number of time steps. Default 6.
+    :type nt: integer
+    :param chem_opt: WRF-Chem chem_opt (see mechanisms.get_chem_opts).
+     Default 202.
+    :type chem_opt: integer
+    :param start: first time. Default '2010-04-01'.
+    :type start: string
+    :param freq: output frequency. Default 'h' (hourly).
+    :type freq: string
+    :param dx: grid spacing [m]. Default 27000.
+    :type dx: float
+    :param center: (lat, long) of the domain center. Default (25, 80).
+    :type center: tuple
+    :param dtype: dtype of the variables. Default 'float32'.
+    :type dtype: string
+    :param seed: random seed. Default 0.
+    :type seed: integer
+    :return: WRF-Chem output like dataset.
+    :rtype: xarray DataSet.
+    """
+    rng = np.random.default_rng(seed)
+    mech = mch.get_mechanism(chem_opt)
+    shape = (nt, nz, ny, nx)
+    times = pd.date_range(start, periods=nt, freq=freq)
+
+    # curvilinear grid (Lambert-like: latitude varies with longitude).
+    deg = dx / 111000.
+    j, i = np.meshgrid(np.arange(ny) - ny / 2., np.arange(nx) - nx / 2.,
+                       indexing='ij')
+    lat = center[0] + j * deg + 0.02 * deg * i**2 / max(nx, 1)
+    lon = center[1] + i * deg / np.cos(np.deg2rad(lat))
+    mapfac = 1. / np.cos(np.deg2rad(lat - center[0]))
+
+    def _field_(low=0., high=1.):
+        return (low + (high - low) * rng.random(shape)).astype(dtype)
+
+    ds = xr.Dataset(coords=dict(
+        Time=('Time', times),
+        XTIME=('Time', times),
+        XLAT=(('Time', 'south_north', 'west_east'),
+              np.broadcast_to(lat, (nt, ny, nx)).astype(dtype)),
+        XLONG=(('Time', 'south_north', 'west_east'),
+               np.broadcast_to(lon, (nt, ny, nx)).astype(dtype))))
+
+    ds['Times'] = ('Time', np.array(times.strftime('%Y-%m-%d_%H:%M:%S'),
+                                    dtype='S19'))
+    for name in ('MAPFAC_M', 'MAPFAC_MX', 'MAPFAC_MY'):
+        ds[name] = (('Time', 'south_north', 'west_east'),
+                    np.broadcast_to(mapfac, (nt, ny, nx)).astype(dtype))
+
+    # state variables.
+    ds['ALT'] = (DIMS, _field_(0.8, 1.2))
+    ds['ALT'].attrs['units'] = 'm3 kg-1'
+    ds['P'] = (DIMS, _field_(0., 1000.))
+    ds['PB'] = (DIMS, _field_(50000., 100000.))
+    ds['T'] = (DIMS, _field_(-10., 20.))
+
+    # aerosols (ug/kg-dryair) and condensable vapours (ppmv).
+    for name in mech.get_variables():
+        if name not in ds:
+            ds[name] = (DIMS, _field_(0., 2.))
+            ds[name].attrs['units'] = 'ug/kg-dryair'
+    for name in mech.cond_vap:
+        ds[name].attrs['units'] = 'ppmv'
+
+    # gases (ppmv).
+    for name in ('so2', 'no2', 'nh3', 'o3'):
+        ds[name] = (DIMS, _field_(0., 0.01))
+        ds[name].attrs['units'] = 'ppmv'
+
+    # diagnostics consistent with the dry species bins.
+    dry = [sp for sp in mech.species if sp != 'water']
+    for name, nbins in (('PM2_5_DRY', mech.cutoffs['pm25']),
+                        ('PM10', mech.nbins)):
+        bins = range(1, nbins + 1)
+        total = sum(ds[sp + '_a%02d' % b].values.astype('float64')
+                    for sp in dry for b in bins)
+        ds[name] = (DIMS, (total / ds['ALT'].values).astype(dtype))
+        ds[name].attrs['units'] = 'ug m-3'
+
+    ds.attrs.update(DX=dx, DY=dx, CHEM_OPT=int(chem_opt), GRID_ID=1,
+                    MAP_PROJ=1, CEN_LAT=center[0], CEN_LON=center[1],
+                    MOAD_CEN_LAT=center[0], STAND_LON=center[1],
+                    TRUELAT1=center[0] - 5., TRUELAT2=center[0] + 5.,
+                    TITLE='Synthetic WRF-Chem output')
+
+    return ds
+
+
+def make_archive(out_dir, n_files=24, steps_per_file=1, domain='d01',
+                 start='2010-04-01', freq='h', **kwargs):
+    """
+    Write synthetic WRF-Chem output files wrfout_<domain>_<time> (e.g. an
+    hourly archive) to a directory.
+
+    :param out_dir: directory for the files.
+    :type out_dir: string
+    :param n_files: number of files. Default 24.
+    :type n_files: integer
+    :param steps_per_file: time steps of each file. Default 1.
+    :type steps_per_file: integer
+    :param domain: WRF domain. Default 'd01'.
+    :type domain: string
+    :param start: first time. Default '2010-04-01'.
+    :type start: string
+    :param freq: output frequency. Default 'h'.
+    :type freq: string
+    :param kwargs: other arguments of make_wrfout (nx, ny, nz, chem_opt..).
+    :return: paths of the files.
+    :rtype: list of strings.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    seed = kwargs.pop('seed', 0)
+    times = pd.date_range(start, periods=n_files * steps_per_file, freq=freq)
+
+    paths = []
+    for n in range(n_files):
+        first = times[n * steps_per_file]
+        ds = make_wrfout(nt=steps_per_file, start=first, freq=freq,
+                         seed=seed + n, **kwargs)
+        path = os.path.join(out_dir, 'wrfout_%s_%s' % (
+                            domain, first.strftime('%Y-%m-%d_%H:%M:%S')))
+        ds.to_netcdf(path)
+        paths.append(path)
+
+    return paths
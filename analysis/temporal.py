@@ -0,0 +1,604 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming temporal aggregations of WRF-Chem outputs.
+
+TemporalAggregator computes, in a single pass over time-ordered files,
+daily and monthly means, daily maxima, rolling N-hour means (and their
+daily maxima) and counts of exceedances of thresholds (e.g. the 24-h
+PM2.5 standard). Days and months spanning several files are kept open
+(running sums, counts and maxima) until a later time is seen; rolling
+windows carry the last N-1 time steps over file boundaries. Memory is
+bounded by one file and the daily/monthly outputs.
+
+DiurnalAggregator computes diurnal cycle composites by local hour of each
+grid column (from XLONG or a timezone raster), in a single pass as well.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from WRFChemToolkit.analysis import profiling as prf
+from WRFChemToolkit.analysis import utils as utl
+
+
+# metrics which exceedances can be counted on ('rolling_<N>' for rolling
+# N-hour means).
+METRICS = ['hourly', 'daily_mean', 'daily_max']
+
+
+class _Periods(object):
+    """
+    Running sums, counts and maxima of the open periods (days or months),
+    and the completed ones.
+    """
+
+    def __init__(self, freq, min_fraction=None):
+
+        self.freq = freq
+        self.min_fraction = min_fraction
+        self.step = None  # time step, for the completeness of periods.
+        self.open = {}  # label -> dict(sum, count, max)
+        self.done = []  # (label, dict(mean, max)) of completed periods.
+
+    def _get_min_count_(self, label):
+        """
+        Minimum number of valid time steps of a period (None if any).
+        """
+        if self.min_fraction is None or self.step is None:
+            return None
+        period = pd.Period(label, freq=self.freq)
+        length = period.end_time - period.start_time + pd.Timedelta(1, 'ns')
+
+        return int(np.ceil(self.min_fraction * (length // self.step)))
+
+    def labels(self, times):
+        """
+        Period label (start time) of each time.
+        """
+        return pd.DatetimeIndex(times).to_period(self.freq).to_timestamp()
+
+    def update(self, x, time_nm):
+        """
+        Add the time steps of x (float64 dataset) to their periods.
+        """
+        labels = xr.DataArray(self.labels(x[time_nm].values), dims=time_nm,
+                              coords={time_nm: x[time_nm]}, name='period')
+        groups = x.groupby(labels)
+        new = dict(sum=groups.sum(skipna=True), count=groups.count(),
+                   max=groups.max(skipna=True))
+
+        for label in np.unique(labels.values):
+            part = {stat: value.sel(period=label, drop=True)
+                    for stat, value in new.items()}
+            if label not in self.open:
+                self.open[label] = part
+                continue
+            old = self.open[label]
+            old['sum'] = old['sum'] + part['sum']
+            old['count'] = old['count'] + part['count']
+            old['max'] = np.fmax(old['max'], part['max'])
+
+    def close(self, before=None):
+        """
+        Complete the open periods with label before a time (all if None).
+        Return the completed periods (label, dict(mean, max)).
+        """
+        closed = []
+        for label in sorted(self.open):
+            if before is not None and label >= before:
+                continue
+            part = self.open.pop(label)
+            count = part['count']
+            min_count = self._get_min_count_(label)
+            if min_count is not None:
+                count = count.where(count >= min_count, 0)
+            closed.append((label, dict(
+                mean=part['sum'] / count.where(count > 0),
+                max=part['max'].where(count > 0))))
+
+        self.done.extend(closed)
+
+        return closed
+
+
+class TemporalAggregator(object):
+    """
+    Daily, monthly, rolling means, daily maxima and exceedance counts of
+    the variables of WRF-Chem outputs, updated file by file. Files must be
+    given in time order, with regular (e.g. hourly) time steps for the
+    rolling means.
+
+    :param time_nm: name of the time dimension. Default 'Time'.
+    :type time_nm: string
+    :param variables: variables to aggregate. Default all the numeric
+     variables with time dimension.
+    :type variables: list of strings.
+    :param rolling: lengths (number of time steps, e.g. hours) of the
+     rolling means. Default (24, 8).
+    :type rolling: tuple of integers.
+    :param thresholds: exceedances to count, name -> (variable, metric,
+     threshold), metric in METRICS or 'rolling_<N>', e.g.
+     {'pm25_24h': ('pm25_tot', 'daily_mean', 60.)}. Default None.
+    :type thresholds: dict
+    :param keep_rolling: keep the full rolling means series (as large as
+     the input). Default False (only their daily maxima).
+    :type keep_rolling: bool
+    :param preprocess: function applied to the dataset of each file
+     (e.g. to get derived aerosols variables). Default None.
+    :type preprocess: function
+    :param min_fraction: minimum fraction of valid time steps of a day (or
+     month) for its mean and maximum, e.g. 0.75 (18 of 24 hours); days and
+     months below it are NaN. The time step is taken from the data.
+     Default None (any valid time step).
+    :type min_fraction: float
+    """
+
+    def __init__(self, time_nm='Time', variables=None, rolling=(24, 8),
+                 thresholds=None, keep_rolling=False, preprocess=None,
+                 min_fraction=None):
+
+        self.time_nm = time_nm
+        self.variables = variables
+        self.rolling = tuple(int(n) for n in rolling)
+        self.thresholds = dict(thresholds or {})
+        self.keep_rolling = keep_rolling
+        self.preprocess = preprocess
+
+        for name, (var, metric, value) in self.thresholds.items():
+            if metric not in METRICS and metric not in [
+                    'rolling_%d' % n for n in self.rolling]:
+                raise ValueError('Unknown metric %s for %s.' % (metric, name))
+
+        self.files = []
+        self.last_time = None
+        self.coords = None
+        self.attrs = {}
+        self.min_fraction = min_fraction
+        self.days = _Periods('D', min_fraction)
+        self.months = _Periods('M', min_fraction)
+        self.buffers = {}  # N -> last N-1 time steps.
+        self.rolling_days = {n: _Periods('D') for n in self.rolling}
+        self.rolling_series = {n: [] for n in self.rolling}
+        self.counts = {}   # threshold name -> exceedances count.
+
+    def _count_(self, metric, values):
+        """
+        Add the exceedances of the thresholds on a metric.
+        """
+        for name, (var, thr_metric, value) in self.thresholds.items():
+            if thr_metric != metric:
+                continue
+            count = (values[var] > value).sum(dim=self.time_nm)
+            if name in self.counts:
+                count = self.counts[name] + count
+            self.counts[name] = count.load()
+
+    def _close_days_(self, before=None):
+        """
+        Complete the days (and months) before a time, counting daily
+        exceedances.
+        """
+        for label, day in self.days.close(before):
+            for metric, stat in (('daily_mean', 'mean'), ('daily_max', 'max')):
+                self._count_(metric, day[stat].expand_dims(
+                    {self.time_nm: [label]}))
+        for n, periods in self.rolling_days.items():
+            periods.close(before)
+
+        month = None
+        if before is not None:
+            month = self.months.labels([before])[0]
+        self.months.close(month)
+
+    @prf.profiled
+    def update(self, ds):
+        """
+        Add the time steps of a dataset to the aggregations.
+
+        :param ds: WRF-Chem output (e.g. a single file), after the last
+         added time.
+        :type ds: xarray DataSet.
+        """
+        t = self.time_nm
+        if self.preprocess is not None:
+            ds = self.preprocess(ds)
+
+        if t not in ds.indexes and 'XTIME' in ds.coords:
+            ds = ds.assign_coords({t: ds['XTIME'].values})
+        times = pd.DatetimeIndex(ds[t].values)
+        if self.last_time is not None and times[0] <= self.last_time:
+            raise ValueError('Times must be after %s.' % self.last_time)
+
+        # time step (regular), from this or the previous file.
+        if self.days.step is None:
+            previous = [] if self.last_time is None else [self.last_time]
+            steps = np.diff(pd.DatetimeIndex(previous).append(times))
+            if len(steps):
+                for periods in (self.days, self.months):
+                    periods.step = pd.Timedelta(steps.min())
+
+        names = self.variables
+        if names is None:
+            names = [var for var in ds.data_vars if t in ds[var].dims
+                     and np.issubdtype(ds[var].dtype, np.number)]
+        x = ds[names].reset_coords(drop=True).astype('float64').load()
+
+        if self.coords is None:
+            self.coords = {nm: (c.isel({t: 0}, drop=True) if t in c.dims
+                                else c).load()
+                           for nm, c in ds.coords.items()
+                           if nm not in (t, 'XTIME')}
+            self.attrs = {var: dict(ds[var].attrs) for var in names}
+
+        self.days.update(x, t)
+        self.months.update(x, t)
+        self._count_('hourly', x)
+
+        # rolling means, with the last N-1 steps of the previous files.
+        for n in self.rolling:
+            y = x
+            if n in self.buffers:
+                y = xr.concat([self.buffers[n], x], dim=t)
+            mean = y.rolling({t: n}, min_periods=n).mean()
+            mean = mean.isel({t: slice(y.sizes[t] - x.sizes[t], None)})
+            self.buffers[n] = y.isel({t: slice(max(y.sizes[t] - n + 1, 0),
+                                               None)})
+
+            self.rolling_days[n].update(mean, t)
+            self._count_('rolling_%d' % n, mean)
+            if self.keep_rolling:
+                self.rolling_series[n].append(mean)
+
+        self.last_time = times[-1]
+        # days before the last one are complete.
+        self._close_days_(times[-1].floor('D'))
+
+    def update_file(self, path):
+        """
+        Add the time steps of a file to the aggregations. Files already
+        added are skipped.
+
+        :param path: path to the WRF-Chem output file.
+        :type path: string
+        :return: True if the file was added.
+        :rtype: bool
+        """
+        path = os.path.abspath(path)
+        if path in self.files:
+            return False
+
+        drop = None
+        if self.variables is not None and self.preprocess is None:
+            drop = utl._get_drop_list_([path], self.variables)
+
+        with xr.open_dataset(path, drop_variables=drop) as ds:
+            self.update(ds)
+        self.files.append(path)
+
+        return True
+
+    def finish(self):
+        """
+        Complete the open days and months (e.g. at the end of the archive).
+        """
+        self._close_days_()
+
+    def _finalize_(self, periods, stat):
+        """
+        Dataset (time_nm = period start) of a statistic of the completed
+        periods, with the variables attributes and coords.
+        """
+        if not periods:
+            return xr.Dataset(coords=self.coords)
+
+        labels = [label for label, _ in periods]
+        out = xr.concat([part[stat] for _, part in periods],
+                        dim=pd.DatetimeIndex(labels, name=self.time_nm))
+        for var in out.data_vars:
+            out[var].attrs = self.attrs.get(var, {})
+
+        return out.assign_coords(self.coords)
+
+    def daily_mean(self):
+        """
+        Daily means of the completed days.
+        """
+        return self._finalize_(self.days.done, 'mean')
+
+    def daily_max(self):
+        """
+        Daily maxima of the completed days.
+        """
+        return self._finalize_(self.days.done, 'max')
+
+    def monthly_mean(self):
+        """
+        Monthly means of the completed months.
+        """
+        return self._finalize_(self.months.done, 'mean')
+
+    def rolling_daily_max(self, n=8):
+        """
+        Daily maxima of the rolling n-step means (each mean assigned to the
+        day of its last time step), e.g. MDA8 with n=8.
+
+        :param n: length of the rolling mean. Default 8.
+        :type n: integer
+        """
+        return self._finalize_(self.rolling_days[n].done, 'max')
+
+    def rolling_mean(self, n=24):
+        """
+        Rolling n-step means (labelled by their last time step), if kept.
+
+        :param n: length of the rolling mean. Default 24.
+        :type n: integer
+        """
+        if not self.keep_rolling:
+            raise ValueError('Rolling means not kept (keep_rolling=False).')
+
+        out = xr.concat(self.rolling_series[n], dim=self.time_nm)
+        for var in out.data_vars:
+            out[var].attrs = self.attrs.get(var, {})
+
+        return out.assign_coords(self.coords)
+
+    def exceedances(self):
+        """
+        Counts of exceedances of the thresholds: number of time steps
+        (hourly, rolling) or completed days (daily_mean, daily_max) above
+        the threshold.
+
+        :return: count of each threshold name.
+        :rtype: xarray DataSet.
+        """
+        out = xr.Dataset({name: count for name, count in self.counts.items()})
+        for name, (var, metric, value) in self.thresholds.items():
+            if name in out:
+                out[name].attrs = dict(variable=var, metric=metric,
+                                       threshold=value)
+
+        return out.assign_coords(self.coords)
+
+
+@prf.profiled
+def aggregate_files(data_path, **kwargs):
+    """
+    Temporal aggregations (see TemporalAggregator) of all the data linked
+    in the path, file by file.
+
+    :param data_path: path to data files.
+    :type data_path: string or list of strings.
+    :param kwargs: arguments of TemporalAggregator.
+    :return: aggregator with all the days and months completed.
+    :rtype: TemporalAggregator
+    """
+    agg = TemporalAggregator(**kwargs)
+    for path in utl._get_paths_(data_path):
+        agg.update_file(path)
+    agg.finish()
+
+    return agg
+
+
+# cache of local time offsets, by grid and timezone.
+_LOCAL_OFFSET = {}
+
+
+def get_local_offset(ds, timezone=None):
+    """
+    Local time offset [hours] from UTC of each grid column: local mean
+    solar time from XLONG (XLONG / 15), or from a timezone raster or a
+    single offset (e.g. 5.5 for IST). Computed once per grid and cached.
+
+    :param ds: WRF-Chem output (or dataset with XLAT and XLONG coords).
+    :type ds: xarray.Dataset
+    :param timezone: offsets [hours] (south_north, west_east) or single
+     offset. Default None (solar time from XLONG).
+    :type timezone: xarray.DataArray or float
+    :return: offsets (south_north, west_east).
+    :rtype: numpy.ndarray
+    """
+    lat, lon, key = utl._get_latlon_(ds)
+
+    if isinstance(timezone, xr.DataArray):
+        timezone = timezone.transpose('south_north', 'west_east').values
+        tz_key = hash(np.ascontiguousarray(timezone, float).tobytes())
+    else:
+        tz_key = timezone
+
+    if (key, tz_key) not in _LOCAL_OFFSET:
+        if timezone is None:
+            offset = (lon + 180.) % 360. - 180.
+            offset = offset / 15.
+        else:
+            offset = np.broadcast_to(np.asarray(timezone, float), lon.shape)
+        _LOCAL_OFFSET[(key, tz_key)] = np.array(offset, dtype=float)
+
+    return _LOCAL_OFFSET[(key, tz_key)]
+
+
+class DiurnalAggregator(object):
+    """
+    Local time diurnal cycle composites (24 hourly bins) of the variables
+    of WRF-Chem outputs, updated file by file. Each time step is binned by
+    the local hour of each grid column (UTC time + local offset, see
+    get_local_offset), and sums and counts of all the bins are accumulated
+    at once for each variable (numpy bincount).
+
+    :param time_nm: name of the time dimension. Default 'Time'.
+    :type time_nm: string
+    :param variables: variables to aggregate. Default all the numeric
+     variables with time and grid dimensions.
+    :type variables: list of strings.
+    :param timezone: local time offsets (see get_local_offset). Default
+     None (solar time from XLONG).
+    :type timezone: xarray.DataArray or float
+    :param preprocess: function applied to the dataset of each file
+     (e.g. to get derived aerosols variables). Default None.
+    :type preprocess: function
+    """
+
+    def __init__(self, time_nm='Time', variables=None, timezone=None,
+                 preprocess=None):
+
+        self.time_nm = time_nm
+        self.variables = variables
+        self.timezone = timezone
+        self.preprocess = preprocess
+
+        self.files = []
+        self.coords = None
+        self.attrs = {}
+        self.dims = {}   # variable -> (dim, size) of non grid dims.
+        self.sums = {}   # variable -> (24, other, cells) sums.
+        self.counts = {} # variable -> (24, other, cells) counts.
+
+    def _get_bins_(self, ds, times):
+        """
+        Local hour bin (time, cells) of each time step and grid column.
+        """
+        offset = get_local_offset(ds, self.timezone).ravel()
+        hours = (times - times.normalize()) / pd.Timedelta(hours=1)
+
+        return (np.floor(np.asarray(hours)[:, None] + offset[None, :])
+                .astype(int) % 24)
+
+    @prf.profiled
+    def update(self, ds):
+        """
+        Add the time steps of a dataset to the composites.
+
+        :param ds: WRF-Chem output (e.g. a single file).
+        :type ds: xarray DataSet.
+        """
+        t = self.time_nm
+        grid = ('south_north', 'west_east')
+        if self.preprocess is not None:
+            ds = self.preprocess(ds)
+
+        times = ds['XTIME'] if t not in ds.indexes else ds[t]
+        times = pd.DatetimeIndex(times.values)
+        bins = self._get_bins_(ds, times)
+        n_cells = bins.shape[1]
+
+        names = self.variables
+        if names is None:
+            names = [var for var in ds.data_vars
+                     if set((t,) + grid) <= set(ds[var].dims)
+                     and np.issubdtype(ds[var].dtype, np.number)]
+
+        if self.coords is None:
+            self.coords = {nm: (c.isel({t: 0}, drop=True) if t in c.dims
+                                else c).load()
+                           for nm, c in ds.coords.items()
+                           if nm not in (t, 'XTIME')}
+            self.attrs = {var: dict(ds[var].attrs) for var in names}
+
+        for var in names:
+            other = [dim for dim in ds[var].dims if dim not in (t,) + grid]
+            values = ds[var].transpose(t, *other, *grid).values
+            values = values.reshape(len(times), -1, n_cells)
+            n_other = values.shape[1]
+
+            # flat index of (bin, other, cell) of each value.
+            index = ((bins[:, None, :] * n_other
+                      + np.arange(n_other)[None, :, None]) * n_cells
+                     + np.arange(n_cells)[None, None, :])
+            valid = np.isfinite(values)
+            size = 24 * n_other * n_cells
+            sums = np.bincount(index[valid], weights=values[valid],
+                               minlength=size)
+            counts = np.bincount(index[valid], minlength=size)
+
+            if var not in self.sums:
+                self.dims[var] = [(dim, ds.sizes[dim]) for dim in other]
+                self.sums[var] = sums
+                self.counts[var] = counts
+            else:
+                self.sums[var] += sums
+                self.counts[var] += counts
+
+    def update_file(self, path):
+        """
+        Add the time steps of a file to the composites. Files already
+        added are skipped.
+
+        :param path: path to the WRF-Chem output file.
+        :type path: string
+        :return: True if the file was added.
+        :rtype: bool
+        """
+        path = os.path.abspath(path)
+        if path in self.files:
+            return False
+
+        drop = None
+        if self.variables is not None and self.preprocess is None:
+            drop = utl._get_drop_list_([path], self.variables)
+
+        with xr.open_dataset(path, drop_variables=drop) as ds:
+            self.update(ds)
+        self.files.append(path)
+
+        return True
+
+    def composite(self, how='mean'):
+        """
+        Diurnal composites: dims ('hour', ..., south_north, west_east), with
+        local hours 0-23. Can be reduced by region (IGP.regional_reduce)
+        or space_mean and plotted with plots.time_series(ds.hour, ...).
+
+        :param how: 'mean' or 'count'. Default 'mean'.
+        :type how: string
+        :return: composites dataset.
+        :rtype: xarray DataSet.
+        """
+        lat = self.coords['XLAT']
+        ny, nx = lat.sizes['south_north'], lat.sizes['west_east']
+
+        out = xr.Dataset(coords=self.coords)
+        for var in self.sums:
+            other = self.dims[var]
+            shape = [24] + [size for _, size in other] + [ny, nx]
+            dims = ['hour'] + [dim for dim, _ in other] + ['south_north',
+                                                          'west_east']
+            counts = self.counts[var].reshape(shape)
+            if how == 'count':
+                values = counts
+            else:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    values = np.where(counts > 0, self.sums[var].reshape(shape)
+                                      / counts, np.nan)
+            out[var] = (dims, values)
+            out[var].attrs = self.attrs.get(var, {})
+
+        out = out.assign_coords(hour=np.arange(24))
+        out['hour'].attrs = dict(long_name='local hour',
+                                 timezone='solar (XLONG)'
+                                 if self.timezone is None else 'raster')
+
+        return out
+
+
+@prf.profiled
+def diurnal_files(data_path, **kwargs):
+    """
+    Local time diurnal composites (see DiurnalAggregator) of all the data
+    linked in the path, file by file.
+
+    :param data_path: path to data files.
+    :type data_path: string or list of strings.
+    :param kwargs: arguments of DiurnalAggregator.
+    :return: composites dataset (see DiurnalAggregator.composite).
+    :rtype: xarray DataSet.
+    """
+    agg = DiurnalAggregator(**kwargs)
+    for path in utl._get_paths_(data_path):
+        agg.update_file(path)
+
+    return agg.composite()
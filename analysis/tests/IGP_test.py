@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for functions/IGP.py functions (regional reductions on a synthetic
+region-label grid).
+"""
+
+import json
+import os
+import tempfile
+
+import numpy as np
+import xarray as xr
+
+import sys
+sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
+from WRFChemToolkit.analysis import IGP
+from WRFChemToolkit.analysis import catalog as cat
+from WRFChemToolkit.analysis import synthetic as syn
+
+# synthetic output and labels of 7 states (IN.UP in 2 parts, BD.DH absent).
+ds = syn.make_wrfout(chem_opt=202, nx=12, ny=10, nz=2, nt=3)
+ds = ds[['PM2_5_DRY', 'PM10']]
+ds['PM10'][0, 0, 0, :] = np.nan
+codes = ['PK.SD', 'IN.PB', 'IN.DL', 'IN.UP', 'IN.WB', 'BD.DH', 'IN.UP']
+values = np.random.RandomState(0).choice([0, 1, 2, 3, 4, 5, 7], size=(10, 12))
+labels = xr.DataArray(values.astype('int16'),
+                      dims=('south_north', 'west_east'),
+                      attrs={'codes': json.dumps(codes)})
+
+regions = {'IGP': codes, 'U_IGP': ['PK.SD', 'IN.PB'],
+           'M_IGP': ['IN.DL', 'IN.UP'], 'L_IGP': ['IN.WB', 'BD.DH'],
+           'IN.UP': ['IN.UP'], 'BD.DH': ['BD.DH']}
+
+#TEST1: groups of labels of each region and state.
+print('Testing region groups')
+groups = IGP._get_groups_(labels, states=True)
+for region, region_codes in regions.items():
+    assert groups[region] == [i + 1 for i, code in enumerate(codes)
+                              if code in region_codes], region
+assert set(groups) == set(['IGP', 'U_IGP', 'M_IGP', 'L_IGP'] + codes)
+assert set(IGP._get_groups_(labels)) == set(['IGP', 'U_IGP', 'M_IGP',
+                                             'L_IGP'])
+
+#TEST2: regional means and sums vs masked reductions.
+print('Testing regional_reduce')
+for how in ('mean', 'sum'):
+    out = IGP.regional_reduce(ds, labels, how=how)
+    assert list(out['region'].values) == list(groups)
+    for region, region_codes in regions.items():
+        mask = xr.DataArray(np.isin(values, groups[region]),
+                            dims=('south_north', 'west_east'))
+        for var in ds.data_vars:
+            masked = ds[var].where(mask)
+            ref = getattr(masked, how)(dim=('south_north', 'west_east'))
+            np.testing.assert_allclose(out[var].sel(region=region).values,
+                                       ref.values, rtol=1e-05)
+            assert out[var].attrs == ds[var].attrs
+assert IGP.regional_reduce(ds, labels)['PM10'].sel(region='BD.DH').isnull(
+    ).all()
+
+#TEST3: catalog query matching no files.
+print('Testing catalog without files')
+data_dir = tempfile.mkdtemp()
+db_path = os.path.join(data_dir, 'catalog.db')
+syn.make_archive(data_dir, n_files=2, nx=6, ny=5, nz=2)
+data_path = os.path.join(data_dir, 'wrfout_d01_*')
+cat.update_catalog(db_path, data_path)
+for func in (IGP.get_IGP, IGP.get_IGP_means):
+    try:
+        func(data_path, 'IGP.shp', catalog=db_path,
+             time_window=('2020-01-01', '2020-01-02'))
+        raise AssertionError('No ValueError without files.')
+    except ValueError as err:
+        assert 'wrfout_d01_*' in str(err)
+
+#TEST4: region labels rasterized once, cached in memory and on disk.
+try:
+    import geopandas as gpd
+    import salem
+    from shapely.geometry import box
+except ImportError:
+    salem = None
+    print('Skipping get_region_labels (salem or geopandas not available)')
+
+if salem is not None:
+    print('Testing get_region_labels')
+    path = os.path.join(data_dir, 'wrfout_d01_labels')
+    ds.to_netcdf(path)
+    grid_ds = salem.open_wrf_dataset(path)
+    lat, lon = ds.XLAT.values[0], ds.XLONG.values[0]
+    mid = float(np.median(lon))
+    shp_path = os.path.join(data_dir, 'IGP.shp')
+    gpd.GeoDataFrame(
+        {'HASC_1': ['IN.DL', 'IN.WB']},
+        geometry=[box(lon.min() - 1, lat.min() - 1, mid, lat.max() + 1),
+                  box(mid, lat.min() - 1, lon.max() + 1, lat.max() + 1)],
+        crs='EPSG:4326').to_file(shp_path)
+
+    cache_dir = os.path.join(data_dir, 'cache')
+    grid_labels = IGP.get_region_labels(grid_ds, shp_path, cache_dir)
+    assert json.loads(grid_labels.attrs['codes']) == ['IN.DL', 'IN.WB']
+    assert grid_labels.dims == ('south_north', 'west_east')
+    assert set(np.unique(grid_labels.values)) <= set([0, 1, 2])
+    assert (grid_labels.values == 1).any() and (grid_labels.values == 2).any()
+    assert IGP.get_region_labels(grid_ds, shp_path) is grid_labels
+    IGP._LABELS.clear()
+    cached = IGP.get_region_labels(grid_ds, shp_path, cache_dir)
+    np.testing.assert_array_equal(cached.values, grid_labels.values)
+    assert len(os.listdir(cache_dir)) == 1
+
+print('All tests passed for IGP!')
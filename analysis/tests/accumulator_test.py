@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for functions/accumulator.py (incremental statistics).
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import xarray as xr
+
+import sys
+sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
+from WRFChemToolkit.analysis import accumulator as acm
+from WRFChemToolkit.analysis import statistics as st
+from WRFChemToolkit.analysis import synthetic as syn
+
+# synthetic archive, 4 files of 3 time steps, with an integer field.
+data_dir = tempfile.mkdtemp()
+paths = syn.make_archive(data_dir, n_files=4, steps_per_file=3, nx=12, ny=10,
+                         nz=3, chem_opt=202)
+variables = ['PM2_5_DRY', 'PM10', 'so4_a01', 'IVGTYP']
+for i, path in enumerate(paths):
+    with xr.open_dataset(path) as stored:
+        ds = stored.load()
+    ds['IVGTYP'] = (('Time', 'south_north', 'west_east'),
+                    np.random.RandomState(i).randint(
+                        1, 25, size=ds.PM10[:, 0].shape).astype('int32'))
+    # missing values.
+    if i == 1:
+        ds['PM10'][0, 0] = np.nan
+    ds.to_netcdf(path + '.tmp')
+    os.replace(path + '.tmp', path)
+ds = st.merge_ds(paths, variables=variables).load()
+
+#TEST1: statistics of 2 cycles (saved and loaded) vs the merged files.
+print('Testing incremental statistics')
+acc = acm.StatsAccumulator(variables=variables)
+for path in paths[:2]:
+    assert acc.update_file(path)
+acc.save(os.path.join(data_dir, 'acc.nc'))
+
+acc = acm.StatsAccumulator.load(os.path.join(data_dir, 'acc.nc'))
+assert not acc.update_file(paths[1])
+for path in paths[2:]:
+    assert acc.update_file(path)
+
+for var in variables:
+    x = ds[var].values.astype('float64')
+    np.testing.assert_allclose(acc.variance()[var].values,
+                               np.nanvar(x, axis=0, ddof=1), rtol=1e-04)
+    np.testing.assert_allclose(acc.minimum()[var].values,
+                               np.nanmin(x, axis=0))
+    np.testing.assert_allclose(acc.maximum()[var].values,
+                               np.nanmax(x, axis=0))
+    np.testing.assert_array_equal(acc.count()[var].values,
+                                  np.isfinite(x).sum(axis=0))
+    assert acc.minimum()[var].dtype == ds[var].dtype
+
+#TEST2: time_mean as statistics.time_mean of the merged files.
+print('Testing time_mean layout')
+mean = acc.time_mean()
+ref = st.time_mean(ds, 'Time')
+assert set(mean.coords) == set(ref.coords)
+for name in ref.coords:
+    assert mean[name].dims == ref[name].dims
+    np.testing.assert_array_equal(mean[name].values, ref[name].values)
+for var in variables:
+    assert mean[var].dims == ref[var].dims
+    assert mean[var].dtype == ref[var].dtype
+    assert mean[var].attrs == ref[var].attrs
+    np.testing.assert_allclose(mean[var].values, ref[var].values,
+                               rtol=1e-05)
+assert mean['IVGTYP'].dtype == np.float64
+assert mean['XLAT'].sizes['Time'] == 12
+
+print('All tests passed for accumulator!')
@@ -9,13 +9,19 @@ Created on Thu Jan  9 10:57:07 2020
 """
 import numpy as np
 import xarray as xr
+import os
 import sys
 sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
 from WRFChemToolkit.analysis import aerosols_201 as ar201
+from WRFChemToolkit.analysis import synthetic as syn
 
 # Load test data.
 data_path = '../../../sample_WRF_chem_out_201'
-ds = xr.open_dataset(data_path)
+if os.path.exists(data_path):
+    ds = xr.open_dataset(data_path)
+else:
+    # synthetic output, if the sample output is not available.
+    ds = syn.make_wrfout(chem_opt=201)
 
 # --------------------------- CHEM-OPT = 201 -------------------------------
 
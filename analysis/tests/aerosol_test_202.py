@@ -11,13 +11,19 @@ Created on Mon Feb  3 16:20:51 2020
 import numpy as np
 import xarray as xr
 
+import os
 import sys
 sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
 from WRFChemToolkit.analysis import aerosols_202 as ar202
+from WRFChemToolkit.analysis import synthetic as syn
 
 # Load test data.
 data_path = '../../../sample_WRF_chem_out_202.nc'
-ds = xr.open_dataset(data_path)
+if os.path.exists(data_path):
+    ds = xr.open_dataset(data_path)
+else:
+    # synthetic output, if the sample output is not available.
+    ds = syn.make_wrfout(chem_opt=202)
 
 # --------------------------- CHEM-OPT = 202 -------------------------------
 
@@ -41,5 +47,10 @@ print('Testing pm10')
 np.testing.assert_allclose(
            ds.pm10_tot.values, ds.PM10.values,rtol=1e-06)
 
+#TEST4: compare directed calculated pm10 with diagnostic variable PM10.
+print('Testing direct pm10 calculation')
+np.testing.assert_allclose(
+           ds.pm10_dir_tot.values, ds.PM10.values,rtol=1e-06)
+
      
 print('All tests passed for chem_opt=202!')
\ No newline at end of file
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks (wall time and peak memory) of the analysis functions on
+synthetic WRF-Chem outputs (see analysis/synthetic.py), so that performance
+regressions can be detected without the sample outputs.
+
+Usage:
+    python benchmark.py [--size small|medium|large] [--repeat N]
+                        [--only name1,name2] [--save results.json]
+                        [--baseline results.json] [--tolerance 0.25]
+
+With --baseline, the script exits with status 1 if any benchmark is slower
+(or uses more memory) than the baseline by more than the tolerance. It also
+exits with status 1 if a benchmark peaks above its memory bound (see
+get_bounds).
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import xarray as xr
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                             '../../..')))
+from WRFChemToolkit.analysis import synthetic as syn
+from WRFChemToolkit.analysis import aerosols_201 as ar201
+from WRFChemToolkit.analysis import aerosols_202 as ar202
+from WRFChemToolkit.analysis import mechanisms as mch
+from WRFChemToolkit.analysis import statistics as st
+from WRFChemToolkit.analysis import plots as plot
+
+
+# grid sizes (nx, ny, nz, nt) of the synthetic outputs.
+SIZES = dict(small=(50, 40, 5, 6),
+             medium=(150, 120, 10, 12),
+             large=(300, 250, 10, 24))
+
+
+def get_benchmarks(size):
+    """
+    Benchmarks (name -> function) on synthetic outputs of the given size.
+    """
+    nx, ny, nz, nt = SIZES[size]
+    ds201 = syn.make_wrfout(nx, ny, nz, nt, chem_opt=201)
+    ds202 = syn.make_wrfout(nx, ny, nz, nt, chem_opt=202)
+    pm = ds202[['PM2_5_DRY', 'PM10']]
+
+    lat, lon = ds202.XLAT.values[0], ds202.XLONG.values[0]
+    lat_lim = (np.percentile(lat, 25), np.percentile(lat, 75))
+    long_lim = (np.percentile(lon, 25), np.percentile(lon, 75))
+
+    ds_tavg = xr.Dataset(dict(pm.mean(dim='Time', keep_attrs=True).data_vars),
+                         coords=dict(pm.coords))
+    out_dir = tempfile.mkdtemp()
+
+    def _map_2D_():
+        plot.map_2D(ds_tavg, 'PM2_5_DRY', coastline=False, borders=False,
+                    save=os.path.join(out_dir, 'map'), format='png', dpi=100)
+        plt.close('all')
+
+    return dict(
+        get_pm_species=lambda: ar202.get_pm_species(ds202.copy()),
+        get_aerosols_201=lambda: ar201.get_aerosols(ds201),
+        get_aerosols_202=lambda: ar202.get_aerosols(ds202),
+        direct_pm25=lambda: ar202.direct_pm25(ds202.copy()),
+        time_mean=lambda: st.time_mean(pm, 'Time'),
+        space_mean=lambda: st.space_mean(pm),
+        space_mean_area=lambda: st.space_mean(
+            ds202[['PM2_5_DRY', 'PM10', 'MAPFAC_MX', 'MAPFAC_MY']],
+            weights='area'),
+        space_subset=lambda: st.space_subset(pm, lat_lim, long_lim),
+        map_2D=_map_2D_)
+
+
+def _get_n_outputs_(chem_opt):
+    """
+    Number of fields added by get_aerosols: species, components and total
+    of each PM size and the converted condensable vapours.
+    """
+    mech = mch.get_mechanism(chem_opt)
+    n_sizes = len(mech.cutoffs)
+
+    return ((len(mech.species) + len(mech.components) + 1) * n_sizes
+            + len(mech.cond_vap))
+
+
+def get_bounds(size):
+    """
+    Peak memory bounds [MB] of the benchmarks (name -> bound) on synthetic
+    outputs of the given size: the size of their outputs plus two fields
+    (working buffers) and 1 MB (python objects, e.g. of xarray). map_2D
+    outputs the RGBA canvas of the figure.
+    """
+    nx, ny, nz, nt = SIZES[size]
+    field = nx * ny * nz * nt * 4 / 2**20 # float32.
+    n_species = len(ar202.SPECIES)
+    n_vars = 2 # PM2_5_DRY and PM10.
+    width, height = plt.rcParams['figure.figsize']
+    canvas = width * height * 100**2 * 4 / 2**20 # RGBA at 100 dpi.
+
+    outputs = dict(
+        get_pm_species=2 * n_species * field,
+        get_aerosols_201=_get_n_outputs_(201) * field,
+        get_aerosols_202=_get_n_outputs_(202) * field,
+        direct_pm25=field,
+        time_mean=n_vars * field / nt,
+        space_mean=n_vars * field / (nx * ny),
+        space_mean_area=n_vars * field / (nx * ny),
+        space_subset=n_vars * field,
+        map_2D=canvas)
+
+    return {name: out + 2 * field + 1. for name, out in outputs.items()}
+
+
+def check_bounds(results, bounds):
+    """
+    Benchmarks with peak memory above their bound.
+    """
+    return ['%s peak_mb: %.1f > %.1f' % (name, results[name]['peak_mb'],
+                                         bound)
+            for name, bound in bounds.items()
+            if name in results and results[name]['peak_mb'] > bound]
+
+
+def run(func, repeat=3):
+    """
+    Best wall time [s] over repeat runs and peak memory [MB] of a function.
+    """
+    func() # warm up (imports, caches).
+
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return dict(time=min(times), peak_mb=peak / 2**20)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Benchmarks slower or using more memory than baseline (1 + tolerance).
+    """
+    regressions = []
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        for stat in ('time', 'peak_mb'):
+            if res[stat] > baseline[name][stat] * (1 + tolerance):
+                regressions.append('%s %s: %.3f > %.3f' % (
+                    name, stat, res[stat], baseline[name][stat]))
+
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size', default='small', choices=sorted(SIZES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', default=None,
+                        help='comma separated benchmarks names.')
+    parser.add_argument('--save', default=None, help='save results (json).')
+    parser.add_argument('--baseline', default=None,
+                        help='results (json) to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    benchmarks = get_benchmarks(args.size)
+    if args.only:
+        benchmarks = {name: benchmarks[name]
+                      for name in args.only.split(',')}
+
+    print('%-20s %10s %12s' % ('benchmark', 'time [s]', 'peak [MB]'))
+    results = {}
+    for name, func in benchmarks.items():
+        results[name] = run(func, args.repeat)
+        print('%-20s %10.4f %12.1f' % (name, results[name]['time'],
+                                       results[name]['peak_mb']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(size=args.size, results=results), f, indent=1)
+
+    above = check_bounds(results, get_bounds(args.size))
+    if above:
+        print('Memory above bounds:\n' + '\n'.join(above))
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('size') != args.size:
+            sys.exit('Baseline size %s differs from %s.'
+                     % (baseline.get('size'), args.size))
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print('Regressions:\n' + '\n'.join(regressions))
+            sys.exit(1)
+        print('No regressions.')
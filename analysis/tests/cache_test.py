@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for functions/cache.py functions (on-disk cache of aerosols).
+"""
+
+import gc
+import os
+import tempfile
+
+import numpy as np
+
+import sys
+sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
+from WRFChemToolkit.analysis import aerosols_202 as ar202
+from WRFChemToolkit.analysis import cache
+from WRFChemToolkit.analysis import statistics as st
+from WRFChemToolkit.analysis import synthetic as syn
+
+# synthetic outputs, 2 files.
+out_dir = tempfile.mkdtemp()
+cache_dir = os.path.join(out_dir, 'cache')
+ds = syn.make_wrfout(chem_opt=202)
+paths = []
+for i in range(2):
+    paths.append(os.path.join(out_dir, 'wrfout_d01_%d' % i))
+    ds.isel(Time=slice(3 * i, 3 * i + 3)).to_netcdf(paths[-1])
+
+
+def entries():
+    return sorted(f for f in os.listdir(cache_dir) if f.endswith('.nc'))
+
+
+#TEST1: cached aerosols vs get_aerosols of the merged files.
+print('Testing cached aerosols')
+ds_aer = cache.get_aerosols(paths, 202, cache_dir)
+ref = ar202.get_aerosols(st.merge_ds(paths,
+                                     variables=ar202.get_variables()))
+for var in ['pm25_tot', 'pm10_tot', 'pm25_SOA']:
+    np.testing.assert_allclose(ds_aer[var].values, ref[var].values,
+                               rtol=1e-06)
+np.testing.assert_array_equal(ds_aer.XTIME.values, ref.XTIME.values)
+
+#TEST2: same files -> same entry, other files or levels -> new entry.
+print('Testing cache keys')
+cache.get_aerosols(paths, 202, cache_dir)
+assert len(entries()) == 1
+cache.get_aerosols(paths[:1], 202, cache_dir)
+cache.get_aerosols(paths, 202, cache_dir, levels=0)
+assert len(entries()) == 3
+ds_aer.close()
+del ds_aer
+gc.collect()
+
+#TEST3: an entry larger than the budget is returned and kept while in use.
+print('Testing eviction')
+size = os.path.getsize(os.path.join(cache_dir, entries()[0]))
+ds_a = cache.get_aerosols(paths[1:], 202, cache_dir, max_size=size // 2)
+ds_a.pm25_tot.load()
+assert len(entries()) == 1
+
+# entries in use are not evicted by later calls.
+ds_b = cache.get_aerosols(paths, 202, cache_dir, max_size=size // 2)
+assert len(entries()) == 2
+ds_a.pm10_tot.load()
+
+# entries no longer in use are evicted.
+ds_a.close()
+del ds_a
+gc.collect()
+cache.evict(cache_dir, size // 2)
+assert len(entries()) == 1
+np.testing.assert_allclose(ds_b.pm25_tot.values, ref.pm25_tot.values,
+                           rtol=1e-06)
+
+print('All tests passed for cache!')
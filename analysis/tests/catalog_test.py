@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for functions/catalog.py functions.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+import sys
+sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
+from WRFChemToolkit.analysis import catalog as cat
+from WRFChemToolkit.analysis import statistics as st
+from WRFChemToolkit.analysis import synthetic as syn
+
+# synthetic hourly archive, 6 files of 2 time steps.
+data_dir = tempfile.mkdtemp()
+db_path = os.path.join(data_dir, 'catalog.db')
+paths = syn.make_archive(data_dir, n_files=6, steps_per_file=2, nx=10, ny=8,
+                         nz=3, chem_opt=202)
+data_path = os.path.join(data_dir, 'wrfout_d01_*')
+
+#TEST1: only new or modified files are read.
+print('Testing update_catalog')
+assert cat.update_catalog(db_path, data_path) == 6
+assert cat.update_catalog(db_path, data_path) == 0
+os.utime(paths[2], (0, 0))
+assert cat.update_catalog(db_path, data_path) == 1
+os.remove(paths[5])
+cat.update_catalog(db_path, data_path)
+assert cat.query_files(db_path) == [os.path.abspath(p) for p in paths[:5]]
+
+#TEST2: files overlapping a time window.
+print('Testing query_files')
+files = cat.query_files(db_path, '2010-04-01 03:00', '2010-04-01 04:00')
+assert files == [os.path.abspath(p) for p in paths[1:3]]
+assert cat.query_files(db_path, '2010-04-01 09:00') == \
+       [os.path.abspath(paths[4])]
+assert cat.query_files(db_path, '2010-04-01 10:00') == []
+assert cat.query_files(db_path, chem_opt=202, domain='d01',
+                       variables=['so4_a01', 'ALT']) == \
+       [os.path.abspath(p) for p in paths[:5]]
+assert cat.query_files(db_path, chem_opt=201) == []
+assert cat.query_files(db_path, variables=['not_a_variable']) == []
+assert cat.query_files(db_path, pattern=paths[:2]) == \
+       [os.path.abspath(p) for p in paths[:2]]
+
+#TEST3: merge_ds of the files of a time window.
+print('Testing merge_ds with catalog')
+ds = st.merge_ds(data_path, catalog=db_path,
+                 time_window=('2010-04-01 03:00', '2010-04-01 04:00'))
+assert ds.sizes['Time'] == 4
+np.testing.assert_array_equal(ds.XTIME.values[[0, -1]],
+                              np.array(['2010-04-01T02:00',
+                                        '2010-04-01T05:00'],
+                                       dtype='datetime64[ns]'))
+try:
+    st.merge_ds(data_path, catalog=db_path,
+                time_window=('2010-04-02', '2010-04-03'))
+    raise AssertionError('No ValueError without files.')
+except ValueError as err:
+    assert db_path in str(err)
+
+print('All tests passed for catalog!')
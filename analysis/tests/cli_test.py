@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for functions/cli.py (batch pipeline checkpointing).
+"""
+
+import os
+import tempfile
+import subprocess
+
+import numpy as np
+import xarray as xr
+
+import sys
+sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
+from WRFChemToolkit.analysis import cli
+from WRFChemToolkit.analysis import synthetic as syn
+
+# synthetic outputs, 2 files.
+data_dir = tempfile.mkdtemp()
+out_dir = os.path.join(data_dir, 'out')
+ds = syn.make_wrfout(chem_opt=202)
+for i in range(2):
+    ds.isel(Time=slice(3 * i, 3 * i + 3)).to_netcdf(
+        os.path.join(data_dir, 'wrfout_d01_2010-04-01_0%d:00:00' % i))
+data_path = os.path.join(data_dir, 'wrfout_d01_*')
+aer_path = os.path.join(out_dir, 'aerosols',
+                        'aerosols_wrfout_d01_2010-04-01_00-00-00.nc')
+
+
+def processed(**kwargs):
+    """
+    Tasks processed by a run.
+    """
+    before = cli.load_state(out_dir)
+    state = cli.run(data_path, 202, ['aerosols'], out_dir, **kwargs)
+    return sorted(name for name in state
+                  if state[name] != before.get(name))
+
+
+#TEST1: first run processes all the tasks, a second run none.
+print('Testing checkpoint')
+assert len(processed()) == 2
+assert len(processed()) == 0
+with xr.open_dataset(aer_path) as ds_aer:
+    assert ds_aer.sizes['bottom_top'] == ds.sizes['bottom_top']
+    np.testing.assert_allclose(ds_aer.pm25_tot.values,
+                               ds.PM2_5_DRY.values[:3], rtol=1e-06)
+
+#TEST2: other options the products depend on invalidate the checkpoint.
+print('Testing checkpoint invalidation by options')
+assert len(processed(levels=[0])) == 2
+with xr.open_dataset(aer_path) as ds_aer:
+    assert ds_aer.sizes['bottom_top'] == 1
+assert len(processed(levels=[0])) == 0
+# options not used by the aerosols product.
+assert len(processed(levels=[0], dpi=300)) == 0
+assert len(processed()) == 2
+
+#TEST3: modified inputs invalidate the checkpoint.
+print('Testing checkpoint invalidation by inputs')
+path = sorted(cli.get_tasks(data_path))[1]
+os.utime(cli.get_tasks(data_path)[path][0], (0, 0))
+assert processed() == [path]
+
+#TEST4: pool of workers, from the command line.
+print('Testing workers')
+command = [sys.executable, '-m', 'WRFChemToolkit.analysis.cli', data_path,
+           '--chem-opt', '202', '--out-dir', out_dir, '--workers', '2',
+           '--restart']
+assert subprocess.run(command).returncode == 0
+assert len(processed()) == 0
+
+print('All tests passed for cli!')
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for functions/derived.py (lazy derived variables) and the variables,
+dtype and memory_budget arguments of get_aerosols.
+"""
+
+import numpy as np
+
+import sys
+sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
+from WRFChemToolkit.analysis import aerosols_201 as ar201
+from WRFChemToolkit.analysis import aerosols_202 as ar202
+from WRFChemToolkit.analysis import derived
+from WRFChemToolkit.analysis import synthetic as syn
+
+ds = syn.make_wrfout(chem_opt=202)
+ref = ar202.get_aerosols(ds.copy())
+
+#TEST1: dependencies of a derived variable (raw inputs only needed).
+print('Testing dependencies')
+deps = derived.get_dependencies(202, ['pm25_SIA'])
+assert set(deps) == set(['%s_a0%d' % (sp, b) for sp in ('so4', 'nh4', 'no3')
+                         for b in (1, 2, 3)] + ['ALT']), deps
+
+#TEST2: derived variables vs get_aerosols.
+print('Testing derived variables')
+names = ['pm25_SIA', 'pm10_SOA', 'pm25_tot', 'pm10_tot', 'cvasoa1']
+out = ar202.get_aerosols(ds, variables=names)
+assert set(out.data_vars) == set(names)
+for name in names:
+    np.testing.assert_allclose(out[name].values, ref[name].values,
+                               rtol=1e-06)
+    assert out[name].attrs['units'] == 'ug m-3'
+
+#TEST3: dtype and memory budget (chunks of time steps).
+print('Testing dtype and memory_budget')
+budget = ds.so4_a01[0].nbytes * 20
+out = ar202.get_aerosols(ds, variables=names, dtype='float32',
+                         memory_budget=budget)
+for name in names:
+    assert out[name].dtype == np.float32
+    np.testing.assert_allclose(out[name].values, ref[name].values,
+                               rtol=1e-06)
+    assert out[name].sizes['Time'] == ds.sizes['Time']
+
+#TEST4: condensable vapours converted from ALT only (no P, PB, T).
+print('Testing convert_cv')
+cv_ds = ds[ar202.COND_VAP + ['ALT']].copy()
+ar202.convert_cv(cv_ds, ar202.COND_VAP)
+assert 'TP' not in cv_ds and 'AT' not in cv_ds
+for cv in ar202.COND_VAP:
+    np.testing.assert_allclose(cv_ds[cv].values, ref[cv].values, rtol=1e-06)
+
+#TEST5: chem_opt 201.
+print('Testing chem_opt 201')
+ds = syn.make_wrfout(chem_opt=201)
+out = ar201.get_aerosols(ds, variables=['pm25_calc'])
+np.testing.assert_allclose(out.pm25_calc.values, ds.PM2_5_DRY.values,
+                           rtol=1e-06)
+
+print('All tests passed for derived!')
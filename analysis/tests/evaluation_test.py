@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for functions/evaluation.py functions (model vs observations).
+"""
+
+import tempfile
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import sys
+sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
+from WRFChemToolkit.analysis import evaluation as evl
+from WRFChemToolkit.analysis import stations as stn
+from WRFChemToolkit.analysis import synthetic as syn
+
+
+def reference(m, o):
+    """
+    Statistics of paired 1D series (numpy).
+    """
+    ok = np.isfinite(m) & np.isfinite(o)
+    m, o = m[ok], o[ok]
+    obar = o.mean()
+    return dict(n=ok.sum(), mean_obs=obar, mean_mod=m.mean(),
+                bias=(m - o).mean(), nmb=(m - o).sum() / o.sum(),
+                nme=abs(m - o).sum() / o.sum(),
+                rmse=np.sqrt(((m - o)**2).mean()),
+                r=np.corrcoef(m, o)[0, 1],
+                ioa=1 - ((m - o)**2).sum()
+                / ((abs(m - obar) + abs(o - obar))**2).sum())
+
+
+# hourly series at 3 stations over 3 days, with missing values.
+rng = np.random.default_rng(0)
+times = pd.date_range('2010-04-01', periods=72, freq='h')
+obs_values = 20 + 10 * rng.random((72, 3))
+mod_values = obs_values * 1.2 + 5 * rng.random((72, 3))
+obs_values[rng.random((72, 3)) < 0.1] = np.nan
+mod_values[5, 1] = np.nan
+coords = dict(Time=times, station=['a', 'b', 'c'])
+obs = xr.Dataset({'pm25_tot': (('Time', 'station'), obs_values)},
+                 coords=coords)
+model = xr.Dataset({'pm25_tot': (('Time', 'station'), mod_values)},
+                   coords=coords)
+
+#TEST1: statistics of each station.
+print('Testing evaluate')
+out = evl.evaluate(model, obs)
+for k, name in enumerate(coords['station']):
+    ref = reference(mod_values[:, k], obs_values[:, k])
+    for stat in evl.STATS:
+        np.testing.assert_allclose(
+            out.pm25_tot.sel(stat=stat, station=name).values, ref[stat],
+            rtol=1e-08)
+
+#TEST2: statistics of daily windows, pooled stations.
+print('Testing windows and pooled')
+out = evl.evaluate(model, obs, window='D', pooled=True)
+assert out.sizes['Time'] == 3
+for d in range(3):
+    day = slice(24 * d, 24 * d + 24)
+    ref = reference(mod_values[day].ravel(), obs_values[day].ravel())
+    for stat in evl.STATS:
+        np.testing.assert_allclose(
+            out.pm25_tot.sel(stat=stat).values[d], ref[stat], rtol=1e-08)
+
+# near perfect model (bias 1e-6 on obs ~150, a year of hourly values):
+# no cancellation in RMSE, r and IOA.
+times = pd.date_range('2010-01-01', periods=8760, freq='h')
+obs_values = 150 + rng.random((8760, 5))
+mod_values = obs_values + 1e-6 + 1e-7 * rng.standard_normal((8760, 5))
+coords = dict(Time=times, station=list('abcde'))
+out = evl.evaluate(
+    xr.Dataset({'pm25_tot': (('Time', 'station'), mod_values)}, coords=coords),
+    xr.Dataset({'pm25_tot': (('Time', 'station'), obs_values)}, coords=coords))
+for k, name in enumerate(coords['station']):
+    ref = reference(mod_values[:, k], obs_values[:, k])
+    for stat in ('rmse', 'r', 'ioa'):
+        np.testing.assert_allclose(
+            out.pm25_tot.sel(stat=stat, station=name).values, ref[stat],
+            rtol=1e-06)
+
+#TEST3: evaluate_files of synthetic outputs vs their own PM2_5_DRY.
+print('Testing evaluate_files')
+data_dir = tempfile.mkdtemp()
+paths = syn.make_archive(data_dir, n_files=3, steps_per_file=2, nx=20,
+                         ny=16, nz=3, chem_opt=202)
+ds = xr.open_mfdataset(paths).load()
+lats = ds.XLAT.values[0, [3, 8], [4, 12]]
+lons = ds.XLONG.values[0, [3, 8], [4, 12]]
+pm = stn.extract_stations(ds.isel(bottom_top=0), lats, lons,
+                          variables=['PM2_5_DRY'])
+obs = xr.Dataset({'pm25_tot': pm.PM2_5_DRY.assign_coords(
+                                  Time=ds.XTIME.values)})
+out = evl.evaluate_files(paths, obs, lats, lons)
+np.testing.assert_array_equal(out.pm25_tot.sel(stat='n').values, [6, 6])
+np.testing.assert_allclose(out.pm25_tot.sel(stat='nmb').values, 0,
+                           atol=1e-06)
+np.testing.assert_allclose(out.pm25_tot.sel(stat='r').values, 1, rtol=1e-05)
+
+print('All tests passed for evaluation!')
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for utils.select_levels: only the selected bottom_top levels are read
+from disk by statistics.merge_ds and get_aerosols.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import xarray as xr
+from xarray.backends import netCDF4_ as nc4
+
+import sys
+sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
+from WRFChemToolkit.analysis import aerosols_202 as ar202
+from WRFChemToolkit.analysis import statistics as st
+from WRFChemToolkit.analysis import synthetic as syn
+from WRFChemToolkit.analysis import utils as utl
+
+# synthetic outputs, 2 files of 5 levels.
+out_dir = tempfile.mkdtemp()
+ds = syn.make_wrfout(nz=5, chem_opt=202)
+paths = []
+for i in range(2):
+    paths.append(os.path.join(out_dir, 'wrfout_d01_%d' % i))
+    ds.isel(Time=slice(3 * i, 3 * i + 3)).to_netcdf(paths[-1])
+
+# record the indices of the netCDF reads.
+reads = []
+_getitem_ = nc4.NetCDF4ArrayWrapper._getitem
+
+def _spy_(self, key):
+    reads.append((self.variable_name, key))
+    return _getitem_(self, key)
+
+nc4.NetCDF4ArrayWrapper._getitem = _spy_
+
+
+def read_levels(var):
+    """
+    bottom_top indices read from disk for var.
+    """
+    levels = set()
+    for name, key in reads:
+        if name == var:
+            levels.update(range(5)[key[1]])
+    return sorted(levels)
+
+
+#TEST1: selected levels vs isel.
+print('Testing select_levels')
+for levels in (0, 3, -1, [1, 2], [0, 2, 4], slice(1, 4)):
+    index = [levels] if isinstance(levels, int) else levels
+    xr.testing.assert_equal(utl.select_levels(ds, levels),
+                            ds.isel(bottom_top=index))
+
+#TEST2: merge_ds reads only the selected levels.
+print('Testing levels read by merge_ds')
+for levels, expected in ((0, [0]), ([1, 2], [1, 2]), (slice(2, 4), [2, 3])):
+    reads.clear()
+    merged = st.merge_ds(paths, variables=ar202.get_variables(),
+                         levels=levels)
+    merged['so4_a01'].load()
+    assert read_levels('so4_a01') == expected, read_levels('so4_a01')
+
+#TEST3: get_aerosols reads only the selected levels.
+print('Testing levels read by get_aerosols')
+reads.clear()
+with xr.open_dataset(paths[0]) as ds_file:
+    ds_aer = ar202.get_aerosols(ds_file, variables=['pm25_tot'], levels=0)
+    ds_aer.load()
+assert read_levels('so4_a01') == [0], read_levels('so4_a01')
+np.testing.assert_allclose(ds_aer.pm25_tot.values,
+                           ds.PM2_5_DRY.isel(Time=slice(0, 3),
+                                             bottom_top=[0]).values,
+                           rtol=1e-06)
+
+nc4.NetCDF4ArrayWrapper._getitem = _getitem_
+
+print('All tests passed for levels!')
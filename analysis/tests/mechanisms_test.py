@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for functions/mechanisms.py functions (aerosol tables engine).
+"""
+
+import numpy as np
+
+import sys
+sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
+from WRFChemToolkit.analysis import aerosols_202 as ar202
+from WRFChemToolkit.analysis import mechanisms as mch
+from WRFChemToolkit.analysis import synthetic as syn
+
+
+for chem_opt in (202, 9, 10):
+
+    ds = syn.make_wrfout(chem_opt=chem_opt)
+    mech = mch.get_mechanism(chem_opt)
+
+    #TEST1: direct dry PM from the table vs diagnostics PM2_5_DRY and PM10.
+    print('Testing direct pm, chem_opt=%d' % chem_opt)
+    mech.direct_pm(ds)
+    assert 'water' not in mech.dry
+    np.testing.assert_allclose(
+               ds.pm25_dir_tot.values, ds.PM2_5_DRY.values, rtol=1e-06)
+    np.testing.assert_allclose(
+               ds.pm10_dir_tot.values, ds.PM10.values, rtol=1e-06)
+
+    #TEST2: totals from the plan vs diagnostics PM2_5_DRY and PM10.
+    print('Testing totals from the plan, chem_opt=%d' % chem_opt)
+    ds_aer = mech.get_aerosols(ds)
+    np.testing.assert_allclose(
+               ds_aer.pm25_tot.values, ds.PM2_5_DRY.values, rtol=1e-06)
+    np.testing.assert_allclose(
+               ds_aer.pm10_tot.values, ds.PM10.values, rtol=1e-06)
+
+#TEST3: table engine vs aerosols_202 step functions.
+print('Testing table engine vs aerosols_202')
+ds = syn.make_wrfout(chem_opt=202)
+ref = ds.copy()
+ar202.get_pm_species(ref)
+ar202.get_pm_components(ref)
+ar202.calculate_tot_pm(ref)
+ar202.direct_pm(ref)
+mch.get_mechanism(202).direct_pm(ds)
+ds_aer = mch.get_mechanism(202).get_aerosols(ds)
+for var in ['pm25_dir_tot', 'pm10_dir_tot']:
+    np.testing.assert_allclose(ds[var].values, ref[var].values, rtol=1e-06)
+for var in ['pm25_SOA', 'pm25_SIA', 'pm10_sea', 'pm25_water', 'pm10_tot']:
+    np.testing.assert_allclose(ds_aer[var].values, ref[var].values,
+                               rtol=1e-06)
+
+#TEST4: species excluded from the dry PM of a new table.
+print('Testing exclude')
+mch.register_mechanism(999, 'test', ['so4', 'water'], 4,
+                       {'pm25': 3, 'pm10': 4})
+assert mch.get_mechanism(999).dry == ['so4']
+mch.register_mechanism(999, 'test', ['so4', 'water'], 4,
+                       {'pm25': 3, 'pm10': 4}, exclude=None)
+assert mch.get_mechanism(999).dry == ['so4', 'water']
+
+print('All tests passed for mechanisms!')
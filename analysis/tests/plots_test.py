@@ -10,12 +10,21 @@ Created on Tue Feb  4 17:23:44 2020
 
 
 from WRFChemToolkit.analysis import plots as plot
+from WRFChemToolkit.analysis import synthetic as syn
 import xarray as xr
 import pandas as pd
+import numpy as np
+import matplotlib.image as mpimg
 import sys as sys
+import os
+import tempfile
 
 data_path = '../../../sample_WRF_chem_out_202'
-ds = xr.open_dataset(data_path)
+if os.path.exists(data_path):
+    ds = xr.open_dataset(data_path)
+else:
+    # synthetic output, if the sample output is not available.
+    ds = syn.make_wrfout(chem_opt=202)
 
 
 def test_map_2D():
@@ -43,14 +52,122 @@ def test_time_series():
 
     plot.time_series(dates,variables= [so2, nh3, no2],labels=['SO2','NH3','NO2'],
             title='Timeseries test', xlabel='Time', ylabel=' mixing ratio')
-     
     
+    # the figure is returned, with or without downsampling.
+    for downsample in (None, 'lttb'):
+        fig = plot.time_series(dates, variables=[so2, nh3], 
+                               labels=['SO2', 'NH3'], downsample=downsample,
+                               dynamic=True)
+        assert len(fig.data) == 2
+
+
+def test_map_2D_batch():
+    
+    # frames of 2 variables at 3 times, in 1 and 2 processes.
+    out_dir = tempfile.mkdtemp()
+    var_names = ['PM2_5_DRY', 'PM10']
+    frames = {}
+    for workers in (1, 2):
+        frames[workers] = plot.map_2D_batch(
+            ds, var_names, os.path.join(out_dir, str(workers)), 
+            times=slice(0, 3), pixels=True, workers=workers)
+        assert sorted(frames[workers]) == sorted(var_names)
+        for var_name, paths in frames[workers].items():
+            assert [os.path.basename(p) for p in paths] == [
+                '%s_%04d.png' % (var_name, i) for i in range(3)]
+            assert all(os.path.getsize(p) > 0 for p in paths)
+    
+    # same frames from the figure of each worker, data updated per frame.
+    for var_name in var_names:
+        images = [mpimg.imread(p) for p in frames[1][var_name]]
+        for path, image in zip(frames[2][var_name], images):
+            np.testing.assert_array_equal(mpimg.imread(path), image)
+        assert not np.array_equal(images[0], images[1])
+
+
+def test_map_decimation():
+    
+    import matplotlib.pyplot as plt
+    
+    # large grid (1500 x 2000 cells), single time and level.
+    ny, nx = 1500, 2000
+    lat, lon = np.meshgrid(np.linspace(20, 30, ny), np.linspace(70, 90, nx), 
+                           indexing='ij')
+    big = xr.Dataset(
+        {'PM2_5_DRY': (('bottom_top', 'south_north', 'west_east'), 
+                       np.random.RandomState(0).rand(1, ny, nx) * 600, 
+                       {'units': 'ug m-3'})}, 
+        coords={'XLAT': (('Time', 'south_north', 'west_east'), lat[None]),
+                'XLONG': (('Time', 'south_north', 'west_east'), lon[None])})
+    out_dir = tempfile.mkdtemp()
+    
+    # default: grid decimated, data layer rasterized at raster_dpi.
+    sizes = {}
+    for raster_dpi in (200, 1000):
+        plt.close('all')
+        save = os.path.join(out_dir, 'map_%d' % raster_dpi)
+        plot.map_2D(big, 'PM2_5_DRY', pixels=True, coastline=False, 
+                    borders=False, save=save, raster_dpi=raster_dpi)
+        mesh = plt.gca().collections[0]
+        sizes[raster_dpi] = os.path.getsize(save + '.pdf')
+        if raster_dpi == 200:
+            assert mesh.get_array().size < ny * nx / 4
+    assert sizes[200] < sizes[1000] / 4
+    plt.close('all')
+
+
+def test_downsampling():
+    
+    # long series (random walk, 100000 points) with missing values.
+    n, n_points = 100000, 2000
+    x = np.arange(n, dtype=float)
+    y = np.cumsum(np.random.RandomState(0).randn(n))
+    y[5000:5100] = np.nan
+    
+    for sampler in (plot._lttb_, plot._minmax_):
+        idx = sampler(x, y, n_points)
+        assert len(idx) == n_points
+        assert idx[0] == 0 and idx[-1] == n - 1
+        assert np.all(np.diff(x[idx]) > 0)
+        # short series are not downsampled.
+        assert len(sampler(x[:100], y[:100], n_points)) == 100
+    
+    # global extremes kept by min/max bucketing.
+    idx = plot._minmax_(x, y, n_points)
+    assert np.nanargmin(y) in idx and np.nanargmax(y) in idx
+    
+    # downsampled traces of time_series.
+    dates = pd.date_range('2010-01-01', periods=n, freq='h')
+    so2 = xr.DataArray(y[:, None], dims=('Time', 'bottom_top'))
+    for downsample in ('lttb', 'minmax'):
+        fig = plot.time_series(dates, [so2], ['SO2'], downsample=downsample,
+                               n_points=n_points, dynamic=True)
+        assert len(fig.data[0].x) == n_points
+
+
 # Pick up test from command line
+
+if __name__ == '__main__':
     
     if sys.argv[1] == 'map_2D' :
         print('Testing function map_2D')
         test_map_2D()
         print('Test passed!')
+    
+    elif sys.argv[1] == 'map_2D_batch' :
+        print('Testing function map_2D_batch')
+        test_map_2D_batch()
+        print('Test passed!')
+      
+    elif sys.argv[1] == 'map_decimation' :
+        print('Testing map_2D decimation')
+        test_map_decimation()
+        print('Test passed!')
+      
+    elif sys.argv[1] == 'downsampling' :
+        print('Testing time_series downsampling')
+        test_downsampling()
+        print('Test passed!')
       
     elif sys.argv[1] == 'time_series' :
         print('Testing function time_series')
@@ -59,6 +176,3 @@ def test_time_series():
       
     else:
         print('Unknown function to test. Add name of function to test.')
-      
-      
-      
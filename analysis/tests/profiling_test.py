@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for functions/profiling.py (stage profiling).
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+import subprocess
+
+import sys
+sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
+from WRFChemToolkit.analysis import profiling as prf
+from WRFChemToolkit.analysis import synthetic as syn
+
+out_dir = tempfile.mkdtemp()
+records_path = os.path.join(out_dir, 'records.jsonl')
+prf.enable(records_path)
+
+
+@prf.profiled
+def work(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+#TEST1: nested stage names and timings.
+print('Testing nested stages')
+with prf.stage('outer', files=2):
+    time.sleep(0.05)
+    with prf.stage('inner'):
+        time.sleep(0.02)
+    work(0.01)
+
+records = {r['path']: r for r in prf.get_records(clear=True)}
+assert set(records) == set(['outer', 'outer/inner', 'outer/__main__.work'])
+assert records['outer']['files'] == 2
+assert records['outer/inner']['stage'] == 'inner'
+assert records['outer/inner']['wall_s'] >= 0.02
+assert records['outer/__main__.work']['wall_s'] >= 0.01
+assert records['outer']['wall_s'] >= 0.08
+assert records['outer']['wall_s'] >= (records['outer/inner']['wall_s']
+                                      + records['outer/__main__.work'][
+                                          'wall_s'])
+assert all(r['error'] is None for r in records.values())
+with open(records_path) as f:
+    assert len([json.loads(line) for line in f]) == 3
+
+#TEST2: stages of concurrent threads are nested per thread.
+print('Testing stages of threads')
+barrier = threading.Barrier(4)
+
+
+def nested(name):
+    with prf.stage(name):
+        barrier.wait()
+        with prf.stage('inner'):
+            barrier.wait()
+            time.sleep(0.02)
+        barrier.wait()
+
+
+threads = [threading.Thread(target=nested, args=('t%d' % i,))
+           for i in range(4)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+
+records = prf.get_records(clear=True)
+assert sorted(r['path'] for r in records) == sorted(
+    ['t%d' % i for i in range(4)] + ['t%d/inner' % i for i in range(4)])
+assert all(r['wall_s'] >= 0.02 for r in records)
+assert not prf._ACTIVE and not prf._SAMPLER
+
+#TEST3: summary by stage.
+print('Testing summary')
+out = prf.summary(records_path, by='stage')
+assert out.loc['inner', 'calls'] == 5
+assert out.loc['outer', 'calls'] == 1
+
+#TEST4: workers of the command line pipeline are profiled.
+print('Testing profiled workers')
+prf.disable()
+ds = syn.make_wrfout(chem_opt=202, nt=4)
+for i in range(2):
+    ds.isel(Time=slice(2 * i, 2 * i + 2)).to_netcdf(
+        os.path.join(out_dir, 'wrfout_d01_2010-04-01_0%d:00:00' % i))
+cli_path = os.path.join(out_dir, 'cli.jsonl')
+command = [sys.executable, '-m', 'WRFChemToolkit.analysis.cli',
+           os.path.join(out_dir, 'wrfout_d01_*'), '--chem-opt', '202',
+           '--out-dir', os.path.join(out_dir, 'out'), '--workers', '2',
+           '--profile', cli_path]
+process = subprocess.Popen(command)
+assert process.wait() == 0
+records = prf.load_records(cli_path)
+tasks = records[records['stage'] == 'cli.aerosols']
+assert len(tasks) == 2
+assert process.pid not in set(tasks['pid'])
+
+print('All tests passed for profiling!')
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for functions/stations.py functions (extraction at stations).
+"""
+
+import numpy as np
+
+import sys
+sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
+from WRFChemToolkit.analysis import stations as stn
+from WRFChemToolkit.analysis import synthetic as syn
+
+# synthetic output on a curvilinear grid.
+ds = syn.make_wrfout(nx=30, ny=25, nz=2, nt=4, chem_opt=202)
+lat = ds.XLAT.values[0].astype('float64')
+lon = ds.XLONG.values[0].astype('float64')
+ny, nx = lat.shape
+
+# stations at random positions (fractional indices) inside grid quads.
+rng = np.random.default_rng(1)
+j0 = rng.integers(0, ny - 1, 20)
+i0 = rng.integers(0, nx - 1, 20)
+t, s = rng.random(20), rng.random(20)
+
+
+def bilinear(a):
+    return ((1 - s) * (1 - t) * a[j0, i0] + s * (1 - t) * a[j0, i0 + 1]
+            + s * t * a[j0 + 1, i0 + 1] + (1 - s) * t * a[j0 + 1, i0])
+
+
+st_lat, st_lon = bilinear(lat), bilinear(lon)
+
+#TEST1: nearest cell vs brute force great circle distance.
+print('Testing nearest')
+points = stn.extract_stations(ds, st_lat, st_lon, variables=['PM2_5_DRY'])
+phi1, phi2 = np.deg2rad(st_lat)[:, None], np.deg2rad(lat.ravel())[None]
+dlon = np.deg2rad(lon.ravel()[None] - st_lon[:, None])
+dist = stn.EARTH_RADIUS * np.arccos(np.clip(
+    np.sin(phi1) * np.sin(phi2) + np.cos(phi1) * np.cos(phi2)
+    * np.cos(dlon), -1, 1))
+jn, inn = np.unravel_index(dist.argmin(axis=1), lat.shape)
+np.testing.assert_array_equal(
+    points.PM2_5_DRY.transpose('Time', 'bottom_top', 'station').values,
+    ds.PM2_5_DRY.values[:, :, jn, inn])
+np.testing.assert_allclose(points.distance.values, dist.min(axis=1),
+                           rtol=1e-03, atol=1e-03)
+
+#TEST2: bilinear weights of a field bilinear in the grid indices.
+print('Testing bilinear')
+jj, ii = np.meshgrid(np.arange(ny), np.arange(nx), indexing='ij')
+field = jj + 2. * ii + 0.1 * ii * jj
+ds['field'] = (('south_north', 'west_east'), field)
+names = ['st%02d' % k for k in range(20)]
+points = stn.extract_stations(ds, st_lat, st_lon, names=names,
+                              variables=['field'], method='bilinear')
+ref = (j0 + t) + 2. * (i0 + s) + 0.1 * (i0 + s) * (j0 + t)
+np.testing.assert_allclose(points.field.values, ref, atol=1e-03)
+assert list(points.station.values) == names
+
+# station on a grid node surrounded by NaN cells, station in a quad with a
+# NaN corner (weights of the other corners renormalised).
+nan_field = field.copy()
+jn0, in0 = max(j0[0], 1), max(i0[0], 1)
+nan_field[jn0 - 1:jn0 + 2, in0 - 1:in0 + 2] = np.nan
+nan_field[jn0, in0] = field[jn0, in0]
+nan_field[j0[1] + 1, i0[1] + 1] = np.nan
+ds['nan_field'] = (('south_north', 'west_east'), nan_field)
+points = stn.extract_stations(ds, [lat[jn0, in0], st_lat[1]],
+                              [lon[jn0, in0], st_lon[1]],
+                              variables=['nan_field'], method='bilinear')
+np.testing.assert_allclose(points.nan_field.values[0], field[jn0, in0],
+                           atol=1e-03)
+w = np.array([(1 - s[1]) * (1 - t[1]), s[1] * (1 - t[1]), (1 - s[1]) * t[1]])
+v = np.array([field[j0[1], i0[1]], field[j0[1], i0[1] + 1],
+              field[j0[1] + 1, i0[1]]])
+np.testing.assert_allclose(points.nan_field.values[1], (w * v).sum() / w.sum(),
+                           atol=1e-03)
+points = stn.extract_stations(ds, [lat[jn0 - 1, in0]], [lon[jn0 - 1, in0]],
+                              variables=['nan_field'])
+assert np.isnan(points.nan_field.values).all()
+
+#TEST3: stations out of the domain.
+print('Testing max_distance')
+points = stn.extract_stations(ds, [st_lat[0], 0.], [st_lon[0], 0.],
+                              variables=['field'], max_distance=50.)
+assert np.isfinite(points.field.values[0])
+assert np.isnan(points.field.values[1])
+
+print('All tests passed for stations!')
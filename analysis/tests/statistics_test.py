@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for functions/statistics.py functions.
+"""
+
+import os
+import pathlib
+import subprocess
+import tempfile
+
+import numpy as np
+import xarray as xr
+
+import sys
+sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
+from WRFChemToolkit.analysis import aerosols_202 as ar202
+from WRFChemToolkit.analysis import statistics as st
+from WRFChemToolkit.analysis import synthetic as syn
+from WRFChemToolkit.analysis import utils as utl
+
+# synthetic outputs, 2 files.
+data_dir = tempfile.mkdtemp()
+ds = syn.make_wrfout(chem_opt=202)
+# integer field (land use), averaged to float as time_mean does.
+ds['IVGTYP'] = (('Time', 'south_north', 'west_east'), np.random.RandomState(
+    0).randint(1, 25, size=ds.PM10[:, 0].shape).astype('int32'))
+paths = []
+for i in range(2):
+    paths.append(os.path.join(data_dir, 'wrfout_d01_%d' % i))
+    ds.isel(Time=slice(3 * i, 3 * i + 3)).to_netcdf(paths[-1])
+
+#TEST1: time_mean_files vs time_mean of the merged files.
+print('Testing time_mean_files')
+for kwargs in (dict(), dict(variables=ar202.get_variables(), levels=0)):
+    mean = st.time_mean_files(paths, workers=1, **kwargs)
+    ref = st.time_mean(st.merge_ds(paths, **kwargs), 'Time')
+    assert set(mean.data_vars) == set(ref.data_vars)
+    assert set(mean.coords) == set(ref.coords)
+    for name in ref.coords:
+        np.testing.assert_array_equal(mean[name].values, ref[name].values)
+    for var in ref.data_vars:
+        assert mean[var].dims == ref[var].dims
+        assert mean[var].dtype == ref[var].dtype
+        assert mean[var].attrs == ref[var].attrs
+        np.testing.assert_allclose(mean[var].values, ref[var].values,
+                                   rtol=1e-05, atol=1e-06)
+
+# pool of (spawned) workers, from a separate interpreter.
+out_path = os.path.join(data_dir, 'mean.nc')
+script = ('import sys; sys.path[:0] = %r; '
+          'from WRFChemToolkit.analysis import statistics as st; '
+          'st.time_mean_files(%r, workers=2).to_netcdf(%r)'
+          % (sys.path, paths, out_path))
+assert subprocess.run([sys.executable, '-c', script]).returncode == 0
+mean = st.time_mean_files(paths, workers=1)
+assert mean.IVGTYP.dtype == np.float64
+with xr.open_dataset(out_path) as pooled:
+    xr.testing.assert_identical(pooled.load(), mean)
+
+try:
+    st.time_mean_files(os.path.join(data_dir, 'nothing_*'))
+    raise AssertionError('No ValueError without files.')
+except ValueError:
+    pass
+
+#TEST2: merge_ds of a path matching no files.
+print('Testing merge_ds without files')
+for kwargs in (dict(), dict(variables=ar202.get_variables())):
+    try:
+        st.merge_ds(os.path.join(data_dir, 'nothing_*'), **kwargs)
+        raise AssertionError('No ValueError without files.')
+    except ValueError as err:
+        assert 'nothing_*' in str(err)
+
+# pathlib paths and remote URLs (passed on to open_mfdataset unchanged).
+pattern = pathlib.Path(data_dir) / 'wrfout_d01_*'
+assert utl._get_paths_(pattern) == paths
+assert utl._get_paths_(pathlib.Path(paths[1])) == [paths[1]]
+assert utl._get_paths_([pathlib.Path(p) for p in paths]) == paths
+url = 'https://server/thredds/dodsC/wrfout_d01?PM10[0:1:5]'
+assert utl._get_paths_(url) == [url]
+merged = st.merge_ds(pattern, variables=['PM10'])
+assert merged.sizes['Time'] == 6
+
+#TEST3: area weighted space_mean.
+print('Testing space_mean')
+mean = st.space_mean(ds[['PM2_5_DRY', 'MAPFAC_MX', 'MAPFAC_MY']],
+                     weights='area')
+area = (ds.DX * ds.DY / (ds.MAPFAC_MX * ds.MAPFAC_MY)).values[0]
+ref = (ds.PM2_5_DRY.values * area).sum(axis=(-2, -1)) / area.sum()
+np.testing.assert_allclose(mean.PM2_5_DRY.values, ref, rtol=1e-05)
+try:
+    st.space_mean(ds, weights='population')
+    raise AssertionError('No ValueError for unknown weights.')
+except ValueError:
+    pass
+
+#TEST4: space_subset vs cells within the limits, bounded index cache.
+print('Testing space_subset')
+lat, lon = ds.XLAT.values[0], ds.XLONG.values[0]
+lat_lim = (np.percentile(lat, 25), np.percentile(lat, 75))
+long_lim = (np.percentile(lon, 25), np.percentile(lon, 75))
+subset = st.space_subset(ds[['PM2_5_DRY']], lat_lim, long_lim)
+inside = ((long_lim[0] < lon) & (lon < long_lim[1]) &
+          (lat_lim[0] < lat) & (lat < lat_lim[1]))
+assert subset.PM2_5_DRY.notnull().values[0, 0].sum() == inside.sum()
+np.testing.assert_allclose(np.nansum(subset.PM2_5_DRY.values[0, 0]),
+                           ds.PM2_5_DRY.values[0, 0][inside].sum(), rtol=1e-05)
+for i in range(2 * st.SUBSET_CACHE_SIZE):
+    st.space_subset(ds[['PM2_5_DRY']], (lat_lim[0], lat_lim[1] + i),
+                    long_lim)
+info = st._subset_index_.cache_info()
+assert info.currsize == st.SUBSET_CACHE_SIZE and info.hits > 0
+
+print('All tests passed for statistics!')
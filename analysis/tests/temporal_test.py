@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for functions/temporal.py (daily, monthly and rolling aggregations,
+diurnal composites).
+"""
+
+import tempfile
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import sys
+sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
+from WRFChemToolkit.analysis import temporal as tmp
+from WRFChemToolkit.analysis import synthetic as syn
+
+# synthetic archive, 6 files of 12 hourly steps across a month end.
+data_dir = tempfile.mkdtemp()
+paths = syn.make_archive(data_dir, n_files=6, steps_per_file=12, nx=8, ny=6,
+                         nz=2, chem_opt=202, start='2010-04-30 12:00')
+variables = ['PM2_5_DRY', 'PM10']
+with xr.open_mfdataset(paths) as merged:
+    ds = merged[variables].load()
+ds = ds.assign_coords(Time=ds['XTIME'].values).reset_coords(drop=True)
+ds = ds.astype('float64')
+
+#TEST1: daily, monthly, rolling means and exceedances vs xarray.
+print('Testing temporal aggregations')
+thr = float(ds['PM2_5_DRY'].mean())
+agg = tmp.aggregate_files(paths, variables=variables, keep_rolling=True,
+                          thresholds={'day': ('PM2_5_DRY', 'daily_mean', thr),
+                                      'hour': ('PM10', 'hourly', thr),
+                                      'mda8': ('PM2_5_DRY', 'rolling_8',
+                                               thr)})
+assert not agg.update_file(paths[0])
+
+daily_mean = ds.resample(Time='D').mean()
+daily_max = ds.resample(Time='D').max()
+monthly_mean = ds.resample(Time='MS').mean()
+for n in (24, 8):
+    rolling = ds.rolling(Time=n, min_periods=n).mean()
+    for var in variables:
+        np.testing.assert_allclose(agg.rolling_mean(n)[var].values,
+                                   rolling[var].values, rtol=1e-10)
+        np.testing.assert_allclose(
+            agg.rolling_daily_max(n)[var].values,
+            rolling[var].resample(Time='D').max().values, rtol=1e-10)
+
+for var in variables:
+    np.testing.assert_allclose(agg.daily_mean()[var].values,
+                               daily_mean[var].values, rtol=1e-10)
+    np.testing.assert_allclose(agg.daily_max()[var].values,
+                               daily_max[var].values, rtol=1e-10)
+    np.testing.assert_allclose(agg.monthly_mean()[var].values,
+                               monthly_mean[var].values, rtol=1e-10)
+np.testing.assert_array_equal(agg.daily_mean()['Time'].values,
+                              daily_mean['Time'].values)
+assert agg.daily_mean()['PM10'].attrs['units'] == 'ug m-3'
+
+counts = agg.exceedances()
+np.testing.assert_array_equal(
+    counts['day'].values, (daily_mean['PM2_5_DRY'] > thr).sum('Time').values)
+np.testing.assert_array_equal(
+    counts['hour'].values, (ds['PM10'] > thr).sum('Time').values)
+rolling = ds['PM2_5_DRY'].rolling(Time=8, min_periods=8).mean()
+np.testing.assert_array_equal(counts['mda8'].values,
+                              (rolling > thr).sum('Time').values)
+
+#TEST2: errors.
+print('Testing temporal aggregation errors')
+try:
+    tmp.TemporalAggregator(thresholds={'x': ('PM10', 'rolling_3', 1.)})
+    raise AssertionError('Unknown metric accepted.')
+except ValueError:
+    pass
+with xr.open_dataset(paths[0]) as first:
+    try:
+        agg.update(first)
+        raise AssertionError('Times before the last one accepted.')
+    except ValueError:
+        pass
+try:
+    tmp.aggregate_files(paths, variables=variables).rolling_mean(24)
+    raise AssertionError('Rolling means not kept but returned.')
+except ValueError:
+    pass
+
+#TEST3: completeness threshold of days and months.
+print('Testing temporal aggregation completeness')
+# a column with only 4 valid hours on 2010-05-01.
+gaps = ds.copy(deep=True)
+gaps['PM10'][12:32, :, 2, 3] = np.nan
+agg = tmp.TemporalAggregator(variables=variables, min_fraction=0.75)
+full = tmp.TemporalAggregator(variables=variables)
+for path in paths:
+    with xr.open_dataset(path) as part:
+        part = part.assign_coords(Time=part['XTIME'].values)
+        part['PM10'] = part['PM10'].astype('float64').copy(
+            data=gaps['PM10'].sel(Time=part['Time'].values).values)
+        agg.update(part)
+        full.update(part)
+agg.finish()
+full.finish()
+
+counts = gaps.resample(Time='D').count()
+for var in variables:
+    ref = gaps[var].resample(Time='D').mean().where(counts[var] >= 18)
+    np.testing.assert_allclose(agg.daily_mean()[var].values, ref.values,
+                               rtol=1e-10)
+    ref = gaps[var].resample(Time='D').max().where(counts[var] >= 18)
+    np.testing.assert_allclose(agg.daily_max()[var].values, ref.values,
+                               rtol=1e-10)
+# first and last days (12 hours) and the months are incomplete.
+assert agg.daily_mean()['PM10'][[0, -1]].isnull().all()
+assert np.isnan(agg.daily_mean()['PM10'].values[1, 0, 2, 3])
+assert agg.monthly_mean()['PM10'].isnull().all()
+# by default, any valid hour gives a mean.
+np.testing.assert_allclose(full.daily_mean()['PM10'].values,
+                           gaps['PM10'].resample(Time='D').mean().values,
+                           rtol=1e-10)
+assert not np.isnan(full.daily_mean()['PM10'].values[1, 0, 2, 3])
+
+#TEST4: diurnal composites vs groupby of the local hour.
+print('Testing diurnal composites')
+local = ds.assign_coords(Time=ds['Time'].values + pd.Timedelta(hours=5.5))
+hourly = local.groupby('Time.hour').mean()
+agg = tmp.DiurnalAggregator(variables=variables, timezone=5.5)
+for path in paths:
+    assert agg.update_file(path)
+assert not agg.update_file(paths[0])
+out = agg.composite()
+for var in variables:
+    np.testing.assert_allclose(out[var].values, hourly[var].values,
+                               rtol=1e-06)
+np.testing.assert_array_equal(agg.composite('count')['PM10'].values[:, 0, 0, 0],
+                              local['Time.hour'].to_series()
+                              .value_counts().sort_index().values)
+
+# solar time from XLONG: a different offset in each column.
+out = tmp.diurnal_files(paths, variables=['PM10'])
+with xr.open_dataset(paths[0]) as first:
+    lon = first['XLONG'].values[0]
+for j, i in [(0, 0), (5, 7)]:
+    offset = pd.Timedelta(hours=((lon[j, i] + 180.) % 360. - 180.) / 15.)
+    x = ds['PM10'][:, 0, j, i].to_series()
+    hours = (x.index + offset).hour
+    ref = x.groupby(hours).mean().reindex(range(24))
+    np.testing.assert_allclose(out['PM10'].values[:, 0, j, i], ref.values,
+                               rtol=1e-06)
+
+print('All tests passed for temporal!')
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for functions/writer.py functions (NetCDF4 writer).
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import xarray as xr
+
+import sys
+sys.path.append('/exports/csce/datastore/geos/users/s1878599/python_code/')
+from WRFChemToolkit.analysis import aerosols_202 as ar202
+from WRFChemToolkit.analysis import synthetic as syn
+from WRFChemToolkit.analysis import writer as wrt
+
+out_dir = tempfile.mkdtemp()
+ds = syn.make_wrfout(chem_opt=202)
+ds_aer = ar202.get_aerosols(ds)[['pm25_tot', 'pm10_tot', 'pm25_SOA']]
+
+#TEST1: compressed output with chunks of the presets.
+print('Testing write')
+for preset in wrt.PRESETS:
+    path = os.path.join(out_dir, 'aer_%s.nc' % preset)
+    assert wrt.write(ds_aer, path, preset=preset) == ds.sizes['Time']
+    with xr.open_dataset(path) as stored:
+        xr.testing.assert_identical(stored.load(), ds_aer)
+        enc = stored.pm25_tot.encoding
+        assert enc['zlib']
+        assert enc['chunksizes'][0] == wrt.PRESETS[preset]['Time']
+
+#TEST2: append along the (unlimited) time dimension, skipping the times
+# already stored.
+print('Testing append')
+path = os.path.join(out_dir, 'aer_append.nc')
+wrt.write(ds_aer.isel(Time=slice(0, 4)), path)
+assert wrt.write(ds_aer.isel(Time=slice(2, 6)), path, append=True) == 2
+assert wrt.write(ds_aer.isel(Time=slice(2, 6)), path, append=True) == 0
+with xr.open_dataset(path) as stored:
+    xr.testing.assert_identical(stored.load(), ds_aer)
+
+#TEST3: int16 packing, also when appending.
+print('Testing packing')
+path = os.path.join(out_dir, 'aer_pack.nc')
+wrt.write(ds_aer.isel(Time=slice(0, 3)), path, pack=True)
+wrt.write(ds_aer.isel(Time=slice(3, 6)), path, append=True)
+with xr.open_dataset(path) as stored:
+    assert stored.pm25_tot.encoding['dtype'] == np.int16
+    for var in ds_aer.data_vars:
+        values = ds_aer[var].values
+        scale = stored[var].encoding['scale_factor']
+        # values of the appended steps out of the packed range are clipped.
+        vmin = stored[var].encoding['add_offset'] - 32766 * scale
+        vmax = stored[var].encoding['add_offset'] + 32767 * scale
+        np.testing.assert_allclose(stored[var].values,
+                                   np.clip(values, vmin, vmax),
+                                   atol=scale)
+    np.testing.assert_array_equal(stored.XTIME.values, ds_aer.XTIME.values)
+
+print('All tests passed for writer!')
@@ -9,8 +9,16 @@ Created on Mon Feb  3 15:35:57 2020
 """
 
 
+import numpy as np
 import xarray as xr
 
+from WRFChemToolkit.analysis import profiling as prf
+
+
+# WRF coordinates variables.
+WRF_COORDS = ['Times', 'XTIME', 'XLAT', 'XLONG', 'XLAT_U', 'XLONG_U', 
+              'XLAT_V', 'XLONG_V']
+
 
 def _sum_(*args):
     """
@@ -24,6 +32,7 @@ def _sum_(*args):
     return sum
 
 
+@prf.profiled
 def _get_data_subset_(ds, var_list):
     
     """
@@ -50,6 +59,259 @@ def _get_data_subset_(ds, var_list):
         
     return subset
 
+@prf.profiled
+def sum_bins(ds, species, cutoffs, conversion='ALT'):
+    """
+    Add to dataset the size-bin sums of each aerosol species in ug m-3.
+    Species are reduced one at a time, each size in a single pass over its 
+    bins dividing once by the conversion (see fused_sum), so that no 
+    species x bin array is built.
+    E.g. cutoffs={'pm25': 3, 'pm10': 4} adds pm25_<sp> (bins 1-3) and 
+    pm10_<sp> (bins 1-4).
+
+    :param ds: WRF-chem output.
+    :type ds: xarray DataSet.
+    :param species: aerosol species names (without bin suffix).
+    :type species: list of strings.
+    :param cutoffs: number of bins summed up for each output prefix.
+    :type cutoffs: dict.
+    :param conversion: name of the inverse density variable. Default 'ALT'.
+    :type conversion: string.
+
+    """
+    
+    for sp in species:
+        for prefix in sorted(cutoffs, key=cutoffs.get):
+            bins = [sp + '_a%02d' % b for b in range(1, cutoffs[prefix] + 1)]
+            ds[prefix + '_' + sp] = fused_sum(ds, bins, conversion=conversion)
+            ds[prefix + '_' + sp].attrs['units'] = 'ug m-3'
+        
+
+def _fused_sum_kernel_(*arrays, divide=False):
+    """
+    Utility function to sum numpy arrays in a single output buffer and 
+    optionally divide the sum by the last array. Uses numexpr (blocked, 
+    multi-threaded, single pass) if available, otherwise in-place numpy 
+    operations without intermediate temporaries.
+    """
+    
+    if divide:
+        arrays, conversion = arrays[:-1], arrays[-1]
+    
+    try:
+        import numexpr as ne
+    except ImportError:
+        ne = None
+    
+    if ne is not None:
+        # numexpr has a limit on the number of operands per expression.
+        out = None
+        for i in range(0, len(arrays), 30):
+            names = ['a%d' % j for j in range(len(arrays[i:i + 30]))]
+            local = dict(zip(names, arrays[i:i + 30]))
+            expr = '+'.join(names)
+            if out is not None:
+                local['out'] = out
+                expr = 'out+' + expr
+            if divide and i + 30 >= len(arrays):
+                local['conv'] = conversion
+                expr = '(' + expr + ')/conv'
+            out = ne.evaluate(expr, local_dict=local, out=out)
+        return out
+    
+    dtype = np.result_type(*arrays, *([conversion] if divide else []))
+    out = np.array(arrays[0], dtype=dtype, copy=True)
+    for a in arrays[1:]:
+        np.add(out, a, out=out)
+    if divide:
+        np.divide(out, conversion, out=out)
+    
+    return out
+
+
+@prf.profiled
+def fused_sum(ds, var_list, conversion=None):
+    """
+    Sum up dataset variables in a single pass over memory, optionally 
+    dividing the total once by a conversion variable (e.g. inverse density 
+    'ALT' to get ug m-3). Dask-backed datasets are computed chunk-wise.
+
+    :param ds: WRF-chem output.
+    :type ds: xarray DataSet.
+    :param var_list: list of variables name to sum up.
+    :type var_list: list of strings.
+    :param conversion: name of the variable to divide the sum by. 
+     Default no conversion.
+    :type conversion: string.
+    
+    :return: sum of the variables.
+    :rtype: xarray DataArray.
+
+    """
+    
+    args = [ds[var] for var in var_list]
+    if conversion is not None:
+        args.append(ds[conversion])
+    
+    return xr.apply_ufunc(_fused_sum_kernel_, *args, 
+                          kwargs={'divide': conversion is not None},
+                          dask='parallelized', 
+                          output_dtypes=[np.result_type(
+                              *[a.dtype for a in args])])
+    
+
+def _get_paths_(data_path):
+    """
+    Utility function to get the sorted list of files from a path (with 
+    wildcards) or a list of paths. Paths without wildcards and remote URLs
+    (e.g. OPeNDAP) are returned unchanged.
+    """
+    import glob
+    import os
+    
+    if isinstance(data_path, (str, os.PathLike)):
+        data_path = os.fspath(data_path)
+        if '://' in data_path or not glob.has_magic(data_path):
+            return [data_path]
+        return sorted(glob.glob(data_path))
+    
+    return [os.fspath(path) for path in data_path]
+
+
+def get_file_identity(path, identity='stat'):
+    
+    """
+    Utility function to identify a file, e.g. to know if it was modified 
+    (cache entries, checkpoints).
+
+    :param path: path to the file.
+    :type path: string
+    :param identity: 'stat' (size and mtime) or 'hash' (sha1 of the 
+     content). Default 'stat'.
+    :type identity: string
+    
+    :return: (absolute path, size, mtime) or (absolute path, size, sha1).
+    :rtype: list.
+
+    """
+    import os
+    import hashlib
+    
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    
+    if identity == 'hash':
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**24), b''):
+                sha.update(block)
+        return [path, stat.st_size, sha.hexdigest()]
+    
+    return [path, stat.st_size, stat.st_mtime]
+
+
+@prf.profiled
+def _get_drop_list_(data_path, var_list):
+    
+    """
+    Utility function to get the variables of WRF-Chem output files not in 
+    a list of selected variables (WRF and dimension coordinates are always 
+    kept), reading only the header of the first file.
+
+    :param data_path: path to data files.
+    :type data_path: string or list of strings.
+    :param var_list: list of variables name to keep.
+    :type var_list: list of strings.
+    
+    :return: variables name to drop.
+    :rtype: list of strings.
+
+    """
+    
+    keep = set(var_list) | set(WRF_COORDS)
+    paths = _get_paths_(data_path)
+    if not paths:
+        raise ValueError('No data files match %s.' % (data_path,))
+    first = paths[0]
+    
+    try:
+        import netCDF4
+        with netCDF4.Dataset(first) as nc:
+            names = list(nc.variables)
+            keep.update(nc.dimensions)
+    except ImportError:
+        with xr.open_dataset(first, decode_cf=False) as ds:
+            names = list(ds.variables)
+            keep.update(ds.dims)
+    
+    return [name for name in names if name not in keep]
+
+
+def select_levels(ds, levels=None, level_dim='bottom_top'):
+    
+    """
+    Utility function to select vertical levels of a dataset (e.g. levels=0 
+    for surface analyses). The level dimension is kept (with size 1 for a 
+    single level). A level or contiguous levels are selected with a slice, 
+    so that on lazily opened datasets only that hyperslab is read from 
+    disk; other lists of levels are read as the slice between the first 
+    and the last one, then subset.
+
+    :param ds: WRF-chem output.
+    :type ds: xarray DataSet.
+    :param levels: level index, list of indices or slice. Default None 
+     (all levels).
+    :type levels: integer, list of integers or slice.
+    :param level_dim: name of the vertical dimension. Default 'bottom_top'.
+    :type level_dim: string
+    
+    :return: dataset on the selected levels.
+    :rtype: xarray DataSet.
+
+    """
+    
+    if levels is None or level_dim not in ds.dims:
+        return ds
+    
+    if isinstance(levels, (int, np.integer)):
+        levels = [int(levels)]
+    
+    if not isinstance(levels, slice):
+        nz = ds.sizes[level_dim]
+        levels = [int(l) % nz for l in levels]
+        start, stop = min(levels), max(levels) + 1
+        if levels == list(range(start, stop)):
+            levels = slice(start, stop)
+        else:
+            ds = ds.isel({level_dim: slice(start, stop)})
+            levels = [l - start for l in levels]
+    
+    return ds.isel({level_dim: levels})
+
+
+def _get_latlon_(ds):
+    """
+    Utility function to get the 2D (south_north, west_east) XLAT and XLONG 
+    arrays of a WRF-Chem output (first time step), and a key identifying 
+    the grid for caching.
+    """
+    import hashlib
+    
+    latlon = []
+    for name in ('XLAT', 'XLONG'):
+        coord = ds[name]
+        for dim in coord.dims:
+            if dim not in ('south_north', 'west_east'):
+                coord = coord.isel({dim: 0})
+        latlon.append(np.ascontiguousarray(
+            coord.transpose('south_north', 'west_east').values))
+    
+    lat, lon = latlon
+    key = hashlib.sha1(lat.tobytes() + lon.tobytes()).hexdigest()
+    
+    return lat, lon, key
+
+
 def get_tot_pressure(ds):
      """
      Add the total pressure [Pa] from base pressure and perturbation pressure.
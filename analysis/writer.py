@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Writer (NetCDF4) of derived products, e.g. aerosols datasets from
+aerosols_201/202.get_aerosols or statistics outputs.
+
+Variables are written compressed (zlib), optionally packed (int16 with
+scale_factor and add_offset) or quantized, with chunks from a preset:
+
+ - 'map': a chunk for each time step (whole domain), for reading maps.
+ - 'timeseries': small spatial tiles with many time steps, for reading
+   time series at points or regions.
+
+The time dimension is unlimited, so that new time steps can be appended
+to an existing file without rewriting it.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from WRFChemToolkit.analysis import profiling as prf
+
+
+# chunk sizes by dimension (other dimensions are not chunked).
+PRESETS = {'map': {'Time': 1, 'bottom_top': 1},
+           'timeseries': {'Time': 720, 'bottom_top': 1,
+                          'south_north': 16, 'west_east': 16}}
+
+# int16 packing: values in [-32766, 32767], -32767 is the fill value.
+_PACK_FILL = -32767
+_PACK_RANGE = 65533
+
+
+def _get_chunks_(var, preset, time_dim):
+    """
+    Chunk sizes of a variable for a preset. Chunks are at most the
+    dimension length, except for the (unlimited) time dimension.
+    """
+    sizes = dict(PRESETS[preset])
+    sizes[time_dim] = sizes.pop('Time')
+
+    chunks = []
+    for dim, length in zip(var.dims, var.shape):
+        size = sizes.get(dim, length)
+        if dim != time_dim:
+            size = min(size, length)
+        chunks.append(max(int(size), 1))
+
+    return tuple(chunks)
+
+
+def _get_packing_(values):
+    """
+    scale_factor and add_offset of int16 packing for the range of values.
+    """
+    vmin, vmax = np.nanmin(values), np.nanmax(values)
+    scale = (vmax - vmin) / _PACK_RANGE if vmax > vmin else 1.
+
+    return dict(dtype='int16', _FillValue=_PACK_FILL,
+                scale_factor=float(scale),
+                add_offset=float(vmin + 32766 * scale))
+
+
+@prf.profiled
+def get_encoding(ds, preset='map', complevel=4, shuffle=True, pack=False,
+                 least_significant_digit=None, time_dim='Time'):
+    """
+    Encoding (compression, chunks, packing) of the variables of a dataset
+    for to_netcdf.
+
+    :param ds: dataset to write.
+    :type ds: xarray.Dataset
+    :param preset: chunk preset, 'map' or 'timeseries'. Default 'map'.
+    :type preset: string
+    :param complevel: zlib compression level (0 no compression).
+     Default 4.
+    :type complevel: integer
+    :param shuffle: HDF5 shuffle filter. Default True.
+    :type shuffle: bool
+    :param pack: pack data variables in int16 (scale_factor and
+     add_offset from the range of the data), or list of variables to
+     pack. Default False.
+    :type pack: bool or list of strings.
+    :param least_significant_digit: quantize data variables to this
+     number of decimal digits. Default None (no quantization).
+    :type least_significant_digit: integer
+    :param time_dim: name of the time dimension. Default 'Time'.
+    :type time_dim: string
+    :return: variable -> encoding.
+    :rtype: dict
+    """
+    if preset not in PRESETS:
+        raise ValueError('Unknown preset %s, use one of %s.'
+                         % (preset, sorted(PRESETS)))
+
+    if pack is True:
+        pack = list(ds.data_vars)
+    pack = pack or []
+
+    encoding = {}
+    for name, var in ds.variables.items():
+        if var.dtype.kind == 'M':
+            # explicit units: inferred ones may not fit all the time steps
+            # (e.g. hourly steps of merged files in days).
+            encoding[name] = dict(units='seconds since 1970-01-01 00:00:00',
+                                  dtype='int64')
+            continue
+        if var.ndim == 0 or var.dtype.kind not in 'fiu':
+            continue
+
+        enc = dict(zlib=complevel > 0, complevel=complevel, shuffle=shuffle,
+                   chunksizes=_get_chunks_(var, preset, time_dim))
+
+        if name in ds.data_vars and var.dtype.kind == 'f':
+            if name in pack:
+                enc.update(_get_packing_(var.values))
+            elif least_significant_digit is not None:
+                enc['least_significant_digit'] = least_significant_digit
+
+        encoding[name] = enc
+
+    return encoding
+
+
+def _get_time_var_(ds, time_dim):
+    """
+    Name of the time coordinate (datetime along time_dim only), or None.
+    """
+    for name in [time_dim, 'XTIME'] + list(ds.coords):
+        if (name in ds.variables and ds[name].dims == (time_dim,)
+                and ds[name].dtype.kind == 'M'):
+            return name
+
+    return None
+
+
+@prf.profiled
+def write(ds, path, preset='map', complevel=4, shuffle=True, pack=False,
+          least_significant_digit=None, time_dim='Time', append=False):
+    """
+    Write a dataset to a NetCDF4 file, or append its time steps to an
+    existing file. New files are written through a temporary file, so
+    that no partial output is left.
+
+    When appending, only the variables along time_dim are written, after
+    the time steps already in the file; time steps already in the file
+    (same time coordinate) are skipped. Encoding (packing, chunks) is the
+    one of the existing file: packed values out of its range are clipped.
+
+    :param ds: dataset to write.
+    :type ds: xarray.Dataset
+    :param path: output file.
+    :type path: string
+    :param preset: chunk preset, 'map' or 'timeseries'. Default 'map'.
+    :type preset: string
+    :param complevel: zlib compression level. Default 4.
+    :type complevel: integer
+    :param shuffle: HDF5 shuffle filter. Default True.
+    :type shuffle: bool
+    :param pack: pack data variables in int16, or list of variables to
+     pack. Default False.
+    :type pack: bool or list of strings.
+    :param least_significant_digit: quantize data variables to this
+     number of decimal digits. Default None.
+    :type least_significant_digit: integer
+    :param time_dim: name of the time dimension. Default 'Time'.
+    :type time_dim: string
+    :param append: append to path if it exists. Default False.
+    :type append: bool
+    :return: number of time steps written (0 if no time_dim).
+    :rtype: integer
+    """
+    if append and os.path.exists(path):
+        return _append_(ds, path, time_dim)
+
+    encoding = get_encoding(ds, preset, complevel, shuffle, pack,
+                            least_significant_digit, time_dim)
+    unlimited = [time_dim] if time_dim in ds.dims else None
+
+    ds.to_netcdf(path + '.tmp', format='NETCDF4', engine='netcdf4',
+                 encoding=encoding, unlimited_dims=unlimited)
+    os.replace(path + '.tmp', path)
+
+    return ds.sizes.get(time_dim, 0)
+
+
+def _append_(ds, path, time_dim):
+    """
+    Append the time steps of a dataset to an existing file.
+    """
+    import netCDF4
+
+    if time_dim not in ds.dims:
+        raise ValueError('Dataset has no %s dimension to append.' % time_dim)
+
+    # skip time steps already in the file.
+    time_var = _get_time_var_(ds, time_dim)
+    if time_var is not None:
+        with xr.open_dataset(path) as stored:
+            if time_var in stored.variables:
+                done = np.isin(ds[time_var].values, stored[time_var].values)
+                ds = ds.isel({time_dim: ~done})
+
+    n_new = ds.sizes[time_dim]
+    if n_new == 0:
+        return 0
+
+    with netCDF4.Dataset(path, 'a') as nc:
+        if time_dim not in nc.dimensions:
+            raise ValueError('%s has no %s dimension.' % (path, time_dim))
+        n_old = nc.dimensions[time_dim].size
+
+        for name, var in ds.variables.items():
+            if time_dim not in var.dims:
+                continue
+            if name not in nc.variables:
+                raise ValueError('Variable %s not in %s.' % (name, path))
+
+            ncvar = nc.variables[name]
+            values = var.transpose(*[dim for dim in ncvar.dimensions
+                                     if dim in var.dims]).values
+
+            if values.dtype.kind in 'SU':
+                values = netCDF4.stringtochar(values.astype('S%d'
+                                              % ncvar.shape[-1]))
+            elif values.dtype.kind == 'M':
+                times = pd.to_datetime(values.ravel()).to_pydatetime()
+                values = netCDF4.date2num(
+                    times, ncvar.units,
+                    calendar=getattr(ncvar, 'calendar', 'standard'))
+                values = np.reshape(values, var.shape)
+            elif 'scale_factor' in ncvar.ncattrs():
+                scale = ncvar.scale_factor
+                offset = getattr(ncvar, 'add_offset', 0.)
+                values = np.clip(values, offset - 32766 * scale,
+                                 offset + 32767 * scale)
+            if values.dtype.kind == 'f':
+                values = np.ma.masked_invalid(values)
+
+            index = tuple(slice(n_old, n_old + n_new) if dim == time_dim
+                          else slice(None) for dim in ncvar.dimensions)
+            ncvar[index] = values
+
+    return n_new